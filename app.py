@@ -1,7 +1,10 @@
+import asyncio
 import base64
 import functools
 import json
 import logging
+from collections import OrderedDict
+from typing import *
 
 import jinja2
 from aiohttp import WSMsgType, web
@@ -9,9 +12,17 @@ from aiohttp_session import Session, get_session, new_session, setup
 from aiohttp_session.cookie_storage import EncryptedCookieStorage
 from cryptography import fernet
 
+from bot import Bot
+from game_record import GameArchive
 from game_room import GameRoom
-from rsa_util import RsaUtil
-from storage import Storage, User, UserValidationError
+from lobby import SORTS, LobbyBroadcaster
+from metrics import install as install_metrics, render as render_metrics, sample_loop_lag
+from player_manager import encode_frame
+from crypto_executor import CryptoExecutor
+from room_log import ActionJournal
+from sharding import RoomRegistry, new_room_id, shard_for
+from static_assets import StaticAssets
+from storage import AsyncStorage, User, UserValidationError
 
 
 def auto_404(request_handler):
@@ -50,12 +61,49 @@ def login_required(request_handler):
     return wrapper
 
 
+def load_secret_key() -> bytes:
+    try:
+        with open('secret_key', 'rb') as fp:
+            return fp.read()
+    except OSError:
+        fernet_key = fernet.Fernet.generate_key()
+        secret_key = base64.urlsafe_b64decode(fernet_key)
+        with open('secret_key', 'wb') as fp:
+            fp.write(secret_key)
+        return secret_key
+
+
 class WallGameApp(web.Application):
-    def __init__(self, **kwargs) -> None:
+    page_cache_size = 256
+
+    def __init__(self, shard: int = 0, shards: int = 1,
+                 registry: Optional[RoomRegistry] = None,
+                 journal_dir: Optional[str] = None,
+                 archive: Optional[str] = None, metrics: bool = False, **kwargs) -> None:
+        """
+        多进程部署时，shard 为本进程的序号，shards 为进程总数，
+        registry 为各进程共享的房间列表，见 sharding 模块。
+        journal_dir 为房间操作日志的目录，默认为 None，不记录日志，重启后房间不会恢复。
+        archive 为对局归档文件，见 game_record 模块，默认为 None，不记录结束的对局。
+        metrics 为真时统计各个阶段的耗时，在 /metrics 输出，见 metrics 模块
+        """
         super().__init__(**kwargs)
+        self.shard = shard
+        self.shards = shards
+        if registry is not None:
+            GameRoom.registry = registry
+        if journal_dir is not None:
+            GameRoom.journal = ActionJournal(journal_dir)
+            self.on_startup.append(self._restore_rooms)
+            self.on_cleanup.append(GameRoom.journal.stop)
+        if archive is not None:
+            GameRoom.archive = GameArchive(archive)
+            self.on_cleanup.append(GameRoom.archive.close)
         self.add_routes([
             web.static('/static/', './static/'),
             web.get('/', self.main_handler, name='list_rooms'),
+            web.get('/lobby.json', self.lobby_handler, name='lobby'),
+            web.get('/lobby/ws/', self.lobby_websocket_handler, name='lobby_ws'),
             web.route('*', '/new/', self.new_handler, name='create_room'),
             web.route('*', '/login/', self.login_handler, name='login'),
             web.route('*', '/register/',
@@ -65,40 +113,125 @@ class WallGameApp(web.Application):
             web.get('/logout/', self.logout_handler, name='logout'),
             web.get('/{room}/', self.room_handler, name='room_page'),
             web.get('/{room}/ws/', self.websocket_handler, name='room_ws'),
+            web.post('/{room}/add-bot/', self.add_bot_handler, name='add_bot'),
         ])
 
-        try:
-            with open('secret_key', 'rb') as fp:
-                secret_key = fp.read()
-        except OSError:
-            fernet_key = fernet.Fernet.generate_key()
-            secret_key = base64.urlsafe_b64decode(fernet_key)
-            with open('secret_key', 'wb') as fp:
-                fp.write(secret_key)
-        setup(self, EncryptedCookieStorage(secret_key))
+        setup(self, EncryptedCookieStorage(load_secret_key()))
 
+        # 编译后的模板缓存在临时目录中，重启时不需要重新编译；启动时加载所有模板
         self.env = jinja2.Environment(loader=jinja2.FileSystemLoader('./templates'),
+                                      bytecode_cache=jinja2.FileSystemBytecodeCache(),
                                       autoescape=True)
+        self.assets = StaticAssets()
+        self.env.globals['static_url'] = self.assets.url
+        self.on_response_prepare.append(self.assets.on_response_prepare)
+        for name in self.env.list_templates():
+            self.env.get_template(name)
+        # (模板, cache_key) -> (模板对象, 页面)，见 render
+        self._pages: OrderedDict = OrderedDict()
+
+        self.lobby = LobbyBroadcaster(GameRoom.registry)
+        self.on_startup.append(self.lobby.start)
+        self.on_cleanup.append(self.lobby.stop)
+
+        # RSA 解密和密码哈希在进程池中执行
+        self.crypto = CryptoExecutor()
+        self.storage = AsyncStorage()
+        self.on_cleanup.append(self._close_storage)
+        self.on_cleanup.append(self._shutdown_bots)
+
+        self._lag_task: Optional[asyncio.Task] = None
+        if metrics:
+            install_metrics()
+            self.router.add_get('/metrics', self.metrics_handler, name='metrics')
+            self.on_startup.append(self._start_lag_sampler)
+            self.on_cleanup.append(self._stop_lag_sampler)
+
+    async def _start_lag_sampler(self, app):
+        self._lag_task = asyncio.create_task(sample_loop_lag())
+
+    async def _stop_lag_sampler(self, app):
+        self._lag_task.cancel()
 
-        self.rsa = RsaUtil()
-        self.storage = Storage()
+    async def metrics_handler(self, request: web.Request):
+        return web.Response(text=render_metrics(), content_type='text/plain',
+                            headers={'Cache-Control': 'no-store'})
 
-    def render(self, template, /, **kwargs):
-        return web.Response(
-            body=self.env.get_template(template).render(**kwargs),
-            content_type='text/html'
-        )
+    async def _restore_rooms(self, app):
+        rooms = GameRoom.restore(
+            GameRoom.journal, lambda room_id: shard_for(room_id, self.shards) == self.shard)
+        logging.info('restored %d rooms', len(rooms))
+        await GameRoom.journal.start()
+
+    async def _close_storage(self, app):
+        await self.storage.close()
+        self.crypto.shutdown()
+
+    async def _shutdown_bots(self, app):
+        Bot.shutdown()
+
+    def render(self, template, /, cache_key: Optional[Hashable] = None, **kwargs):
+        """
+        cache_key 不为 None 时，页面只由 cache_key 决定，渲染一次后缓存，
+        模板文件修改后重新渲染。最多缓存 page_cache_size 个页面
+        """
+        if cache_key is None:
+            return web.Response(body=self.env.get_template(template).render(**kwargs),
+                                content_type='text/html')
+        key = template, cache_key
+        cached = self._pages.get(key)
+        if cached is not None and cached[0].is_up_to_date:
+            self._pages.move_to_end(key)
+            body = cached[1]
+        else:
+            compiled = self.env.get_template(template)
+            body = compiled.render(**kwargs).encode()
+            self._pages[key] = compiled, body
+            if len(self._pages) > self.page_cache_size:
+                self._pages.popitem(last=False)
+        return web.Response(body=body, content_type='text/html', charset='utf-8')
+
+    @staticmethod
+    def lobby_query(request: web.Request) -> Tuple[int, int, str]:
+        """
+        从查询参数中读取 (page, per_page, sort)
+        """
+        try:
+            page = int(request.query.get('page', 1))
+            per_page = min(max(int(request.query.get('per_page', 20)), 1), 100)
+        except ValueError:
+            raise web.HTTPBadRequest(text='page 和 per_page 必须是整数')
+        sort = request.query.get('sort', 'newest')
+        if sort not in SORTS:
+            raise web.HTTPBadRequest(text=f'sort 必须是 {", ".join(SORTS)} 之一')
+        return page, per_page, sort
 
     @with_session
     async def main_handler(self, request: web.Request, session: Session):
-        available_rooms = {room for room in GameRoom.instances.values()
-                           if room.manager.unregistered_players}
+        lobby = GameRoom.registry.lobby()
+        listing = lobby.open_page(*self.lobby_query(request))
         if user := session.get('user'):
-            joined_rooms = {room for room in GameRoom.instances.values()
-                            if user in room.manager.users_players}
+            joined_rooms = lobby.rooms_of(user)
         else:
-            joined_rooms = {}
-        return self.render('index.html', rooms=available_rooms, joined_rooms=joined_rooms, session=session)
+            joined_rooms = []
+        return self.render('index.html', rooms=listing['rooms'], page=listing['page'],
+                           pages=listing['pages'], joined_rooms=joined_rooms, session=session)
+
+    @with_session
+    async def lobby_handler(self, request: web.Request, session: Session):
+        """
+        大厅的 JSON 版本，支持 If-None-Match，房间列表没有变化时返回 304
+        """
+        lobby = GameRoom.registry.lobby()
+        query = self.lobby_query(request)
+        user = session.get('user', '')
+        etag = lobby.etag(*query, user)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag in request.headers.get('If-None-Match', ''):
+            raise web.HTTPNotModified(headers=headers)
+        listing = lobby.open_page(*query)
+        listing['joined'] = lobby.rooms_of(user) if user else []
+        return web.json_response(listing, headers=headers, dumps=encode_frame)
 
     @with_session
     @login_required
@@ -112,7 +245,8 @@ class WallGameApp(web.Application):
                 size = int(size)
                 positions = json.loads(player_positions)
                 if 2 <= size <= 20 and name.strip() and len(positions) >= 2:
-                    room = GameRoom(size, name, positions)
+                    room = GameRoom(size, name, positions,
+                                    room_id=new_room_id(self.shard, self.shards))
                 else:
                     raise ValueError()
             except ValueError:
@@ -120,14 +254,39 @@ class WallGameApp(web.Application):
             else:
                 raise web.HTTPFound(f'/{room.id}/')
         else:
-            name = ''
-            size = 7
-            error_message = ''
-            player_positions = ''
+            # 空白的表单只与用户名有关
+            return self.render('new.html', cache_key=session['user'], name='', size=7,
+                               error_message='', session=session, player_positions='')
         return self.render('new.html', name=name, size=size,
                            error_message=error_message, session=session,
                            player_positions=player_positions)
 
+    async def lobby_websocket_handler(self, request: web.Request):
+        """
+        推送房间列表的变化，客户端不需要发送消息
+        """
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        queue = self.lobby.subscribe()
+
+        async def pump():
+            try:
+                while True:
+                    await ws.send_str(await queue.get())
+            except ConnectionResetError:
+                # 客户端已经断开，关闭连接，下面的 async for 随之结束
+                await ws.close()
+
+        task = asyncio.create_task(pump())
+        try:
+            async for msg in ws:
+                pass
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            self.lobby.unsubscribe(queue)
+        return ws
+
     @auto_404
     @with_session
     @login_required
@@ -138,6 +297,17 @@ class WallGameApp(web.Application):
         except KeyError:
             raise web.HTTPNotFound()
 
+    @auto_404
+    @with_session
+    @login_required
+    async def add_bot_handler(self, request: web.Request, session: Session):
+        room = GameRoom.instances[request.match_info['room']]
+        try:
+            await room.add_bot()
+        except IndexError:
+            pass
+        raise web.HTTPFound(self.router['room_page'].url_for(room=room.id))
+
     @auto_404
     @with_session
     @login_required
@@ -152,73 +322,78 @@ class WallGameApp(web.Application):
         except KeyError:
             await ws.send_json({'event': 'error', 'message': '房间不存在或游戏已结束'})
             await ws.close()
-            return
+            return ws
         if user not in room.manager.users_sockets:
+            # 先查询符号再选择空位，等待查询期间其他连接可能已占据空位
+            symbol = (await self.storage.get_user(user)).symbol
             try:
                 player = room.manager.unregistered_players[0]
-                player.symbol = self.storage.get_user(user).symbol
+                player.symbol = symbol
                 queue = await room.register_player(user, player, ws)
             except IndexError:
                 await ws.send_json({'event': 'error', 'message': '加入房间失败，可能房间已满！'})
-                return
+                return ws
         else:
             logging.info('someone reconnect')
             try:
                 await room.reconnect(user, ws)
             except ValueError:
                 await ws.send_json({'event': 'error', 'message': '你已进入该房间！'})
-                return
+                return ws
             queue = room.manager.users_queues[user]
 
         async for msg in ws:
             if msg.type == WSMsgType.TEXT:
-                await queue.put(json.loads(msg.data))
+                data = json.loads(msg.data)
+                if data.get('resync'):
+                    await room.resync(user)
+                else:
+                    await queue.put(data)
 
-        return
+        return ws
 
     async def login_handler(self, request: web.Request):
         if request.method == 'POST':
             post = await request.post()
             username = post['username']
             password_encrypted = post['password_encrypted']
-            password = self.rsa.decrypt_by_private_key(password_encrypted)
+            password = await self.crypto.decrypt(password_encrypted)
             try:
-                user = self.storage.get_user(username)
+                user = await self.storage.get_user(username)
                 session = await new_session(request)
-                if user.verify_password(password):
+                verified, upgraded = await self.crypto.verify_and_upgrade(user, password)
+                if verified:
                     session['user'] = user.name
-
-                raise web.HTTPFound(request.query.get('next', '/'))
+                    if upgraded:
+                        # 旧算法计算的密码，登录时换成新算法
+                        await self.storage.update_user(user)
+                    raise web.HTTPFound(request.query.get('next', '/'))
             except ValueError:
                 pass
             error_message = '用户名或密码错误'
         else:
-            error_message = ''
-            username = ''
+            return self.render('login.html', cache_key='', username='', error_message='',
+                               session={'user': ''})
         return self.render('login.html', username=username, error_message=error_message, session={'user': ''})
 
     async def register_handler(self, request: web.Request):
         if request.method == 'POST':
             post = await request.post()
-            raw_password = self.rsa.decrypt_by_private_key(
-                post['password_encrypted'])
+            raw_password = await self.crypto.decrypt(post['password_encrypted'])
             try:
                 user = User(post['username'], post['symbol'],
-                            raw_password=raw_password)
-                self.storage.new_user(user)
+                            password=await self.crypto.hash_password(raw_password))
+                await self.storage.new_user(user)
                 session = await new_session(request)
                 session['user'] = user.name
-                session
-                self.storage.save()
                 raise web.HTTPFound(request.query.get('next', '/'))
             except UserValidationError as exc:
                 error_message = exc.args[0]
             username = post['username']
             symbol = post['symbol']
         else:
-            username = ''
-            symbol = ''
-            error_message = ''
+            return self.render('register.html', cache_key='', username='', symbol='',
+                               error_message='', session={'user': ''})
         return self.render('register.html', username=username, symbol=symbol,
                            error_message=error_message, session={'user': ''})
 
@@ -227,19 +402,18 @@ class WallGameApp(web.Application):
     async def edit_profile_handler(self, request: web.Request, session: Session):
         if request.method == 'POST':
             post = await request.post()
-            raw_old_password = self.rsa.decrypt_by_private_key(
-                post['old_password_encrypted'])
-            user = self.storage.get_user(session['user'])
-            if user.verify_password(raw_old_password):
-                if post['password_encrypted']:
-                    raw_new_password = self.rsa.decrypt_by_private_key(
-                        post['password_encrypted'])
-                    user.set_password(raw_new_password)
-                user.symbol = post['symbol']
-                user.name = post['username']
+            raw_old_password = await self.crypto.decrypt(post['old_password_encrypted'])
+            user = await self.storage.get_user(session['user'])
+            if await self.crypto.verify_password(user, raw_old_password):
                 try:
-                    self.storage.update_user(user)
-                    self.storage.save()
+                    if post['password_encrypted']:
+                        raw_new_password = await self.crypto.decrypt(post['password_encrypted'])
+                        await self.crypto.set_password(user, raw_new_password)
+                    elif user.needs_rehash(self.crypto.password_method):
+                        await self.crypto.set_password(user, raw_old_password)
+                    user.symbol = post['symbol']
+                    user.name = post['username']
+                    await self.storage.update_user(user)
                     raise web.HTTPFound('/')
                 except UserValidationError as exc:
                     error_message = exc.args[0]
@@ -248,7 +422,7 @@ class WallGameApp(web.Application):
             username = post['username']
             symbol = post['symbol']
         else:
-            user = self.storage.get_user(session['user'])
+            user = await self.storage.get_user(session['user'])
             username = user.name
             symbol = user.symbol
             error_message = ''
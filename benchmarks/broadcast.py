@@ -0,0 +1,96 @@
+"""
+比较广播 update_game_map 消息的两种方式：
+
+- per-player: 旧的做法，每个玩家各自调用 send_json(data, dumps=json_dumps)
+- encode-once: PlayerManager.send_to_everyone，编码一次后向所有连接发送同一个文本帧
+
+    python -m benchmarks.broadcast --repeat 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from core import Event, Player
+from game_room import GameRoom
+from player_manager import encode_frame, orjson
+
+
+class CustomJsonEncoder(json.JSONEncoder):
+    """
+    旧的做法使用的编码器，只用于对比
+    """
+    def default(self, obj):
+        if isinstance(obj, Event):
+            obj = obj.value
+        elif isinstance(obj, Player):
+            obj = obj.symbol
+        return obj
+
+
+def json_dumps(*args, **kwargs):
+    kwargs['cls'] = CustomJsonEncoder
+    return json.dumps(*args, **kwargs)
+
+
+class NullSocket:
+    closed = False
+
+    def __init__(self) -> None:
+        self.sent = 0
+
+    async def send_json(self, data, dumps):
+        await self.send_str(dumps(data))
+
+    async def send_str(self, data):
+        self.sent += len(data)
+
+
+def make_room(players):
+    size = 20
+    positions = [divmod(i * 397 % (size * size), size) for i in range(players)]
+    room = GameRoom(size, 'benchmark', positions)
+    for i, player in enumerate(room.game.players):
+        room.manager.register_player(f'user{i}', player, NullSocket())
+    del GameRoom.instances[room.id]
+    return room
+
+
+async def per_player(room, data):
+    manager = room.manager
+    await asyncio.gather(*[
+        manager.users_sockets[manager.players_users[player]].send_json(data, dumps=json_dumps)
+        for player in manager.players
+    ])
+
+
+async def encode_once(room, data):
+    await room.manager.send_to_everyone(data)
+
+
+async def measure(method, room, repeat):
+    data = room.update_game_map_message()
+    await method(room, data)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await method(room, data)
+    return (time.perf_counter() - started) / repeat
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+    print(f'encoder: {"orjson" if orjson is not None else "json"}')
+    print(f'{"players":>8} {"per-player":>12} {"encode-once":>12} {"speedup":>8}')
+    for players in (2, 8, 32):
+        room = make_room(players)
+        old = await measure(per_player, room, args.repeat)
+        new = await measure(encode_once, room, args.repeat)
+        print(f'{players:>8} {old * 1e6:>10.1f}us {new * 1e6:>10.1f}us {old / new:>7.2f}x')
+    frame = encode_frame(room.update_game_map_message())
+    print(f'frame size: {len(frame.encode())} bytes')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,405 @@
+"""
+core.WallGame 的微基准测试
+
+    python -m benchmarks.core run --output before.json
+    （修改 core.py）
+    python -m benchmarks.core run --output after.json
+    python -m benchmarks.core compare before.json after.json
+
+每个测试在若干局面上执行。局面由棋盘尺寸、玩家数量和墙的密度决定：
+玩家随机放在不同的格子上，再随机放置 密度 * 内部墙总数 面墙，随机数种子由参数决定，
+所以两次运行使用完全相同的局面。测试的操作：
+
+- update_areas：在局面上再逐面放墙（约内部墙总数的十分之一），每放一面调用一次 update_areas
+- get_reachable_points：每个玩家的可到达位置
+- reachable_points_near：每个格子的相邻格子
+- apply_player_action：依次执行随机的合法动作（不包括更新区域），直到无法继续，最多约 size * size 次
+- territory：与 apply_player_action 相同地执行随机动作，只计每次动作后调用 territory 的时间，
+  即增量更新的开销（第一次完整的计算不计入）
+- playout：从局面开始用随机策略下完整局 game_loop（包括随机策略本身的开销）
+
+每个测试重复 rounds 轮，每轮至少执行 min_time 秒，记录每次调用的平均时间，
+取各轮中的最小值作为结果。各轮交替执行所有测试。虚拟机上 CPU 的速度时快时慢，同一测试相差可达一倍，
+所以每轮前后还执行一段固定的纯 Python 代码作为参照，结果同时以参照的倍数（relative）记录。
+compare 默认比较 relative，变慢超过 threshold 的测试视为退化，存在退化时以状态码 1 退出。
+在单核的虚拟机上两次相同的运行中，95% 的测试 relative 相差不超过 20%，所以 threshold 默认为 0.25，
+在安静的机器上可以用 0.1。
+
+早期的 core.py 没有 legal_actions 和 territory，也不支持 backend 参数。
+这时只能运行 list 实现，依赖这两个方法的测试（见 REQUIRES）被跳过，
+compare 只比较两份结果中都有的测试
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import pickle
+import platform
+import random
+import sys
+import time
+from typing import *
+
+from core import Direction, Event, Player, WallGame
+
+DEFAULT_SIZES = [2, 5, 7, 10, 15, 20]
+DEFAULT_PLAYERS = [2, 4, 8, 16]
+DEFAULT_DENSITIES = [0.0, 0.2, 0.5]
+
+
+# Scenario -> pickle 后的局面
+_positions: Dict['Scenario', bytes] = {}
+
+
+class Scenario(NamedTuple):
+    size: int
+    players: int
+    density: float
+    backend: str
+    seed: int
+
+    @property
+    def name(self) -> str:
+        return f'size={self.size}/players={self.players}/density={self.density}/backend={self.backend}'
+
+    def rng(self, *salt) -> random.Random:
+        return random.Random(f'{self.seed}-{self.size}-{self.players}-{self.density}-{"-".join(map(str, salt))}')
+
+    def game(self) -> WallGame:
+        """
+        局面的一个新副本。第一次构造后保存 pickle 的结果，之后从中复制，比重新放墙快得多
+        """
+        data = _positions.get(self)
+        if data is None:
+            data = _positions[self] = pickle.dumps(self.build())
+        return pickle.loads(data)
+
+    def build(self) -> WallGame:
+        rng = self.rng('game')
+        cells = rng.sample(range(self.size * self.size), self.players)
+        players = [Player(str(i), *divmod(cell, self.size)) for i, cell in enumerate(cells)]
+        if self.backend == 'list':
+            game = WallGame(self.size, players)
+        else:
+            game = WallGame(self.size, players, backend=self.backend)
+        add_random_walls(game, round(self.density * 2 * self.size * (self.size - 1)), rng)
+        game.update_areas()
+        return game
+
+
+def add_random_walls(game: WallGame, count: int, rng: random.Random, update=None) -> int:
+    """
+    随机放置最多 count 面内部墙，每放一面调用一次 update，返回放置的数量
+    """
+    # 每面内部墙都是某个格子下方或右方的墙
+    last = game.size - 1
+    free = [((row, col), direction)
+            for row in range(game.size) for col in range(game.size)
+            for direction in (Direction.down, Direction.right)
+            if not (direction is Direction.down and row == last
+                    or direction is Direction.right and col == last)]
+    rng.shuffle(free)
+    placed = 0
+    for pos, direction in free:
+        if placed >= count:
+            break
+        try:
+            game.put_wall(pos, direction)
+        except ValueError:
+            continue
+        placed += 1
+        if update is not None:
+            update()
+    return placed
+
+
+# 每个测试接受局面，返回 (调用次数, 耗时)，只计入被测试的操作
+
+def bench_update_areas(scenario: Scenario, game: WallGame, rng: random.Random) -> Tuple[int, float]:
+    elapsed = 0.0
+
+    def update():
+        nonlocal elapsed
+        started = time.perf_counter()
+        game.update_areas()
+        elapsed += time.perf_counter() - started
+
+    # 每个局面的准备时间远多于一次更新，所以在同一个局面上多放一些墙
+    calls = add_random_walls(game, max(20, game.size * (game.size - 1) // 5), rng, update)
+    return calls, elapsed
+
+
+def bench_get_reachable_points(scenario: Scenario, game: WallGame, rng: random.Random) -> Tuple[int, float]:
+    players = game.players
+    started = time.perf_counter()
+    for player in players:
+        for _ in game.get_reachable_points(player):
+            pass
+    return len(players), time.perf_counter() - started
+
+
+def bench_reachable_points_near(scenario: Scenario, game: WallGame, rng: random.Random) -> Tuple[int, float]:
+    size = game.size
+    near = game.reachable_points_near
+    started = time.perf_counter()
+    for row in range(size):
+        for col in range(size):
+            for _ in near(row, col):
+                pass
+    return size * size, time.perf_counter() - started
+
+
+def bench_apply_player_action(scenario: Scenario, game: WallGame, rng: random.Random) -> Tuple[int, float]:
+    calls = 0
+    elapsed = 0.0
+    for _ in range(max(10, game.size * game.size // len(game.players))):
+        before = calls
+        for player in game.players:
+            actions = game.legal_actions(player)
+            if not actions:
+                continue
+            (row, col), direction = game.decode_action(rng.choice(actions))
+            motions = row - player.row, col - player.col
+            started = time.perf_counter()
+            game.apply_player_action(player, motions, direction)
+            elapsed += time.perf_counter() - started
+            calls += 1
+        if calls == before:
+            break
+    return calls, elapsed
+
+
+def bench_territory(scenario: Scenario, game: WallGame, rng: random.Random) -> Tuple[int, float]:
+    game.territory()
+    calls = 0
+    elapsed = 0.0
+    for _ in range(max(10, game.size * game.size // len(game.players))):
+        before = calls
+        for player in game.players:
+            actions = game.legal_actions(player)
+            if not actions:
+                continue
+            (row, col), direction = game.decode_action(rng.choice(actions))
+            game.apply_player_action(player, (row - player.row, col - player.col), direction)
+            started = time.perf_counter()
+            game.territory()
+            elapsed += time.perf_counter() - started
+            calls += 1
+        if calls == before:
+            break
+    return calls, elapsed
+
+
+def bench_playout(scenario: Scenario, game: WallGame, rng: random.Random) -> Tuple[int, float]:
+    started = time.perf_counter()
+    loop = game.game_loop()
+    reply = None
+    try:
+        while True:
+            event, *args = loop.send(reply)
+            reply = None
+            if event is Event.ask_player_action:
+                player = args[0]
+                actions = game.legal_actions(player)
+                if not actions:
+                    # 随机放置的墙可能把玩家四面围住，实际对局中不会出现。
+                    # 关闭时 game_loop 会打印 GeneratorExit
+                    with contextlib.redirect_stderr(io.StringIO()):
+                        loop.close()
+                    break
+                (row, col), direction = game.decode_action(rng.choice(actions))
+                reply = (row - player.row, col - player.col), direction
+    except StopIteration:
+        pass
+    return 1, time.perf_counter() - started
+
+
+BENCHMARKS: Dict[str, Callable[[Scenario, WallGame, random.Random], Tuple[int, float]]] = {
+    'update_areas': bench_update_areas,
+    'get_reachable_points': bench_get_reachable_points,
+    'reachable_points_near': bench_reachable_points_near,
+    'apply_player_action': bench_apply_player_action,
+    'territory': bench_territory,
+    'playout': bench_playout,
+}
+# 会修改局面的测试每次使用新的局面，其余的测试在一轮中共用同一个局面
+MUTATING = {bench_update_areas, bench_apply_player_action, bench_territory, bench_playout}
+# 测试依赖的 WallGame 方法，随机动作由 legal_actions 产生
+REQUIRES = {
+    'apply_player_action': ('legal_actions', 'decode_action'),
+    'territory': ('legal_actions', 'decode_action', 'territory'),
+    'playout': ('legal_actions', 'decode_action'),
+}
+
+
+def available(name: str) -> bool:
+    return all(hasattr(WallGame, attr) for attr in REQUIRES.get(name, ()))
+
+
+def _reference_workload():
+    counts = {}
+    for i in range(2000):
+        counts[i & 63] = counts.get(i & 63, 0) + i
+
+
+def reference_time(repeat: int = 5) -> float:
+    """
+    参照代码的执行时间（微秒），取 repeat 次中的最小值
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        _reference_workload()
+        best = min(best, time.perf_counter() - started)
+    return best * 1e6
+
+
+def measure_round(bench, scenario: Scenario, round_index: int, min_time: float) -> Optional[Tuple[float, float]]:
+    """
+    一轮测试，至少计时 min_time 秒，返回每次调用的平均时间（微秒）和它相对于参照代码的倍数，
+    没有执行任何调用时返回 None
+    """
+    # 与 timeit 相同，计时期间关闭垃圾回收
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        reference = reference_time()
+        rng = scenario.rng(bench.__name__, round_index)
+        calls = 0
+        elapsed = 0.0
+        game = scenario.game()
+        while elapsed < min_time:
+            if bench in MUTATING and calls:
+                game = scenario.game()
+            more_calls, more_elapsed = bench(scenario, game, rng)
+            if not more_calls:
+                break
+            calls += more_calls
+            elapsed += more_elapsed
+        reference = min(reference, reference_time())
+    finally:
+        if gc_enabled:
+            gc.enable()
+    if not calls:
+        return None
+    per_call = elapsed / calls * 1e6
+    return per_call, per_call / reference
+
+
+def scenarios(args) -> Iterator[Scenario]:
+    for backend in args.backends:
+        for size in args.sizes:
+            for players in args.players:
+                # 至少留一个空格子
+                if players >= size * size:
+                    continue
+                for density in args.densities:
+                    yield Scenario(size, players, density, backend, args.seed)
+
+
+def run(args):
+    # 每轮依次执行所有测试，同一测试的各轮分散在整个运行期间，不会都落在 CPU 较慢的一段时间里
+    samples: Dict[str, List[Tuple[float, float]]] = {}
+    names = [name for name in args.benchmarks if available(name)]
+    skipped = [name for name in args.benchmarks if name not in names]
+    if skipped and not args.quiet:
+        print(f'skipped {", ".join(skipped)}: WallGame has no '
+              f'{", ".join(sorted({attr for name in skipped for attr in REQUIRES[name]} - set(dir(WallGame))))}',
+              file=sys.stderr)
+    for round_index in range(args.rounds):
+        for scenario in scenarios(args):
+            for name in names:
+                sample = measure_round(BENCHMARKS[name], scenario, round_index, args.min_time)
+                if sample is not None:
+                    samples.setdefault(f'{name}/{scenario.name}', []).append(sample)
+        if not args.quiet:
+            print(f'round {round_index + 1}/{args.rounds} done', file=sys.stderr)
+    results = {}
+    for key, values in samples.items():
+        per_call = sorted(value for value, _ in values)
+        results[key] = {'min_us': per_call[0], 'median_us': per_call[len(per_call) // 2],
+                        'relative': min(relative for _, relative in values), 'rounds': len(values)}
+        if not args.quiet:
+            print(f'{key:70s} {per_call[0]:12.2f}us', file=sys.stderr)
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'created': time.time(),
+        'seed': args.seed,
+        'reference_us': reference_time(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+def compare(args) -> int:
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)['results']
+    with open(args.current) as fp:
+        current = json.load(fp)['results']
+    metric = 'min_us' if args.absolute else 'relative'
+    regressions = 0
+    for key in sorted(baseline.keys() & current.keys()):
+        ratio = current[key][metric] / baseline[key][metric]
+        if ratio > 1 + args.threshold:
+            flag = 'REGRESSION'
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            flag = 'faster'
+        elif args.all:
+            flag = ''
+        else:
+            continue
+        print(f'{key:70s} {baseline[key]["min_us"]:12.2f}us -> {current[key]["min_us"]:12.2f}us '
+              f'{ratio:6.2f}x{"" if args.absolute else " relative"} {flag}')
+    missing = baseline.keys() - current.keys()
+    if missing:
+        print(f'{len(missing)} benchmarks missing from {args.current}')
+    added = current.keys() - baseline.keys()
+    if added:
+        print(f'{len(added)} benchmarks missing from {args.baseline}')
+    print(f'{len(baseline.keys() & current.keys())} compared, {regressions} regressions '
+          f'(threshold {args.threshold:.0%})')
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='core.WallGame 的微基准测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    run_parser.add_argument('--players', type=int, nargs='+', default=DEFAULT_PLAYERS)
+    run_parser.add_argument('--densities', type=float, nargs='+', default=DEFAULT_DENSITIES)
+    run_parser.add_argument('--backends', nargs='+', default=['list'])
+    run_parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    run_parser.add_argument('--rounds', type=int, default=5)
+    run_parser.add_argument('--min-time', type=float, default=0.01, help='每轮至少执行的秒数')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', default=None, help='结果写入的 JSON 文件，默认输出到标准输出')
+    run_parser.add_argument('--quiet', action='store_true')
+
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.25,
+                                help='变慢超过这个比例视为退化')
+    compare_parser.add_argument('--absolute', action='store_true',
+                                help='比较时间本身，而不是相对于参照代码的倍数')
+    compare_parser.add_argument('--all', action='store_true', help='列出所有测试，而不只是变化超过阈值的')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
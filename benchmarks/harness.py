@@ -0,0 +1,151 @@
+"""
+基准测试共用的服务端和客户端
+
+prepare_workdir 在临时目录中准备运行 WallGameApp 所需的文件（密钥、数据库、模板和静态文件），
+serve 在当前进程中启动服务器，Client 模拟浏览器注册、登录、创建房间和下棋
+"""
+import contextlib
+import json
+import os
+import random
+import shutil
+import sqlite3
+from pathlib import Path
+from typing import *
+
+from aiohttp import ClientSession, CookieJar, TCPConnector, WSMsgType, web
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def prepare_workdir(path, key_size=1024) -> Path:
+    """
+    在 path 中生成新的密钥对和空数据库，模板链接到仓库中的文件。
+    静态文件需要复制，aiohttp 不提供指向静态目录之外的链接
+    """
+    path = Path(path)
+    shutil.copytree(ROOT / 'static', path / 'static', dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns('public_key.pem'))
+    if not (path / 'templates').exists():
+        (path / 'templates').symlink_to(ROOT / 'templates')
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    (path / 'private_key.pem').write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption()))
+    (path / 'static' / 'public_key.pem').write_bytes(key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+
+    conn = sqlite3.connect(path / 'db.sqlite3')
+    conn.executescript((ROOT / 'create_table.sql').read_text())
+    conn.commit()
+    conn.close()
+    return path
+
+
+@contextlib.asynccontextmanager
+async def serve(workdir, app_factory=None, port=0) -> AsyncIterator[Tuple[str, web.Application]]:
+    """
+    在 workdir 中启动 WallGameApp，产出 (base_url, app)
+    """
+    from app import WallGameApp
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    runner = None
+    try:
+        app = (app_factory or WallGameApp)()
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', port)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        yield f'http://{host}:{port}', app
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        os.chdir(cwd)
+
+
+def symbol_for(index: int) -> str:
+    chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+    return chars[index // len(chars) % len(chars)] + chars[index % len(chars)]
+
+
+class Client:
+    """
+    一个浏览器：保存会话 cookie，用服务器的公钥加密密码
+    """
+
+    def __init__(self, base_url: str, name: str, symbol: str, rsa_util,
+                 password: bytes = b'password', seed=None) -> None:
+        self.base_url = base_url
+        self.name = name
+        self.symbol = symbol
+        self.password_encrypted = rsa_util.encrypt_by_public_key(password).decode()
+        # 一个用户可能同时在很多房间中，每个房间一个 WebSocket 连接，不限制连接数
+        self.session = ClientSession(cookie_jar=CookieJar(unsafe=True),
+                                     connector=TCPConnector(limit=0))
+        self.rng = random.Random(seed if seed is not None else name)
+        self.moves = 0
+        self.games = 0
+
+    async def close(self):
+        await self.session.close()
+
+    async def post(self, path, data) -> int:
+        async with self.session.post(self.base_url + path, data=data,
+                                     allow_redirects=False) as resp:
+            await resp.read()
+            return resp.status
+
+    async def register(self):
+        status = await self.post('/register/', {
+            'username': self.name, 'symbol': self.symbol,
+            'password_encrypted': self.password_encrypted})
+        if status != 302:
+            raise RuntimeError(f'failed to register {self.name}: {status}')
+
+    async def login(self) -> int:
+        return await self.post('/login/', {
+            'username': self.name, 'password_encrypted': self.password_encrypted})
+
+    async def new_room(self, size: int, positions) -> str:
+        async with self.session.post(self.base_url + '/new/', data={
+            'name': f'{self.name} 的房间', 'size': str(size),
+            'player-positions': json.dumps(positions)
+        }, allow_redirects=False) as resp:
+            return resp.headers['Location']
+
+    async def play(self, room: str, games: Optional[int] = None):
+        """
+        连接到房间，随机走棋，每局结束后同意重新开始，直到下完 games 局
+        """
+        async with self.session.ws_connect(f'{self.base_url}{room}ws/') as ws:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    break
+                data = json.loads(msg.data)
+                event = data['event']
+                if event == 'ask_player_action':
+                    (row, col), *_ = data['reachable_points']
+                    to_row, to_col = self.rng.choice(data['reachable_points'])
+                    await ws.send_json({
+                        'motions': [to_row - row, to_col - col],
+                        'wall_dir': self.rng.choice(('up', 'down', 'left', 'right'))
+                    })
+                    self.moves += 1
+                elif event == 'game_over':
+                    self.games += 1
+                    if games is not None and self.games >= games:
+                        break
+                    await ws.send_json({'agree': True})
+                elif event == 'error':
+                    raise RuntimeError(data['message'])
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
@@ -0,0 +1,93 @@
+"""
+测量玩家加入房间的速度，比较有无用户缓存
+
+    python -m benchmarks.join --users 30 --rooms 300
+    python -m benchmarks.join --users 30 --rooms 300 --no-cache
+
+每个房间两个座位，users 个用户轮流加入各个房间，同一个用户会加入多个房间。
+计时从建立 WebSocket 连接开始，到收到 joined 消息为止
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+from benchmarks.harness import Client, percentile, prepare_workdir, serve, symbol_for
+
+
+def app_factory(cache):
+    from app import WallGameApp
+    from storage import AsyncStorage
+
+    def factory():
+        app = WallGameApp()
+        if not cache:
+            app.storage = AsyncStorage(cache_size=0)
+        return app
+
+    return factory
+
+
+async def join(client: Client, room: str, connections: list) -> float:
+    started = time.perf_counter()
+    ws = await client.session.ws_connect(f'{client.base_url}{room}ws/')
+    connections.append(ws)
+    async for msg in ws:
+        if json.loads(msg.data)['event'] == 'joined':
+            return time.perf_counter() - started
+    raise RuntimeError(f'{client.name} failed to join {room}')
+
+
+async def run(args):
+    from rsa_util import RsaUtil
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = prepare_workdir(tmp)
+        async with serve(workdir, app_factory(not args.no_cache)) as (base_url, app):
+            rsa_util = RsaUtil(company_pri_file=None)
+            clients = [Client(base_url, f'user{i}', symbol_for(i), rsa_util)
+                       for i in range(args.users)]
+            connections = []
+            try:
+                await asyncio.gather(*[client.register() for client in clients])
+                # 注册时写入的记录不算在内
+                if app.storage.cache is not None:
+                    app.storage.cache.clear()
+                rooms = [await clients[0].new_room(7, [[0, 0], [6, 6]]) for _ in range(args.rooms)]
+                # 第 i 次加入由第 i % users 个用户完成，相邻两次加入同一个房间
+                joins = [(clients[i % args.users], rooms[i // 2]) for i in range(args.rooms * 2)]
+                semaphore = asyncio.Semaphore(args.concurrency)
+
+                async def limited(client, room):
+                    async with semaphore:
+                        return await join(client, room, connections)
+
+                started = time.perf_counter()
+                latencies = await asyncio.gather(*[limited(client, room) for client, room in joins])
+                elapsed = time.perf_counter() - started
+                stats = app.storage.cache.stats() if app.storage.cache is not None else None
+            finally:
+                await asyncio.gather(*[ws.close() for ws in connections])
+                await asyncio.gather(*[client.close() for client in clients])
+
+    print(f'cache: {"off" if args.no_cache else "on"}, {args.users} users, '
+          f'{len(latencies)} joins, concurrency {args.concurrency}')
+    print(f'joins: {len(latencies) / elapsed:.1f}/s')
+    for name, fraction in (('p50', 0.5), ('p99', 0.99)):
+        print(f'{name}: {percentile(latencies, fraction) * 1e3:.2f}ms')
+    if stats is not None:
+        print(f'cache: {stats}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=30)
+    parser.add_argument('--rooms', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--no-cache', action='store_true')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+单个 WallGameApp 能同时支撑多少房间
+
+    python -m benchmarks.load --rooms 10 50 200 --players 2 --size 7 --games 1
+
+对每个房间数量，在同一进程中启动一个新的服务器，通过 /new/ 创建房间，
+每个房间的玩家通过 /{room}/ws/ 加入，根据 reachable_points 随机走棋，直到每个房间下完 games 局。
+每个座位由同一个用户占据，所以只需要注册 players 个用户。报告：
+
+- moves/s：所有房间每秒完成的动作数
+- latency：发出动作到收到对应的 game_map_diff 的时间
+- loop lag：每 lag_interval 秒唤醒一次的任务实际晚了多久。客户端与服务器在同一个事件循环中，
+  所以包括客户端的开销
+- memory/room：加入房间前后的 RSS 之差（包括客户端的连接）。
+  指定 --tracemalloc 时改为统计加入期间仓库中的模块（房间、游戏状态）分配的内存，
+  tracemalloc 本身占用内存，这时不报告 RSS
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from aiohttp import WSMsgType
+
+from benchmarks.harness import ROOT, Client, percentile, prepare_workdir, serve, symbol_for
+
+
+class LoadStats:
+    def __init__(self) -> None:
+        self.moves = 0
+        self.games = 0
+        self.latencies = []
+        self.lags = []
+
+
+def rss() -> int:
+    with open('/proc/self/statm') as fp:
+        return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def corner_positions(size, players):
+    corners = [[0, 0], [size - 1, size - 1], [0, size - 1], [size - 1, 0]]
+    if players > len(corners):
+        raise ValueError(f'at most {len(corners)} players')
+    return corners[:players]
+
+
+async def sample_lag(stats: LoadStats, interval: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        stats.lags.append(loop.time() - expected)
+
+
+async def join(client: Client, room: str):
+    ws = await client.session.ws_connect(f'{client.base_url}{room}ws/')
+    async for msg in ws:
+        if json.loads(msg.data)['event'] == 'joined':
+            return ws
+    raise RuntimeError(f'{client.name} failed to join {room}')
+
+
+async def play(ws, rng: random.Random, stats: LoadStats, games: int, think: float):
+    """
+    在已加入的房间中随机走棋，下完 games 局后断开
+    """
+    sent = None
+    played = 0
+    async for msg in ws:
+        if msg.type != WSMsgType.TEXT:
+            break
+        data = json.loads(msg.data)
+        event = data['event']
+        if event == 'game_map_diff' and sent is not None:
+            stats.latencies.append(time.perf_counter() - sent)
+            sent = None
+        elif event == 'ask_player_action':
+            if think:
+                await asyncio.sleep(rng.expovariate(1 / think))
+            (row, col), *_ = data['reachable_points']
+            to_row, to_col = rng.choice(data['reachable_points'])
+            sent = time.perf_counter()
+            await ws.send_json({
+                'motions': [to_row - row, to_col - col],
+                'wall_dir': rng.choice(('up', 'down', 'left', 'right'))
+            })
+            stats.moves += 1
+        elif event == 'game_over':
+            played += 1
+            stats.games += 1
+            if played >= games:
+                break
+            await ws.send_json({'agree': True})
+        elif event == 'error':
+            raise RuntimeError(data['message'])
+    await ws.close()
+
+
+def app_factory(metrics):
+    from app import WallGameApp
+
+    return lambda: WallGameApp(metrics=metrics)
+
+
+async def run_level(rooms: int, args) -> dict:
+    from rsa_util import RsaUtil
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = prepare_workdir(tmp)
+        async with serve(workdir, app_factory(args.metrics)) as (base_url, app):
+            rsa_util = RsaUtil(company_pri_file=None)
+            clients = [Client(base_url, f'user{i}', symbol_for(i), rsa_util)
+                       for i in range(args.players)]
+            connections = []
+            stats = LoadStats()
+            lag_task = None
+            try:
+                for client in clients:
+                    await client.register()
+                positions = corner_positions(args.size, args.players)
+                room_ids = [await clients[0].new_room(args.size, positions) for _ in range(rooms)]
+
+                # 加入房间的开销：各个房间的最后一个玩家加入时游戏开始，所以也包括第一次发送地图
+                rss_before = rss()
+                if args.tracemalloc:
+                    tracemalloc.start()
+                for room in room_ids:
+                    for client in clients:
+                        connections.append((client, await join(client, room)))
+                memory = {'rss_per_room_kb': (rss() - rss_before) / rooms / 1024}
+                if args.tracemalloc:
+                    snapshot = tracemalloc.take_snapshot()
+                    tracemalloc.stop()
+                    traced = sum(stat.size for stat in snapshot.statistics('filename')
+                                 if os.path.dirname(os.path.abspath(stat.traceback[0].filename)) == str(ROOT))
+                    memory = {'traced_per_room_kb': traced / rooms / 1024}
+
+                lag_task = asyncio.create_task(sample_lag(stats, args.lag_interval))
+                started = time.perf_counter()
+                await asyncio.gather(*[
+                    play(ws, random.Random(f'{args.seed}-{i}'), stats, args.games, args.think)
+                    for i, (client, ws) in enumerate(connections)])
+                elapsed = time.perf_counter() - started
+            finally:
+                if lag_task is not None:
+                    lag_task.cancel()
+                await asyncio.gather(*[ws.close() for _, ws in connections])
+                await asyncio.gather(*[client.close() for client in clients])
+
+    return {
+        'rooms': rooms,
+        'games': stats.games // args.players,
+        'moves': stats.moves,
+        'seconds': elapsed,
+        'moves_per_second': stats.moves / elapsed,
+        'latency_ms': {name: percentile(stats.latencies, fraction) * 1e3
+                       for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))},
+        'loop_lag_ms': {'p50': percentile(stats.lags, 0.5) * 1e3 if stats.lags else 0.0,
+                        'max': max(stats.lags, default=0.0) * 1e3},
+        **memory,
+    }
+
+
+async def run(args):
+    results = []
+    for rooms in args.rooms:
+        result = await run_level(rooms, args)
+        results.append(result)
+        if not args.json:
+            print(f'{rooms:5d} rooms: {result["moves_per_second"]:8.0f} moves/s, '
+                  f'latency p50 {result["latency_ms"]["p50"]:.2f}ms '
+                  f'p99 {result["latency_ms"]["p99"]:.2f}ms, '
+                  f'loop lag p50 {result["loop_lag_ms"]["p50"]:.2f}ms '
+                  f'max {result["loop_lag_ms"]["max"]:.1f}ms, '
+                  + ', '.join(f'{key[:-len("_per_room_kb")]}/room {value:.1f}KB'
+                              for key, value in result.items() if key.endswith('_per_room_kb')))
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, nargs='+', default=[10, 50, 200],
+                        help='依次测试的房间数量')
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--size', type=int, default=7)
+    parser.add_argument('--games', type=int, default=1, help='每个房间下的局数')
+    parser.add_argument('--think', type=float, default=0.0,
+                        help='玩家思考时间的平均值（秒），0 表示立即回复')
+    parser.add_argument('--lag-interval', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='用 tracemalloc 统计房间占用的内存，而不是 RSS')
+    parser.add_argument('--metrics', action='store_true', help='启用 metrics 模块的统计')
+    parser.add_argument('--json', action='store_true', help='以 JSON 输出所有结果')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
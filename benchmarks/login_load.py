@@ -0,0 +1,120 @@
+"""
+在持续的 WebSocket 对局流量下测量登录的延迟
+
+    python -m benchmarks.login_load --players 32 --logins 400 --storage async
+    python -m benchmarks.login_load --players 32 --logins 400 --storage sync
+
+--storage sync 在事件循环中直接执行 sqlite3 查询（旧的做法），
+--storage async 使用 storage.AsyncStorage。服务器和客户端运行在同一个进程中
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+
+from benchmarks.harness import Client, percentile, prepare_workdir, serve, symbol_for
+
+
+class InlineStorage:
+    """
+    接口与 AsyncStorage 相同，但在事件循环中同步执行查询
+    """
+
+    def __init__(self) -> None:
+        from storage import Storage
+
+        self.storage = Storage()
+
+    async def get_user(self, name):
+        return self.storage.get_user(name)
+
+    async def new_user(self, user):
+        self.storage.new_user(user)
+        self.storage.save()
+
+    async def update_user(self, user):
+        self.storage.update_user(user)
+        self.storage.save()
+
+    async def close(self):
+        self.storage.close()
+
+
+def app_factory(storage):
+    from app import WallGameApp
+
+    def factory():
+        app = WallGameApp()
+        if storage == 'sync':
+            app.storage = InlineStorage()
+        return app
+
+    return factory
+
+
+async def run(args):
+    from rsa_util import RsaUtil
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = prepare_workdir(tmp)
+        async with serve(workdir, app_factory(args.storage)) as (base_url, app):
+            rsa_util = RsaUtil(company_pri_file=None)
+            clients = [Client(base_url, f'user{i}', symbol_for(i), rsa_util)
+                       for i in range(args.players + args.concurrency)]
+            try:
+                await asyncio.gather(*[client.register() for client in clients])
+                players = clients[:args.players]
+                loggers = clients[args.players:]
+
+                games = []
+                for host, guest in zip(players[::2], players[1::2]):
+                    room = await host.new_room(args.size, [[0, 0], [args.size - 1, args.size - 1]])
+                    games += [asyncio.create_task(host.play(room)),
+                              asyncio.create_task(guest.play(room))]
+                await asyncio.sleep(args.warmup)
+
+                latencies = []
+                remaining = args.logins
+                moves_before = sum(client.moves for client in players)
+                started = time.perf_counter()
+
+                async def login_loop(client):
+                    nonlocal remaining
+                    while remaining > 0:
+                        remaining -= 1
+                        begin = time.perf_counter()
+                        await client.login()
+                        latencies.append(time.perf_counter() - begin)
+
+                await asyncio.gather(*[login_loop(client) for client in loggers])
+                elapsed = time.perf_counter() - started
+                moves = sum(client.moves for client in players) - moves_before
+                for task in games:
+                    if task.done() and task.exception():
+                        raise task.exception()
+                    task.cancel()
+            finally:
+                await asyncio.gather(*[client.close() for client in clients])
+
+    print(f'storage: {args.storage}, {args.players} players in {args.players // 2} rooms, '
+          f'{args.concurrency} concurrent logins')
+    print(f'logins: {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.1f}/s)')
+    for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+        print(f'{name}: {percentile(latencies, fraction) * 1e3:.1f}ms')
+    print(f'max: {max(latencies) * 1e3:.1f}ms')
+    print(f'moves during the test: {moves} ({moves / elapsed:.1f}/s)')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=32)
+    parser.add_argument('--size', type=int, default=7)
+    parser.add_argument('--logins', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--storage', choices=('async', 'sync'), default='async')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
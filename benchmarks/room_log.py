@@ -0,0 +1,102 @@
+"""
+房间操作日志的大小和恢复速度
+
+    python -m benchmarks.room_log --rooms 200 --size 7 --players 2
+
+用随机策略下完 rooms 局，把每局的动作按 GameRoom 的格式写入 ActionJournal，
+然后用 GameRoom.restore 从日志恢复所有房间（读取、回放、改写日志）
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from core import Event, Player, WallGame
+from game_room import GameRoom
+from player_manager import ClosedSocket
+from room_log import ActionJournal
+from simulate import random_policy, random_positions
+
+
+def random_game(size, players, rng):
+    """
+    返回 (初始位置, 动作列表)，动作为 (玩家序号, motions, wall_dir)
+    """
+    positions = random_positions(size, players, rng)
+    game = WallGame(size, [Player(str(i), row, col) for i, (row, col) in enumerate(positions)])
+    loop = game.game_loop()
+    moves = []
+    reply = None
+    try:
+        while True:
+            event, *args = loop.send(reply)
+            reply = None
+            if event is Event.ask_player_action:
+                player = args[0]
+                (row, col), direction = random_policy(game, player, rng)
+                reply = (row - player.row, col - player.col), direction
+                moves.append((game.players.index(player), list(reply[0]), direction.name))
+    except StopIteration:
+        pass
+    return positions, moves
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    games = [random_game(args.size, args.players, rng) for _ in range(args.rooms)]
+    total_moves = sum(len(moves) for _, moves in games)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = ActionJournal(tmp, compact_every=10 ** 9)
+        GameRoom.journal = journal
+        started = time.perf_counter()
+        for positions, moves in games:
+            room = GameRoom(args.size, 'benchmark', positions)
+            for i, player in enumerate(room.players):
+                player.symbol = f'P{i}'
+                room.manager.register_player(f'user{i}', player, ClosedSocket())
+                room.log(room.join_record(f'user{i}', player))
+            for index, motions, wall_dir in moves:
+                room.log({'t': 'move', 'p': index, 'm': motions, 'w': wall_dir})
+            if args.flush_every_game:
+                await journal.submit_pending()
+        await journal.stop()
+        write_seconds = time.perf_counter() - started
+        move_bytes = sum(len(journal.encode({'t': 'move', 'p': index, 'm': motions, 'w': wall_dir}))
+                         for _, moves in games for index, motions, wall_dir in moves)
+        file_bytes = sum(os.path.getsize(journal.path(room_id)) for room_id in GameRoom.instances)
+
+        GameRoom.instances.clear()
+        journal = ActionJournal(tmp)
+        GameRoom.journal = journal
+        started = time.perf_counter()
+        rooms = GameRoom.restore(journal)
+        restore_seconds = time.perf_counter() - started
+        for room in rooms:
+            room.task.cancel()
+        await journal.stop()
+        GameRoom.journal = None
+
+    print(f'{args.rooms} rooms, {total_moves} moves, size {args.size}, {args.players} players')
+    print(f'log bytes per move: {move_bytes / total_moves:.1f} '
+          f'(files: {file_bytes / total_moves:.1f} including headers and joins)')
+    print(f'write: {total_moves / write_seconds:.0f} moves/s')
+    print(f'restore: {total_moves / restore_seconds:.0f} moves/s, '
+          f'{restore_seconds / args.rooms * 1e3:.2f}ms per room')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=200)
+    parser.add_argument('--size', type=int, default=7)
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--flush-every-game', action='store_true',
+                        help='每局写完后立即 fsync，而不是最后批量写入')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+比较 RsaUtil 两种后端每秒的解密次数，使用临时生成的密钥
+
+    python -m benchmarks.rsa --key-size 1024 --seconds 2
+"""
+import argparse
+import tempfile
+import time
+
+from benchmarks.harness import prepare_workdir
+from rsa_util import RsaUtil
+
+# 密码的典型长度，以及需要分段的长消息
+MESSAGES = {'16 bytes': b'p' * 16, '1000 bytes': b'm' * 1000}
+
+
+def measure(func, seconds):
+    count = 0
+    started = time.perf_counter()
+    while (elapsed := time.perf_counter() - started) < seconds:
+        func()
+        count += 1
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--key-size', type=int, default=1024)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = prepare_workdir(tmp, key_size=args.key_size)
+        public_key, private_key = workdir / 'static' / 'public_key.pem', workdir / 'private_key.pem'
+        utils = {backend: RsaUtil(public_key, private_key, backend=backend)
+                 for backend in ('rsa', 'cryptography')}
+
+        print(f'{args.key_size}-bit key')
+        print(f'{"message":>12} {"rsa":>12} {"cryptography":>14} {"speedup":>8}')
+        for name, message in MESSAGES.items():
+            encrypted = utils['rsa'].encrypt_by_public_key(message)
+            rates = {}
+            for backend, util in utils.items():
+                # 两种后端的密文格式相同，可以互相解密
+                assert util.decrypt_by_private_key(encrypted) == message
+                assert utils['rsa'].decrypt_by_private_key(util.encrypt_by_public_key(message)) == message
+                rates[backend] = measure(lambda: util.decrypt_by_private_key(encrypted), args.seconds)
+            print(f'{name:>12} {rates["rsa"]:>10.0f}/s {rates["cryptography"]:>12.0f}/s '
+                  f'{rates["cryptography"] / rates["rsa"]:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
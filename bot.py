@@ -0,0 +1,258 @@
+"""
+电脑玩家
+
+Bot 作为虚拟用户注册到 PlayerManager，并伪装成 WebSocketResponse 接收发给它的消息。
+收到 ask_player_action 时，在进程池中对 WallGame 的状态做带置换表的迭代加深搜索，
+每步的搜索时间不超过给定的预算。包括进程间传输在内超过预算 Bot.grace 秒仍没有结果时，随机走一步
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+
+from core import Event, Player, WallGame
+
+logger = logging.getLogger(__name__)
+
+EXACT, LOWER, UPPER = range(3)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Searcher:
+    """
+    多人博弈的偏执 (paranoid) alpha-beta 搜索：根玩家取最大值，其余玩家都取最小值
+    """
+
+    def __init__(self, game: WallGame, player_index: int, budget: float, max_depth=8):
+        self.game = game
+        self.me = player_index
+        self.deadline = time.perf_counter() + budget
+        self.max_depth = max_depth
+        # key -> (depth, value, flag, best_action)
+        self.table: Dict[Hashable, Tuple[int, float, int, int]] = {}
+        self.nodes = 0
+        self.depth = 0
+
+    def run(self) -> int:
+        game = self.game
+        actions = list(game.legal_actions(game.players[self.me]))
+        best = actions[0]
+        if len(actions) == 1:
+            return best
+        try:
+            for depth in range(1, self.max_depth + 1):
+                best = self.root(depth, actions)
+                self.depth = depth
+                actions.remove(best)
+                actions.insert(0, best)
+        except SearchTimeout:
+            pass
+        return best
+
+    def root(self, depth, actions):
+        alpha = float('-inf')
+        best = actions[0]
+        for action in actions:
+            self.push(self.game, self.me, action)
+            try:
+                value = self.alphabeta(self.game, self.me, depth - 1, alpha, float('inf'))
+            finally:
+                self.game.pop_action()
+            if value > alpha:
+                alpha = value
+                best = action
+        return best
+
+    def alphabeta(self, game: WallGame, last: int, depth: int, alpha: float, beta: float):
+        self.nodes += 1
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout
+        mover = self.next_mover(game, last)
+        if depth == 0 or mover is None:
+            return self.evaluate(game)
+
+        key = self.key(game, mover)
+        entry = self.table.get(key)
+        best_action = None
+        if entry is not None:
+            entry_depth, value, flag, best_action = entry
+            if entry_depth >= depth and (
+                    flag == EXACT or
+                    (flag == LOWER and value >= beta) or
+                    (flag == UPPER and value <= alpha)):
+                return value
+
+        actions = list(game.legal_actions(game.players[mover]))
+        if best_action in actions:
+            actions.remove(best_action)
+            actions.insert(0, best_action)
+        alpha_orig, beta_orig = alpha, beta
+        maximizing = mover == self.me
+        value = float('-inf') if maximizing else float('inf')
+        for action in actions:
+            self.push(game, mover, action)
+            try:
+                child = self.alphabeta(game, mover, depth - 1, alpha, beta)
+            finally:
+                game.pop_action()
+            if maximizing:
+                if child > value:
+                    value, best_action = child, action
+                alpha = max(alpha, value)
+            else:
+                if child < value:
+                    value, best_action = child, action
+                beta = min(beta, value)
+            if alpha >= beta:
+                break
+
+        if value <= alpha_orig:
+            flag = UPPER
+        elif value >= beta_orig:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table[key] = depth, value, flag, best_action
+        return value
+
+    @staticmethod
+    def push(game: WallGame, index: int, action: int):
+        player = game.players[index]
+        (row, col), direction = game.decode_action(action)
+        game.push_action(player, (row - player.row, col - player.col), direction)
+
+    @staticmethod
+    def key(game: WallGame, mover: int):
+        return game.zobrist, mover
+
+    @staticmethod
+    def active_players(game: WallGame):
+        """
+        还与其他玩家处于同一区域的玩家的序号
+        """
+        areas = [game.area_of(p.row, p.col) for p in game.players]
+        return [i for i, area in enumerate(areas)
+                if game.players[i].status == 'normal' and areas.count(area) > 1]
+
+    def next_mover(self, game: WallGame, last: int) -> Optional[int]:
+        active = self.active_players(game)
+        if len(active) < 2:
+            return None
+        for index in active:
+            if index > last:
+                return index
+        return active[0]
+
+    def evaluate(self, game: WallGame) -> float:
+        """
+        根玩家平均每人占有的面积减去其他玩家中的最大值
+        """
+        areas = [game.area_of(p.row, p.col) for p in game.players]
+        shares = [game.area_sizes[area] / areas.count(area) for area in areas]
+        mine = shares.pop(self.me)
+        return mine - max(shares)
+
+
+def choose_action(game: WallGame, player_index: int, budget: float):
+    """
+    在进程池中执行：返回 (动作编码, 搜索统计)
+    """
+    started = time.perf_counter()
+    searcher = Searcher(game, player_index, budget)
+    action = searcher.run()
+    elapsed = time.perf_counter() - started
+    return action, {'nodes': searcher.nodes, 'depth': searcher.depth, 'seconds': elapsed}
+
+
+def _ready():
+    return True
+
+
+class Bot:
+    """
+    机器人玩家，伪装成 WebSocketResponse 交给 PlayerManager
+    """
+    executor: Optional[ProcessPoolExecutor] = None
+    max_workers = None
+    # 在预算之外，允许传输局面和结果、等待空闲进程所用的时间
+    grace = 0.5
+
+    def __init__(self, room, user: str, budget: float = 1.0) -> None:
+        self.room = room
+        self.user = user
+        self.budget = budget
+        self.closed = False
+        self.task = None
+        # 加入房间时就启动工作进程，不让第一步承担启动的时间
+        self.get_executor()
+
+    @classmethod
+    def get_executor(cls) -> ProcessPoolExecutor:
+        if cls.executor is None:
+            # 使用 spawn 启动工作进程，否则它们会继承服务器监听的套接字，
+            # 服务器异常退出后端口仍被占用，无法立即重启
+            cls.executor = ProcessPoolExecutor(
+                cls.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            # 进程按需启动，提交空任务让所有进程立即启动并导入模块
+            for _ in range(cls.max_workers or os.cpu_count() or 1):
+                cls.executor.submit(_ready)
+        return cls.executor
+
+    @classmethod
+    def shutdown(cls):
+        if cls.executor is not None:
+            cls.executor.shutdown(wait=False, cancel_futures=True)
+            cls.executor = None
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        return self.room.manager.users_queues[self.user]
+
+    async def send_json(self, data: Dict, dumps=None):
+        # 广播的消息经 send_str 以 JSON 文本的形式到达，其中的 event 是字符串
+        event = getattr(data.get('event'), 'value', data.get('event'))
+        if event == Event.ask_player_action.value:
+            self.task = asyncio.create_task(self.act())
+        elif event == Event.game_over.value:
+            await self.queue.put({'agree': True})
+
+    async def send_str(self, data: str):
+        await self.send_json(json.loads(data))
+
+    async def close(self, *args, **kwargs):
+        self.closed = True
+
+    async def act(self):
+        game = self.room.game
+        player: Player = self.room.manager.users_players[self.user]
+        index = game.players.index(player)
+        loop = asyncio.get_running_loop()
+        try:
+            action, stats = await asyncio.wait_for(
+                loop.run_in_executor(self.get_executor(), choose_action, game, index, self.budget),
+                self.budget + self.grace)
+        except asyncio.TimeoutError:
+            logger.warning('bot %s exceeded its %.2fs budget, playing a random move',
+                           player.symbol, self.budget)
+            action = random.choice(game.legal_actions(player))
+        except Exception:
+            # 本任务没有人等待，出错时房间会一直等待回答，所以改为随机走一步
+            logger.exception('bot %s failed to search, playing a random move', player.symbol)
+            action = random.choice(game.legal_actions(player))
+        else:
+            logger.info('bot %s searched %d nodes to depth %d in %.2fs (%.0f nodes/s)',
+                        player.symbol, stats['nodes'], stats['depth'], stats['seconds'],
+                        stats['nodes'] / stats['seconds'] if stats['seconds'] else 0)
+        (row, col), direction = game.decode_action(action)
+        await self.queue.put({
+            'motions': [row - player.row, col - player.col],
+            'wall_dir': direction.name
+        })
@@ -1,6 +1,10 @@
 import itertools
+import random
+from array import array
+from bisect import bisect_left
 from collections import deque, Counter
 from enum import Enum
+from typing import NamedTuple, Optional, Tuple
 import traceback
 
 
@@ -13,8 +17,29 @@ class Direction(Enum):
     bottom = 'd'
 
 
+# legal_actions 中方向的编号
+DIRECTIONS = (Direction.up, Direction.left, Direction.down, Direction.right)
+
+
+def wall_position(pos, direction: Direction):
+    """
+    在 pos 处向 direction 放的墙对应的 (是否为上侧墙, row, col)，
+    即 wall_top[row][col] 或 wall_left[row][col]
+    """
+    row, col = pos
+    if direction is Direction.up:
+        return True, row, col
+    elif direction is Direction.down:
+        return True, row + 1, col
+    elif direction is Direction.left:
+        return False, row, col
+    else:
+        return False, row, col + 1
+
+
 class Event(Enum):
     update_game_map = 'update_game_map'
+    game_map_diff = 'game_map_diff'
     ask_player_action = 'ask_player_action'
     player_out = 'player_out'
     new_player = 'new_player'
@@ -45,8 +70,227 @@ class Player:
         return hash(self.symbol)
 
 
+class ReachableSet:
+    """
+    某玩家本回合可以到达的位置，按搜索顺序保存，第一个是玩家当前所在位置
+    """
+    __slots__ = ['player', 'version', 'points', '_members']
+
+    def __init__(self, player, version, points) -> None:
+        self.player = player
+        self.version = version
+        self.points = tuple(points)
+        self._members = frozenset(self.points)
+
+    def __contains__(self, pos):
+        return pos in self._members
+
+    def __iter__(self):
+        return iter(self.points)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __repr__(self) -> str:
+        return f'<ReachableSet of {self.player!r}: {len(self.points)} points>'
+
+
+# Territory.owners 中有多个最近的玩家、所在区域中没有玩家的格子
+CONTESTED = -1
+UNCLAIMED = -2
+
+
+class Territory(NamedTuple):
+    """
+    WallGame.territory 的结果。owners[row][col] 是离该格最近（不穿过墙，可以经过其他玩家）的玩家的序号，
+    或 CONTESTED、UNCLAIMED；distances[row][col] 是相应的步数，UNCLAIMED 的格子为 -1。
+    counts[i] 是第 i 个玩家拥有的格子数，contested 是 CONTESTED 的格子数
+    """
+    owners: list
+    distances: list
+    counts: Tuple[int, ...]
+    contested: int
+
+
+class _TerritoryCache:
+    """
+    上次计算 territory 时的墙、玩家位置和结果，格子用序号 row * size + col 表示
+    """
+    __slots__ = ['size', 'top', 'left', 'positions', 'neighbors', 'owners', 'distances',
+                 'counts', 'contested']
+
+    def __init__(self, size, top, left, players) -> None:
+        self.size = size
+        self.top = top
+        self.left = left
+        cells = size * size
+        self.positions = [-1] * players
+        # neighbors[i]: 与格子 i 之间没有墙的相邻格子
+        self.neighbors = [[] for _ in range(cells)]
+        for index in range(cells):
+            row, col = divmod(index, size)
+            if row > 0 and not top >> index & 1:
+                self._link(index - size, index)
+            if col > 0 and not left >> index & 1:
+                self._link(index - 1, index)
+        self.owners = [UNCLAIMED] * cells
+        self.distances = [-1] * cells
+        self.counts = [0] * players
+        self.contested = 0
+
+    def _link(self, a, b):
+        self.neighbors[a].append(b)
+        self.neighbors[b].append(a)
+
+    def update_walls(self, top, left) -> list:
+        """
+        更新 neighbors，返回墙发生变化处两侧的格子
+        """
+        changed = []
+        neighbors = self.neighbors
+        for bits, old, step in ((top, self.top, self.size), (left, self.left, 1)):
+            diff = bits ^ old
+            while diff:
+                low = diff & -diff
+                diff ^= low
+                b = low.bit_length() - 1
+                a = b - step
+                if bits & low:
+                    neighbors[a].remove(b)
+                    neighbors[b].remove(a)
+                else:
+                    self._link(a, b)
+                changed += a, b
+        self.top = top
+        self.left = left
+        return changed
+
+    def search(self, seeds, positions):
+        """
+        重新计算 seeds 所在的各个连通块
+        """
+        neighbors = self.neighbors
+        owners = self.owners
+        distances = self.distances
+        # 受影响的格子的距离暂时标记为 -2
+        affected = []
+        for index in seeds:
+            if distances[index] != -2:
+                distances[index] = -2
+                affected.append(index)
+        for index in affected:
+            for other in neighbors[index]:
+                if distances[other] != -2:
+                    distances[other] = -2
+                    affected.append(other)
+        for index in affected:
+            owners[index] = UNCLAIMED
+
+        # 逐层扩展，同一层中从不同玩家（或有争议的格子）到达的格子有争议
+        frontier = []
+        for player, index in enumerate(positions):
+            if distances[index] == -2:
+                owners[index] = player
+                distances[index] = 0
+                frontier.append(index)
+        distance = 0
+        while frontier:
+            distance += 1
+            reached = []
+            for index in frontier:
+                owner = owners[index]
+                for other in neighbors[index]:
+                    other_distance = distances[other]
+                    if other_distance < 0:
+                        distances[other] = distance
+                        owners[other] = owner
+                        reached.append(other)
+                    elif other_distance == distance and owners[other] != owner:
+                        owners[other] = CONTESTED
+            frontier = reached
+        for index in affected:
+            if distances[index] == -2:
+                distances[index] = -1
+
+        totals = Counter(owners)
+        self.counts = [totals[player] for player in range(len(positions))]
+        self.contested = totals[CONTESTED]
+        self.positions = list(positions)
+
+    def result(self) -> Territory:
+        size = self.size
+        cells = size * size
+        return Territory([self.owners[i:i + size] for i in range(0, cells, size)],
+                         [self.distances[i:i + size] for i in range(0, cells, size)],
+                         tuple(self.counts), self.contested)
+
+
+class GameState(NamedTuple):
+    """
+    WallGame 的不可变快照，可以用作字典的键。
+    wall_top/wall_left 的第 row * size + col 位表示格子 (row, col) 的上/左侧有墙，
+    outs 的第 i 位表示第 i 个玩家已出局
+    """
+    size: int
+    wall_top: int
+    wall_left: int
+    positions: Tuple[Tuple[int, int], ...]
+    outs: int
+    zobrist: Optional[int] = None
+
+    def __hash__(self):
+        if self.zobrist is None:
+            return tuple.__hash__(self)
+        return self.zobrist
+
+
+class ZobristKeys:
+    """
+    Zobrist 哈希使用的随机数，只由棋盘尺寸决定，因此在各个进程中都相同
+    """
+    _instances = {}
+
+    def __init__(self, size):
+        self._rng = random.Random(size)
+        self.cells = size * size
+        # 第 2 * index 项对应格子 index 上侧的墙，第 2 * index + 1 项对应左侧的墙
+        self.walls = [self._rng.getrandbits(64) for _ in range(2 * self.cells)]
+        self._players = []
+
+    @classmethod
+    def for_size(cls, size) -> 'ZobristKeys':
+        try:
+            return cls._instances[size]
+        except KeyError:
+            keys = cls._instances[size] = cls(size)
+            return keys
+
+    def player(self, index, cell):
+        players = self._players
+        while len(players) <= index:
+            players.append([self._rng.getrandbits(64) for _ in range(self.cells)])
+        return players[index][cell]
+
+
+def _border_bits(size):
+    """
+    第一行格子和第一列格子的位板，即初始时上侧和左侧有墙的格子
+    """
+    first_row = (1 << size) - 1
+    first_col = sum(1 << (row * size) for row in range(size))
+    return first_row, first_col
+
+
 class WallGame:
-    def __init__(self, size=7, players=None):
+    def __new__(cls, size=7, players=None, backend='list'):
+        if cls is WallGame and backend != 'list':
+            try:
+                cls = BACKENDS[backend]
+            except KeyError:
+                raise ValueError(f'unknown backend {backend!r}') from None
+        return super().__new__(cls)
+
+    def __init__(self, size=7, players=None, backend='list'):
         self.size = size
         self.wall_left = [[False] * size for _ in range(size)]
         self.wall_top = [[False] * size for _ in range(size)]
@@ -54,10 +298,29 @@ class WallGame:
                                    Player('乙', size - 1, size - 1)]
         self.areas = 1
         self.area_sizes = [0, size * size]
+        # area_mins[i]: 区域 i 中按行优先顺序最靠前的格子的序号 (row * size + col)，
+        # 区域编号正是按这个顺序分配的
+        self._area_mins = [-1, 0]
+        # 尚未反映到区域标记中的墙：(wall_list, row, col, 墙一侧的格子, 另一侧的格子)
+        self._new_walls = []
+        # 墙或玩家位置每变化一次 _version 加一，用于判断 _reachable 是否过期
+        self._version = 0
+        self._reachable = None
+        self._territory = None
         self.map = [[1] * size for _ in range(size)]
         for i in range(size):
             self.wall_left[i][0] = True
             self.wall_top[0][i] = True
+        self._top, self._left = _border_bits(size)
+        self._init_history()
+
+    def _init_history(self):
+        # push_action 记录的增量，供 pop_action 撤销
+        self._history = []
+        keys = ZobristKeys.for_size(self.size)
+        self.zobrist = 0
+        for index, player in enumerate(self.players):
+            self.zobrist ^= keys.player(index, player.row * self.size + player.col)
 
     def find_player_by_pos(self, row, col):
         for player in self.players:
@@ -65,24 +328,47 @@ class WallGame:
                 return player
         return None
 
+    def area_of(self, row, col):
+        return self.map[row][col]
+
     def update_areas(self):
+        """
+        根据上次调用以来新放置的墙增量地更新区域标记。
+        一面墙最多把一个区域分成两个，故只需在墙两侧做双向搜索，
+        并且只需重新标记较小的一侧，结果与 recompute_areas 完全相同
+        """
+        new_walls = self._new_walls
+        if len(new_walls) > 1:
+            # 多面墙一起处理时，先撤去它们再逐面放回，保证每一步都只新增了一面墙
+            for wall_list, row, col, _, _ in new_walls:
+                wall_list[row][col] = False
+        for wall_list, row, col, cell_a, cell_b in new_walls:
+            wall_list[row][col] = True
+            self._split_area(cell_a, cell_b)
+        new_walls.clear()
+
+    def recompute_areas(self):
         # 将对象属性变为局部变量可以加快访问速度
         size = self.size
         map = self.map
         area_sizes = self.area_sizes
+        area_mins = self._area_mins
         # 清楚地图区域标记
         for i in range(size):
             map[i][:] = itertools.repeat(0, size)
         areas = 0
         area_sizes.clear()
+        area_mins.clear()
         # 列表索引从0开始，而area从1开始，故先放入一个0作为占位符
         area_sizes.append(0)
+        area_mins.append(-1)
         for i in range(self.size):
             for j in range(self.size):
                 if map[i][j] == 0:
                     areas += 1
                     map[i][j] = areas
                     area_sizes.append(1)
+                    area_mins.append(i * size + j)
                     queue = deque(((i, j),))
                     while queue:
                         row, col = queue.popleft()
@@ -92,20 +378,161 @@ class WallGame:
                                 queue.append((r, c))
                                 area_sizes[areas] += 1
         self.map = map
+        self.areas = areas
+        self._new_walls.clear()
+
+    def _split_area(self, cell_a, cell_b):
+        """
+        cell_a 与 cell_b 之间刚放置了一面墙，若它们因此不再连通，则把原区域拆分为两个。
+        返回 (原区域编号, 新区域编号)，未拆分时返回 None
+        """
+        size = self.size
+        map = self.map
+        area_sizes = self.area_sizes
+        area_mins = self._area_mins
+        # 从墙两侧交替扩展，任一侧搜索完毕时，该侧就是被分出来的较小部分
+        seen_a = {cell_a}
+        seen_b = {cell_b}
+        queue_a = deque((cell_a,))
+        queue_b = deque((cell_b,))
+        sides = ((queue_a, seen_a, seen_b), (queue_b, seen_b, seen_a))
+        while queue_a and queue_b:
+            for queue, seen, other in sides:
+                row, col = queue.popleft()
+                for point in self.reachable_points_near(row, col):
+                    if point in other:
+                        return None
+                    if point not in seen:
+                        seen.add(point)
+                        queue.append(point)
+        small = seen_b if queue_a else seen_a
+
+        area = map[cell_a[0]][cell_a[1]]
+        old_min = area_mins[area]
+        for row, col in small:
+            map[row][col] = 0
+        if map[old_min // size][old_min % size] == 0:
+            # 较小部分保留原编号，较大部分的新起点是原起点之后第一个仍标记为 area 的格子
+            row, col = divmod(old_min, size)
+            while True:
+                try:
+                    col = map[row].index(area, col)
+                    break
+                except ValueError:
+                    row += 1
+                    col = 0
+            new_min = row * size + col
+            moved = area
+            moved_size = area_sizes[area] - len(small)
+        else:
+            new_min = min(row * size + col for row, col in small)
+            moved = -1
+            moved_size = len(small)
+        new_area = bisect_left(area_mins, new_min)
+        # 编号 >= new_area 的区域都在 new_min 之后，只需处理从 new_min 所在行开始的部分
+        if moved != -1 or new_area < len(area_sizes):
+            for row in map[new_min // size:]:
+                row[:] = [new_area if value == moved else
+                          value + 1 if value >= new_area else value
+                          for value in row]
+        fill = area if moved != -1 else new_area
+        for row, col in small:
+            map[row][col] = fill
+        area_sizes[area] -= moved_size
+        area_sizes.insert(new_area, moved_size)
+        area_mins.insert(new_area, new_min)
+        self.areas += 1
+        return area, new_area
+
+    def reachable_set(self, player: Player) -> ReachableSet:
+        """
+        返回 player 可以到达的位置，结果会被缓存，直到墙或玩家位置发生变化
+        """
+        cached = self._reachable
+        if cached is None or cached.player is not player or cached.version != self._version:
+            cached = self._reachable = ReachableSet(
+                player, self._version, self.get_reachable_points(player))
+        return cached
+
+    def territory(self) -> Territory:
+        """
+        用一次多源广度优先搜索求出每个格子离哪个玩家最近，墙和区域划分未完成时也可以使用。
+        出局的玩家同样计算在内。结果按连通块缓存，再次调用时只重新搜索墙或玩家位置发生了变化的连通块，
+        因此每回合调用一次的开销只与刚刚动过的区域的大小有关
+        """
+        size = self.size
+        positions = [player.row * size + player.col for player in self.players]
+        cache = self._territory
+        if cache is None or len(cache.positions) != len(positions):
+            cache = self._territory = _TerritoryCache(size, self._top, self._left, len(positions))
+            seeds = range(size * size)
+        else:
+            seeds = cache.update_walls(self._top, self._left)
+            for old, new in zip(cache.positions, positions):
+                if old != new:
+                    seeds += old, new
+        if seeds:
+            cache.search(seeds, positions)
+        return cache.result()
+
+    def _merge_areas(self, area, new_area):
+        """
+        _split_area 的逆操作
+        """
+        size = self.size
+        new_min = self._area_mins.pop(new_area)
+        self.area_sizes[area] += self.area_sizes.pop(new_area)
+        for row in self.map[new_min // size:]:
+            row[:] = [area if value == new_area else
+                      value - 1 if value > new_area else value
+                      for value in row]
+        self.areas -= 1
 
     def get_reachable_points(self, player: Player):
-        queue = deque(((player.row, player.col, 0),))
-        result_set = set()
-        yield player.row, player.col
+        # 其他玩家所在的位置不能经过
+        occupied = {(p.row, p.col) for p in self.players if p is not player}
+        start = player.row, player.col
+        queue = deque((start + (0,),))
+        result_set = {start}
         while queue:
             row, col, step = queue.popleft()
-            result_set.add((row, col))
             yield row, col
             if step >= 3:
                 continue
-            for r, c in self.reachable_points_near(row, col):
-                if self.find_player_by_pos(r, c) in (None, player) and (r, c) not in result_set:
-                    queue.append((r, c, step + 1))
+            for point in self.reachable_points_near(row, col):
+                if point not in occupied and point not in result_set:
+                    result_set.add(point)
+                    queue.append(point + (step + 1,))
+
+    def legal_actions(self, player: Player) -> array:
+        """
+        player 本回合所有合法的动作，每个动作 (位置, 放墙方向) 压缩为一个整数
+        (row * size + col) * 4 + DIRECTIONS.index(direction)，用 decode_action 解码
+        """
+        size = self.size
+        last = size - 1
+        wall_top = self.wall_top
+        wall_left = self.wall_left
+        actions = array('I')
+        append = actions.append
+        for row, col in self.reachable_set(player):
+            base = (row * size + col) * 4
+            if not wall_top[row][col]:
+                append(base)
+            if not wall_left[row][col]:
+                append(base + 1)
+            if row < last and not wall_top[row + 1][col]:
+                append(base + 2)
+            if col < last and not wall_left[row][col + 1]:
+                append(base + 3)
+        return actions
+
+    def encode_action(self, pos, direction: Direction) -> int:
+        return (pos[0] * self.size + pos[1]) * 4 + DIRECTIONS.index(direction)
+
+    def decode_action(self, action: int):
+        index, direction = divmod(action, 4)
+        return divmod(index, self.size), DIRECTIONS[direction]
 
     def reachable_points_near(self, row, col):
         wall_top = self.wall_top
@@ -120,12 +547,8 @@ class WallGame:
             yield row, col + 1
 
     def put_wall(self, player_pos, direction: Direction):
-        wall_list, row, col = {
-            Direction.up: (self.wall_top, player_pos[0], player_pos[1]),
-            Direction.down: (self.wall_top, player_pos[0] + 1, player_pos[1]),
-            Direction.left: (self.wall_left, player_pos[0], player_pos[1]),
-            Direction.right: (self.wall_left, player_pos[0], player_pos[1] + 1)
-        }[direction]
+        top, row, col = wall_position(player_pos, direction)
+        wall_list = self.wall_top if top else self.wall_left
         try:
             if wall_list[row][col] is False:
                 wall_list[row][col] = True
@@ -133,17 +556,73 @@ class WallGame:
                 raise ValueError('there is already a wall')
         except IndexError:
             raise ValueError('there is already a wall')
+        if wall_list is self.wall_top:
+            self._new_walls.append((wall_list, row, col, (row - 1, col), (row, col)))
+        else:
+            self._new_walls.append((wall_list, row, col, (row, col - 1), (row, col)))
+        self._toggle_wall(wall_list is self.wall_top, row * self.size + col)
+        self._version += 1
+
+    def _update_areas_undoable(self):
+        wall_list, row, col, cell_a, cell_b = self._new_walls.pop()
+        return self._split_area(cell_a, cell_b)
+
+    def _remove_wall(self, wall, split):
+        wall_list, row, col, _, _ = wall
+        wall_list[row][col] = False
+        self._toggle_wall(wall_list is self.wall_top, row * self.size + col)
+        if split is not None:
+            self._merge_areas(*split)
+        self._version += 1
 
     def apply_player_action(self, player, motions, wall_dir):
-        reachable_points = self.get_reachable_points(player)
+        reachable_points = self.reachable_set(player)
         new_pos = player.row + motions[0], player.col + motions[1]
         if new_pos in reachable_points:
             self.put_wall(new_pos, wall_dir)
-            player.row = new_pos[0]
-            player.col = new_pos[1]
+            self._move_player(player, *new_pos)
         else:
             raise ValueError('invalid motions')
 
+    def _move_player(self, player, row, col):
+        size = self.size
+        keys = ZobristKeys.for_size(size)
+        index = self.players.index(player)
+        self.zobrist ^= (keys.player(index, player.row * size + player.col) ^
+                         keys.player(index, row * size + col))
+        player.row = row
+        player.col = col
+        self._version += 1
+
+    def _toggle_wall(self, top, index):
+        if top:
+            self._top ^= 1 << index
+        else:
+            self._left ^= 1 << index
+        self.zobrist ^= ZobristKeys.for_size(self.size).walls[2 * index + (not top)]
+
+    def push_action(self, player, motions, wall_dir):
+        """
+        与 apply_player_action 相同，但同时更新区域，并记录撤销所需的增量，
+        之后可以用 pop_action 撤销。供搜索和回放使用
+        """
+        self.update_areas()
+        old_pos = player.row, player.col
+        self.apply_player_action(player, motions, wall_dir)
+        wall = self._new_walls[-1]
+        self._history.append((player, old_pos, wall, self._update_areas_undoable()))
+
+    def pop_action(self):
+        player, (row, col), wall, record = self._history.pop()
+        self._remove_wall(wall, record)
+        self._move_player(player, row, col)
+
+    def snapshot(self, zobrist=False) -> GameState:
+        return GameState(self.size, self._top, self._left,
+                         tuple((p.row, p.col) for p in self.players),
+                         sum(1 << i for i, p in enumerate(self.players) if p.status == 'out'),
+                         self.zobrist if zobrist else None)
+
     def game_loop(self):
         try:
             player_cycle = itertools.cycle(self.players)
@@ -154,6 +633,7 @@ class WallGame:
                 if player.status == 'out':
                     continue
                 message = ''
+                self.reachable_set(player)
                 while True:
                     motions, wall_dir = yield Event.ask_player_action, player, message
                     try:
@@ -166,14 +646,281 @@ class WallGame:
                 yield Event.update_game_map,
 
                 # 检查是否有人出局
-                areas_players = Counter(self.map[player.row][player.col]
-                                        for player in self.players)
-                for p in self.players:
-                    if areas_players[self.map[p.row][p.col]] == 1:
+                players_areas = [self.area_of(p.row, p.col) for p in self.players]
+                areas_players = Counter(players_areas)
+                for p, area in zip(self.players, players_areas):
+                    if areas_players[area] == 1:
                         if p.status == 'normal':
-                            yield Event.player_out, p, self.area_sizes[self.map[p.row][p.col]]
+                            p.status = 'out'
+                            yield Event.player_out, p, self.area_sizes[area]
                             remaining_players -= 1
         except:
             traceback.print_exc()
-        return {player: self.area_sizes[self.map[player.row][player.col]]
+        return {player: self.area_sizes[self.area_of(player.row, player.col)]
                 for player in self.players}
+
+
+def _popcount(value):
+    return bin(value).count('1')
+
+
+def _iter_bits(value):
+    while value:
+        low = value & -value
+        yield low.bit_length() - 1
+        value ^= low
+
+
+class BitboardWallGame(WallGame):
+    """
+    用整数位板保存墙和区域的 WallGame，第 row * size + col 位对应格子 (row, col)。
+    wall_top、wall_left 和 map 仍可按列表的方式读取，但它们是由位板生成的只读副本，
+    在墙或区域变化之前重复读取得到的是同一个列表
+    """
+
+    def __init__(self, size=7, players=None, backend='bitboard'):
+        self.size = size
+        self.players = players or [Player('甲', 0, 0),
+                                   Player('乙', size - 1, size - 1)]
+        cells = size * size
+        self._full = full = (1 << cells) - 1
+        first_row, first_col = _border_bits(size)
+        self._top = first_row
+        self._left = first_col
+        # 四个方向上可以移动的格子
+        self._open_up = full & ~first_row
+        self._open_down = full & ~(first_row << (cells - size))
+        self._open_left = full & ~first_col
+        self._open_right = full & ~(first_col << (size - 1))
+        self.areas = 1
+        self.area_sizes = [0, cells]
+        self._area_mins = [-1, 0]
+        self._area_masks = [0, full]
+        self._new_walls = []
+        self._version = 0
+        self._reachable = None
+        self._territory = None
+        # (_version, wall_top, wall_left)
+        self._wall_views = None
+        # 每个格子所在的区域，按位序号排列；区域划分变化时置为 None，需要时再生成
+        self._cells = None
+        self._map = None
+        self._init_history()
+
+    def _walls(self):
+        views = self._wall_views
+        if views is None or views[0] != self._version:
+            views = self._wall_views = (self._version, self._to_lists(self._top),
+                                        self._to_lists(self._left))
+        return views
+
+    @property
+    def wall_top(self):
+        return self._walls()[1]
+
+    @property
+    def wall_left(self):
+        return self._walls()[2]
+
+    def _cell_areas(self):
+        if self._cells is None:
+            cells = [0] * (self.size * self.size)
+            for area, mask in enumerate(self._area_masks):
+                for index in _iter_bits(mask):
+                    cells[index] = area
+            self._cells = cells
+        return self._cells
+
+    @property
+    def map(self):
+        if self._map is None:
+            cells = self._cell_areas()
+            size = self.size
+            self._map = [cells[i:i + size] for i in range(0, size * size, size)]
+        return self._map
+
+    def area_of(self, row, col):
+        return self._cell_areas()[row * self.size + col]
+
+    def _to_lists(self, bits):
+        size = self.size
+        return [[bits >> (row * size + col) & 1 == 1 for col in range(size)]
+                for row in range(size)]
+
+    def _expand(self, bits):
+        size = self.size
+        return (((bits & self._open_up) >> size) | ((bits & self._open_down) << size) |
+                ((bits & self._open_left) >> 1) | ((bits & self._open_right) << 1))
+
+    def _flood_fill(self, bits):
+        expand = self._expand
+        reached = frontier = bits
+        while frontier:
+            frontier = expand(frontier) & ~reached
+            reached |= frontier
+        return reached
+
+    def update_areas(self):
+        masks = self._area_masks
+        mins = self._area_mins
+        # 区域划分没有变化时不修改任何列表；有区域被分割时先复制再修改，
+        # 所以 _update_areas_undoable 可以直接保存旧的列表
+        split = False
+        for index, _ in self._new_walls:
+            if split or self._cells is None:
+                bit = 1 << index
+                area = next(area for area, mask in enumerate(masks) if mask & bit)
+            else:
+                area = self._cells[index]
+            # 位板上的整块填充很快，直接把所在区域拆成它的各个连通块
+            remaining = masks[area]
+            parts = []
+            while remaining:
+                part = self._flood_fill(remaining & -remaining)
+                parts.append(part)
+                remaining &= ~part
+            if len(parts) == 1:
+                continue
+            if not split:
+                split = True
+                masks = self._area_masks = masks[:]
+                mins = self._area_mins = mins[:]
+            del masks[area]
+            del mins[area]
+            for part in parts:
+                low = (part & -part).bit_length() - 1
+                position = bisect_left(mins, low)
+                mins.insert(position, low)
+                masks.insert(position, part)
+        self._new_walls.clear()
+        if split:
+            self.area_sizes[:] = [_popcount(mask) for mask in masks]
+            self.areas = len(masks) - 1
+            self._cells = self._map = None
+
+    def recompute_areas(self):
+        masks = [0]
+        mins = [-1]
+        remaining = self._full
+        while remaining:
+            low = remaining & -remaining
+            part = self._flood_fill(low)
+            masks.append(part)
+            mins.append(low.bit_length() - 1)
+            remaining &= ~part
+        self._area_masks = masks
+        self._area_mins = mins
+        self._new_walls.clear()
+        self.area_sizes[:] = [_popcount(mask) for mask in masks]
+        self.areas = len(masks) - 1
+        self._cells = self._map = None
+
+    def get_reachable_points(self, player: Player):
+        size = self.size
+        blocked = 0
+        for other in self.players:
+            if other is not player:
+                blocked |= 1 << (other.row * size + other.col)
+        reached = frontier = 1 << (player.row * size + player.col)
+        yield player.row, player.col
+        for _ in range(3):
+            frontier = self._expand(frontier) & ~reached & ~blocked
+            if not frontier:
+                break
+            reached |= frontier
+            for index in _iter_bits(frontier):
+                yield divmod(index, size)
+
+    def legal_actions(self, player: Player) -> array:
+        size = self.size
+        open_up = self._open_up
+        open_left = self._open_left
+        open_down = self._open_down
+        open_right = self._open_right
+        actions = array('I')
+        append = actions.append
+        for row, col in self.reachable_set(player):
+            index = row * size + col
+            bit = 1 << index
+            base = index * 4
+            if open_up & bit:
+                append(base)
+            if open_left & bit:
+                append(base + 1)
+            if open_down & bit:
+                append(base + 2)
+            if open_right & bit:
+                append(base + 3)
+        return actions
+
+    def reachable_points_near(self, row, col):
+        size = self.size
+        bit = 1 << (row * size + col)
+        if self._open_up & bit:
+            yield row - 1, col
+        if self._open_left & bit:
+            yield row, col - 1
+        if self._open_down & bit:
+            yield row + 1, col
+        if self._open_right & bit:
+            yield row, col + 1
+
+    def put_wall(self, player_pos, direction: Direction):
+        size = self.size
+        row, col = player_pos
+        if not (0 <= row < size and 0 <= col < size):
+            raise ValueError('there is already a wall')
+        index = row * size + col
+        bit = 1 << index
+        if direction is Direction.up and self._open_up & bit:
+            other = index - size
+        elif direction is Direction.down and self._open_down & bit:
+            other = index + size
+        elif direction is Direction.left and self._open_left & bit:
+            other = index - 1
+        elif direction is Direction.right and self._open_right & bit:
+            other = index + 1
+        else:
+            raise ValueError('there is already a wall')
+        self._set_wall(index, other, False)
+        self._new_walls.append((index, other))
+        self._version += 1
+
+    def _set_wall(self, index, other, open):
+        """
+        在相邻的格子 index 与 other 之间放置 (open 为 False) 或拆除 (open 为 True) 墙
+        """
+        first, second = min(index, other), max(index, other)
+        top = second - first != 1
+        if top:
+            masks = '_open_down', '_open_up'
+        else:
+            masks = '_open_right', '_open_left'
+        for name, cell in zip(masks, (first, second)):
+            if open:
+                setattr(self, name, getattr(self, name) | 1 << cell)
+            else:
+                setattr(self, name, getattr(self, name) & ~(1 << cell))
+        self._toggle_wall(top, second)
+
+    def _update_areas_undoable(self):
+        before = self._area_masks, self._area_mins
+        self.update_areas()
+        if self._area_masks is before[0]:
+            return None
+        return before
+
+    def _remove_wall(self, wall, before):
+        self._set_wall(*wall, True)
+        if before is not None:
+            self._area_masks, self._area_mins = before
+            self.area_sizes[:] = [_popcount(mask) for mask in self._area_masks]
+            self.areas = len(self._area_masks) - 1
+            self._cells = self._map = None
+        self._version += 1
+
+
+BACKENDS = {
+    'list': WallGame,
+    'bitboard': BitboardWallGame,
+}
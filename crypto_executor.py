@@ -0,0 +1,82 @@
+"""
+在进程池中执行 RSA 解密和密码哈希，避免阻塞事件循环
+
+同时提交的任务数不超过 max_pending，超出时调用者在 asyncio.Semaphore 上等待，
+一批集中的登录请求不会在进程池中无限堆积
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+
+import storage
+from rsa_util import RsaUtil
+
+# 工作进程中的 RsaUtil，由 _init_worker 创建
+_rsa: Optional[RsaUtil] = None
+
+
+def _init_worker(private_key_file: str):
+    global _rsa
+    _rsa = RsaUtil(company_pub_file=None, company_pri_file=private_key_file)
+
+
+def _decrypt(message) -> bytes:
+    return bytes(_rsa.decrypt_by_private_key(message))
+
+
+class CryptoExecutor:
+    def __init__(self, private_key_file: str = './private_key.pem', max_workers: Optional[int] = None,
+                 max_pending: Optional[int] = None, password_method: Optional[str] = None):
+        """
+        password_method 为新密码使用的算法，默认为 storage.PASSWORD_METHOD
+        """
+        self.password_method = password_method or storage.PASSWORD_METHOD
+        max_workers = max_workers or os.cpu_count() or 1
+        # 与 Bot 的进程池相同，工作进程不能继承服务器的套接字
+        self.executor = ProcessPoolExecutor(
+            max_workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(private_key_file,))
+        self.max_pending = max_pending or 4 * max_workers
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def _submit(self, func, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    async def decrypt(self, message) -> bytes:
+        """
+        与 RsaUtil.decrypt_by_private_key 相同
+        """
+        return await self._submit(_decrypt, message)
+
+    async def hash_password(self, raw_password) -> str:
+        """
+        计算保存在数据库中的密码，密码长度不符合要求时抛出 UserValidationError
+        """
+        return await self._submit(storage.hash_password, raw_password, self.password_method)
+
+    async def set_password(self, user: storage.User, raw_password):
+        user.password = await self.hash_password(raw_password)
+
+    async def verify_password(self, user: storage.User, raw_password) -> bool:
+        return await self._submit(storage.check_password, user.password, raw_password)
+
+    async def verify_and_upgrade(self, user: storage.User, raw_password) -> Tuple[bool, bool]:
+        """
+        验证密码，若密码正确但使用旧的算法，则用 password_method 重新计算。
+        返回 (密码是否正确, 是否重新计算了密码)，后者为真时需要保存 user
+        """
+        if not await self.verify_password(user, raw_password):
+            return False, False
+        if user.needs_rehash(self.password_method):
+            await self.set_password(user, raw_password)
+            return True, True
+        return True, False
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,241 @@
+"""
+紧凑的二进制对局记录
+
+每局记录的格式（小端）：
+
+    2s  魔数 b'WG'
+    B   版本 1
+    B   棋盘尺寸
+    B   玩家数量 n
+    H   动作数量 m
+    2n  每个玩家的初始位置 (row, col)，各一个字节
+    2n  每个玩家的得分，各两个字节
+    m   每个动作一个字节：((drow + 3) * 7 + (dcol + 3)) * 4 + DIRECTIONS.index(wall_dir)
+
+玩家每回合最多移动 3 步，所以位移在 [-3, 3] 之内。动作按 game_loop 的顺序排列，
+由谁行动由回放决定，不需要记录。多局记录直接拼接成一个归档文件
+
+    python game_record.py stats games.wgr --replay
+"""
+import argparse
+import asyncio
+import json
+import mmap
+import struct
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+
+from core import DIRECTIONS, Direction, Event, Player, WallGame
+
+MAGIC = b'WG'
+VERSION = 1
+HEADER = struct.Struct('<2sBBBH')
+MAX_STEP = 3
+SPAN = 2 * MAX_STEP + 1
+
+
+class GameRecord(NamedTuple):
+    size: int
+    positions: Tuple[Tuple[int, int], ...]
+    scores: Tuple[int, ...]
+    # 编码后的动作，从 mmap 读取时是只读的 memoryview
+    moves: Sequence[int]
+
+    def to_bytes(self) -> bytes:
+        players = len(self.positions)
+        return b''.join((
+            HEADER.pack(MAGIC, VERSION, self.size, players, len(self.moves)),
+            bytes(value for pos in self.positions for value in pos),
+            struct.pack(f'<{players}H', *self.scores),
+            bytes(self.moves),
+        ))
+
+    @classmethod
+    def from_buffer(cls, buffer, offset: int = 0) -> Tuple['GameRecord', int]:
+        """
+        从 buffer 的 offset 处读取一局记录，返回记录和下一局的位置。
+        动作是 buffer 的切片，不复制
+        """
+        magic, version, size, players, moves = HEADER.unpack_from(buffer, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'not a game record at offset {offset}')
+        offset += HEADER.size
+        flat = buffer[offset:offset + 2 * players]
+        positions = tuple((flat[i], flat[i + 1]) for i in range(0, 2 * players, 2))
+        offset += 2 * players
+        scores = struct.unpack_from(f'<{players}H', buffer, offset)
+        offset += 2 * players
+        return cls(size, positions, scores, buffer[offset:offset + moves]), offset + moves
+
+    def actions(self) -> Iterator[Tuple[Tuple[int, int], Direction]]:
+        return map(decode_move, self.moves)
+
+
+def encode_move(motions, wall_dir: Direction) -> int:
+    drow, dcol = motions
+    if not (-MAX_STEP <= drow <= MAX_STEP and -MAX_STEP <= dcol <= MAX_STEP):
+        raise ValueError(f'motions {motions} out of range')
+    return ((drow + MAX_STEP) * SPAN + dcol + MAX_STEP) * 4 + DIRECTIONS.index(wall_dir)
+
+
+def decode_move(code: int) -> Tuple[Tuple[int, int], Direction]:
+    cell, direction = divmod(code, 4)
+    drow, dcol = divmod(cell, SPAN)
+    return (drow - MAX_STEP, dcol - MAX_STEP), DIRECTIONS[direction]
+
+
+def append_to_archive(path: str, records: Iterable[GameRecord]):
+    with open(path, 'ab') as fp:
+        for record in records:
+            fp.write(record.to_bytes())
+
+
+class GameArchive:
+    """
+    服务器的对局归档，GameRoom 在每局结束时调用 append。
+    写入在单独的线程中进行；每局记录用一次 write 追加，多个进程可以共用一个归档文件
+    """
+    def __init__(self, path: str = 'games.wgr') -> None:
+        self.path = path
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='game-archive')
+        self._fp: Optional[BinaryIO] = None
+        self.records = 0
+
+    def append(self, record: GameRecord):
+        self.records += 1
+        self._executor.submit(self._write, record.to_bytes())
+
+    async def close(self, app=None):
+        await asyncio.wrap_future(self._executor.submit(self._close))
+        self._executor.shutdown()
+
+    def _write(self, data):
+        if self._fp is None:
+            self._fp = open(self.path, 'ab', buffering=0)
+        self._fp.write(data)
+
+    def _close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+def iter_archive(path: str, use_mmap: bool = True) -> Iterator[GameRecord]:
+    """
+    依次产出归档中的记录。use_mmap 为真时把文件映射到内存，不把整个文件读入，
+    此时记录的 moves 引用映射的内存，只在迭代期间有效
+    """
+    with open(path, 'rb') as fp:
+        if not use_mmap:
+            data = fp.read()
+        else:
+            try:
+                data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # 空文件不能映射
+                return
+        view = memoryview(data)
+        try:
+            offset = 0
+            while offset < len(view):
+                record, offset = GameRecord.from_buffer(view, offset)
+                yield record
+                del record
+        finally:
+            view.release()
+            if use_mmap:
+                try:
+                    data.close()
+                except BufferError:
+                    # 调用者还持有记录，映射在最后一个记录被回收时关闭
+                    pass
+
+
+def replay(record: GameRecord, backend='list') -> Tuple[int, ...]:
+    """
+    按记录重新下一遍，返回每个玩家的得分
+    """
+    players = [Player(str(i), row, col) for i, (row, col) in enumerate(record.positions)]
+    game = WallGame(record.size, players, backend=backend)
+    loop = game.game_loop()
+    actions = record.actions()
+    reply = None
+    try:
+        while True:
+            event, *args = loop.send(reply)
+            reply = None
+            if event is Event.ask_player_action:
+                if args[1]:
+                    raise ValueError(f'invalid move in record: {args[1]}')
+                reply = next(actions)
+    except StopIteration as exc:
+        scores = exc.value
+    return tuple(scores[player] for player in players)
+
+
+class ArchiveStats:
+    def __init__(self) -> None:
+        self.games = 0
+        self.lengths: Counter = Counter()
+        self.wins: Counter = Counter()
+        self.seats: Counter = Counter()
+        self.ties = 0
+
+    def add(self, record: GameRecord):
+        self.games += 1
+        self.lengths[len(record.moves)] += 1
+        best = max(record.scores)
+        winners = [seat for seat, score in enumerate(record.scores) if score == best]
+        for seat in range(len(record.scores)):
+            self.seats[seat] += 1
+        if len(winners) == 1:
+            self.wins[winners[0]] += 1
+        else:
+            self.ties += 1
+
+    def summary(self) -> Dict:
+        lengths = sorted(self.lengths.elements())
+        return {
+            'games': self.games,
+            'average_moves': sum(lengths) / self.games if self.games else 0.0,
+            'median_moves': lengths[len(lengths) // 2] if lengths else 0,
+            'max_moves': lengths[-1] if lengths else 0,
+            'tie_rate': self.ties / self.games if self.games else 0.0,
+            'win_rate_by_seat': {seat + 1: self.wins[seat] / count
+                                 for seat, count in sorted(self.seats.items())},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='困兽围斗对局记录')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    stats_parser = subparsers.add_parser('stats', help='统计归档中的对局')
+    stats_parser.add_argument('archive')
+    stats_parser.add_argument('--replay', action='store_true',
+                              help='同时回放每一局，检查得分并测量回放速度')
+    stats_parser.add_argument('--backend', default='list', help='回放使用的 WallGame 实现')
+    stats_parser.add_argument('--no-mmap', action='store_true')
+    args = parser.parse_args()
+
+    stats = ArchiveStats()
+    started = time.perf_counter()
+    moves = 0
+    for record in iter_archive(args.archive, use_mmap=not args.no_mmap):
+        stats.add(record)
+        if args.replay:
+            if replay(record, args.backend) != tuple(record.scores):
+                raise ValueError(f'record {stats.games} does not replay to its scores')
+            moves += len(record.moves)
+    elapsed = time.perf_counter() - started
+    summary = stats.summary()
+    summary['seconds'] = elapsed
+    if args.replay:
+        summary['replayed_games_per_second'] = stats.games / elapsed if elapsed else 0.0
+        summary['replayed_moves_per_second'] = moves / elapsed if elapsed else 0.0
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
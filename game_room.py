@@ -1,12 +1,26 @@
-import uuid
+import contextlib
+import itertools
 import enum
+import time
 from asyncio import Queue, create_task
 from typing import *
 
 from aiohttp.web import WebSocketResponse
 
-from core import Direction, Event, Player, WallGame
-from player_manager import PlayerManager
+from bot import Bot
+from core import Direction, Event, Player, WallGame, wall_position
+from game_record import GameArchive, GameRecord, encode_move
+from player_manager import ClosedSocket, PlayerManager
+from room_log import ActionJournal
+from sharding import LocalRegistry, RoomRegistry, new_room_id
+
+
+def _finished(value):
+    """
+    已经结束的 game_loop：第一次 send 就以 value 结束
+    """
+    return value
+    yield
 
 
 class RoomStatus(enum.Enum):
@@ -17,15 +31,22 @@ class RoomStatus(enum.Enum):
 
 class GameRoom:
     instances: 'Dict[str, GameRoom]' = {}
+    # 所有进程的房间列表，多进程部署时由 WallGameApp 替换为共享的实现
+    registry: RoomRegistry = LocalRegistry()
+    # 房间的操作日志，为 None 时不记录，由 WallGameApp 设置
+    journal: Optional[ActionJournal] = None
+    # 结束的对局写入的归档，为 None 时不记录，由 WallGameApp 设置
+    archive: Optional[GameArchive] = None
 
     @property
     def players(self):
         return self.manager.players
 
-    def __init__(self, size, name, player_positions) -> None:
-        self.id: str = str(uuid.uuid1())
+    def __init__(self, size, name, player_positions, room_id: Optional[str] = None) -> None:
+        self.id: str = room_id or new_room_id()
         self.name: str = name
         self.instances[self.id] = self
+        self.player_positions = [[row, col] for row, col in player_positions]
         players = [Player(str(i), row, col) for i, (row, col) in enumerate(player_positions, 1)]
         self.game: WallGame = WallGame(size, players)
         self.manager = PlayerManager(self.game.players)
@@ -35,9 +56,71 @@ class GameRoom:
         if len(self.players_initial_poses) != len(self.manager.players):
             raise ValueError('duplicated player_positions')
         self.task = None
+        self.created = time.time()
+        # 本局中有效的动作 (玩家序号, motions, wall_dir)
+        self.moves: List[Tuple[int, List[int], str]] = []
+        # 电脑玩家的用户名 -> 搜索预算
+        self.bots: Dict[str, float] = {}
+        # 地图消息的序号，每个 game_map_diff 加一，客户端据此发现遗漏的消息
+        self.map_seq = 0
+        self.publish()
+        self.log(self.header_record())
+
+    def summary(self) -> Dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'open': bool(self.manager.unregistered_players),
+            'users': list(self.manager.users_players),
+            'seats': len(self.players),
+            'status': self.status.value,
+            'created': self.created,
+        }
+
+    def publish(self):
+        self.registry.publish(self.id, self.summary())
+
+    def destroy(self):
+        del self.instances[self.id]
+        self.registry.remove(self.id)
+        if self.journal is not None:
+            self.journal.delete(self.id)
+
+    def header_record(self) -> Dict:
+        return {'t': 'room', 'id': self.id, 'name': self.name, 'size': self.game.size,
+                'positions': self.player_positions, 'created': self.created}
+
+    def join_record(self, user: str, player: Player) -> Dict:
+        return {'t': 'join', 'user': user, 'player': self.players.index(player),
+                'symbol': player.symbol, 'bot': self.bots.get(user)}
+
+    def journal_records(self) -> List[Dict]:
+        """
+        描述房间当前状态的最少的记录，用于改写日志
+        """
+        return [self.header_record(),
+                *(self.join_record(user, player) for user, player in self.manager.users_players.items()),
+                *({'t': 'move', 'p': index, 'm': motions, 'w': wall_dir}
+                  for index, motions, wall_dir in self.moves)]
+
+    def game_record(self, scores: Dict[Player, int]) -> GameRecord:
+        return GameRecord(self.game.size, tuple(map(tuple, self.player_positions)),
+                          tuple(scores[player] for player in self.players),
+                          bytes(encode_move(motions, Direction[wall_dir])
+                                for _, motions, wall_dir in self.moves))
+
+    def log(self, record: Dict):
+        if self.journal is not None:
+            self.journal.record(self.id, record)
+            if self.journal.needs_compaction(self.id):
+                self.journal.compact(self.id, self.journal_records())
 
     async def register_player(self, sid: str, player: Player, ws: WebSocketResponse) -> Queue:
         queue = self.manager.register_player(sid, player, ws)
+        # 必须在 await 之前判断，否则同时加入的两个玩家都会看到房间已满，开始两次游戏
+        full = not self.manager.unregistered_players
+        self.publish()
+        self.log(self.join_record(sid, player))
         await self.manager.send_to(player, {
             'event': Event.joined, 'player': player.symbol
         })
@@ -46,10 +129,25 @@ class GameRoom:
             'player': player
         })
 
-        if len(self.manager.unregistered_players) == 0:
+        if full:
             await self.start_game()
         return queue
 
+    async def add_bot(self, budget: float = 1.0) -> Player:
+        """
+        让电脑玩家占据一个空位，房间已满时抛出 IndexError
+        """
+        player = self.manager.unregistered_players[0]
+        symbols = {p.symbol for p in self.players}
+        number = next(i for i in itertools.count(1) if f'机{i}' not in symbols)
+        # 用户名包含中文，不会与真实用户重名。符号是中文加数字，User 不允许这样的符号
+        # （只能是一个字符或两个 ascii 字符），Player 按符号比较，所以也不会与真实用户的符号相同
+        user = f'电脑{number}'
+        player.symbol = f'机{number}'
+        self.bots[user] = budget
+        await self.register_player(user, player, Bot(self, user, budget))
+        return player
+
     async def start_game(self):
         await self.manager.send_to_everyone({'event': Event.game_start})
         self.task = create_task(self.game_loop())
@@ -67,13 +165,30 @@ class GameRoom:
             await self.manager.send_to(user, self.update_game_map_message())
         await self.manager.resend_messages(user)
 
-    async def game_loop(self):
+    async def resync(self, user: str):
+        """
+        客户端发现遗漏了 game_map_diff 时，重新发送完整的地图
+        """
+        await self.manager.send_to(user, self.update_game_map_message())
+
+    async def game_loop(self, resume: Optional[Tuple[Generator, Optional[Tuple]]] = None):
+        """
+        resume 为 replay 的返回值，从回放到的位置继续游戏
+        """
         self.status = RoomStatus.running
-        loop = self.game.game_loop()
+        self.publish()
+        loop, pending = resume or (self.game.game_loop(), None)
+        # 重启前已经结束的对局在结束时已写入归档
+        finished_before = resume is not None and pending is None
         reply = None
+        # 最近一次提交的动作 (玩家, 放墙方向)，收到 update_game_map 时它一定是有效的
+        last_action = None
         try:
             while True:
-                event, *args = loop.send(reply)
+                if pending is not None:
+                    (event, *args), pending = pending, None
+                else:
+                    event, *args = loop.send(reply)
                 if event is Event.ask_player_action:
                     player, msg = args
                     data = await self.manager.ask(player, {
@@ -81,17 +196,26 @@ class GameRoom:
                         'msg': msg,
                         'reachable_points': [
                             [row, col] for row, col in
-                            self.game.get_reachable_points(player)
+                            self.game.reachable_set(player)
                         ]
                     })
                     reply = data['motions'], Direction[data['wall_dir']]
+                    last_action = player, reply[1]
 
                 elif event is Event.update_game_map:
-
-                    await self.manager.send_to_everyone(self.update_game_map_message())
+                    if last_action is None:
+                        # 游戏开始时发送完整的地图，之后只发送每一步的变化
+                        await self.manager.send_to_everyone(self.update_game_map_message())
+                    else:
+                        player, wall_dir = last_action
+                        move = self.players.index(player), list(reply[0]), wall_dir.name
+                        self.moves.append(move)
+                        self.log({'t': 'move', 'p': move[0], 'm': move[1], 'w': move[2]})
+                        await self.manager.send_to_everyone(self.game_map_diff_message(*last_action))
 
                 elif event is Event.player_out:
                     player, score = args
+                    self.log({'t': 'out', 'p': self.players.index(player), 'score': score})
                     await self.manager.send_to_everyone({
                         'event': event,
                         'player': player.symbol,
@@ -100,37 +224,117 @@ class GameRoom:
 
         except StopIteration as exc:
             self.status = RoomStatus.finished
+            self.publish()
+            if self.archive is not None and not finished_before:
+                self.archive.append(self.game_record(exc.value))
             data = [[f'{self.manager.players_users[player]}({player.symbol})', score]
                     for player, score in exc.value.items()]
             data.sort(key=lambda item: item[1], reverse=True)
-            # 发送游戏结果并询问是否重新开始
-            async for user, reply in self.manager.ask_everyone({
+            # 发送游戏结果并询问是否重新开始。有人拒绝时提前退出，要立即关闭生成器，把已经收到的回答放回队列
+            async with contextlib.aclosing(self.manager.ask_everyone({
                     'event': Event.game_over,
-                    'result': data}):
-                if reply.get('agree'):
-                    await self.manager.send_to_everyone({'event': Event.agreed_restarting, 'user': user})
-                else:
-                    await self.manager.send_to_everyone({'event': 'error', 'message': f'由于{user}拒绝重新开始游戏，游戏房间将被销毁'})
-                    del self.instances[self.id]
-                    return
+                    'result': data})) as replies:
+                async for user, reply in replies:
+                    if reply.get('agree'):
+                        await self.manager.send_to_everyone({'event': Event.agreed_restarting, 'user': user})
+                    else:
+                        await self.manager.send_to_everyone({'event': 'error', 'message': f'由于{user}拒绝重新开始游戏，游戏房间将被销毁'})
+                        self.destroy()
+                        return
 
             # 重新开始
             for player, (row, col) in self.players_initial_poses.items():
                 player.row = row
                 player.col = col
+                player.status = 'normal'
             self.game.__init__(self.game.size, self.game.players)
+            self.moves = []
+            if self.journal is not None:
+                self.journal.compact(self.id, self.journal_records())
             await self.start_game()
 
+    def replay(self, moves) -> Tuple[Generator, Optional[Tuple]]:
+        """
+        把 moves 依次交给 WallGame.game_loop，返回 game_loop 生成器和它最后产出、尚未处理的事件，
+        可以传给 GameRoom.game_loop 继续游戏
+        """
+        loop = self.game.game_loop()
+        try:
+            event = loop.send(None)
+            for index, motions, wall_dir in moves:
+                while event[0] is not Event.ask_player_action:
+                    event = loop.send(None)
+                if event[1] is not self.players[index]:
+                    raise ValueError(f'room {self.id}: move by player {index} out of turn')
+                event = loop.send((motions, Direction[wall_dir]))
+                if event[0] is Event.ask_player_action:
+                    raise ValueError(f'room {self.id}: invalid move {motions} {wall_dir}')
+                self.moves.append((index, list(motions), wall_dir))
+        except StopIteration as exc:
+            return _finished(exc.value), None
+        return loop, tuple(event)
+
+    @classmethod
+    def restore(cls, journal: ActionJournal,
+                include: Callable[[str], bool] = lambda room_id: True) -> 'List[GameRoom]':
+        """
+        从 journal 中的日志恢复房间。所有玩家的连接都是断开的，需要重新连接；
+        已满的房间从回放到的位置继续游戏
+        """
+        rooms = []
+        for room_id, records in journal.load(include):
+            header, *records = records
+            room = cls.__new__(cls)
+            # 恢复期间不写日志，最后用 compact 一次写入完整的状态
+            room.journal = None
+            room.__init__(header['size'], header['name'], header['positions'], room_id=room_id)
+            room.created = header['created']
+            moves = []
+            for record in records:
+                if record['t'] == 'join':
+                    player = room.players[record['player']]
+                    player.symbol = record['symbol']
+                    if record['bot'] is not None:
+                        room.bots[record['user']] = record['bot']
+                        ws = Bot(room, record['user'], record['bot'])
+                    else:
+                        ws = ClosedSocket()
+                    room.manager.register_player(record['user'], player, ws)
+                elif record['t'] == 'move':
+                    moves.append((record['p'], record['m'], record['w']))
+            resume = room.replay(moves) if not room.manager.unregistered_players else None
+            del room.journal
+            room.publish()
+            journal.compact(room_id, room.journal_records())
+            if resume is not None:
+                room.task = create_task(room.game_loop(resume))
+            rooms.append(room)
+        return rooms
+
     def update_game_map_message(self):
         wall_top = [''.join('1' if char else '0' for char in row)
                     for row in self.game.wall_top]
         wall_left = [''.join('1' if char else '0' for char in row)
                      for row in self.game.wall_left]
-        players_info = [(player.row, player.col, player.symbol)
+        players_info = [(player.row, player.col, player.symbol, player.status)
                         for player in self.game.players]
         return {
             'event': Event.update_game_map,
+            'seq': self.map_seq,
             'wall_top': wall_top,
             'wall_left': wall_left,
             'players_info': players_info
         }
+
+    def game_map_diff_message(self, player: Player, wall_dir: Direction):
+        """
+        player 刚刚移动到当前位置，并向 wall_dir 放了一面墙
+        """
+        self.map_seq += 1
+        top, row, col = wall_position((player.row, player.col), wall_dir)
+        return {
+            'event': Event.game_map_diff,
+            'seq': self.map_seq,
+            'wall': [row, col, 'top' if top else 'left'],
+            'move': [player.row, player.col, player.symbol]
+        }
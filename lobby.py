@@ -0,0 +1,192 @@
+"""
+大厅索引
+
+房间的摘要在创建、有玩家加入、开始或结束游戏、销毁时由 GameRoom 发布到 RoomRegistry，
+LobbyIndex 随之增量维护可加入的房间集合和 用户 -> 房间 的映射，
+首页和 /lobby.json 只需要读取一页数据，不需要遍历所有房间。
+LobbyBroadcaster 把房间的变化推送给通过 /lobby/ws/ 订阅的客户端
+"""
+import asyncio
+import secrets
+import zlib
+from typing import *
+
+from player_manager import encode_frame
+
+# 排序方式 -> (排序键, 是否倒序)
+SORTS: Dict[str, Tuple[Callable[[Dict], Any], bool]] = {
+    'newest': (lambda room: (room['created'], room['id']), True),
+    'oldest': (lambda room: (room['created'], room['id']), False),
+    'name': (lambda room: (room['name'], room['id']), False),
+}
+
+
+class LobbyIndex:
+    def __init__(self) -> None:
+        self.rooms: Dict[str, Dict] = {}
+        self.open_rooms: Set[str] = set()
+        self.user_rooms: Dict[str, Set[str]] = {}
+        # 每次变化加一；nonce 区分不同的进程，避免重启后的版本号与旧的 ETag 相同
+        self.version = 0
+        self.nonce = secrets.token_hex(4)
+        # 排序方式 -> 排好序的可加入房间的 id，版本变化时清空
+        self._sorted: Dict[str, List[str]] = {}
+        # 房间变化时以 (房间 id, 摘要) 调用，房间被删除时摘要为 None
+        self.listeners: List[Callable[[str, Optional[Dict]], None]] = []
+
+    def publish(self, room_id: str, summary: Dict):
+        old = self.rooms.get(room_id)
+        if old == summary:
+            return
+        if old is not None:
+            self._unlink(room_id, old)
+        self.rooms[room_id] = summary
+        if summary['open']:
+            self.open_rooms.add(room_id)
+        for user in summary['users']:
+            self.user_rooms.setdefault(user, set()).add(room_id)
+        self._changed(room_id, summary)
+
+    def remove(self, room_id: str):
+        old = self.rooms.pop(room_id, None)
+        if old is not None:
+            self._unlink(room_id, old)
+            self._changed(room_id, None)
+
+    def sync(self, rooms: Dict[str, Dict]):
+        """
+        使索引与另一份完整的房间列表一致，只有内容不同时版本才会变化
+        """
+        for room_id in self.rooms.keys() - rooms.keys():
+            self.remove(room_id)
+        for room_id, summary in rooms.items():
+            self.publish(room_id, summary)
+
+    def _unlink(self, room_id, summary):
+        self.open_rooms.discard(room_id)
+        for user in summary['users']:
+            rooms = self.user_rooms.get(user)
+            if rooms is not None:
+                rooms.discard(room_id)
+                if not rooms:
+                    del self.user_rooms[user]
+
+    def _changed(self, room_id, summary):
+        self.version += 1
+        self._sorted.clear()
+        for listener in self.listeners:
+            listener(room_id, summary)
+
+    def sorted_open_rooms(self, sort: str = 'newest') -> List[str]:
+        ids = self._sorted.get(sort)
+        if ids is None:
+            key, reverse = SORTS[sort]
+            ids = self._sorted[sort] = sorted(
+                self.open_rooms, key=lambda room_id: key(self.rooms[room_id]), reverse=reverse)
+        return ids
+
+    def open_page(self, page: int = 1, per_page: int = 20, sort: str = 'newest') -> Dict:
+        """
+        可加入房间的第 page 页（从 1 开始）
+        """
+        ids = self.sorted_open_rooms(sort)
+        pages = max(1, -(-len(ids) // per_page))
+        page = min(max(page, 1), pages)
+        start = (page - 1) * per_page
+        return {
+            'rooms': [self.rooms[room_id] for room_id in ids[start:start + per_page]],
+            'page': page,
+            'pages': pages,
+            'total': len(ids),
+        }
+
+    def rooms_of(self, user: str) -> List[Dict]:
+        key, reverse = SORTS['newest']
+        return sorted((self.rooms[room_id] for room_id in self.user_rooms.get(user, ())),
+                      key=key, reverse=reverse)
+
+    def etag(self, *args) -> str:
+        """
+        当前版本下，由 args（页码、用户等请求参数）确定的响应的 ETag
+        """
+        params = zlib.crc32(repr(args).encode())
+        return f'"{self.nonce}-{self.version}-{params:08x}"'
+
+
+class LobbyBroadcaster:
+    """
+    每 tick 秒把这段时间内的房间变化合并为一条 lobby 消息，发给所有订阅者。
+    同一房间的多次变化只保留最后的状态：
+    {'type': 'open', 'room': 摘要}、{'type': 'filled', 'id': ...} 或 {'type': 'closed', 'id': ...}。
+    每个订阅者的队列最多积压 queue_size 条消息，队列满时清空并改为发送 lobby_reset，
+    客户端收到后重新请求 /lobby.json
+    """
+    reset_frame = encode_frame({'event': 'lobby_reset'})
+
+    def __init__(self, registry, tick: float = 0.2, queue_size: int = 16) -> None:
+        self.registry = registry
+        self.tick = tick
+        self.queue_size = queue_size
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.resets = 0
+        self._pending: Dict[str, Optional[Dict]] = {}
+        self._index: Optional[LobbyIndex] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def notify(self, room_id: str, summary: Optional[Dict]):
+        self._pending[room_id] = summary
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def _attach(self):
+        # 多进程部署时 lobby() 会与其他进程的房间同步，同步产生的变化同样会被推送
+        index = self.registry.lobby()
+        if index is not self._index:
+            if self._index is not None:
+                self._index.listeners.remove(self.notify)
+            index.listeners.append(self.notify)
+            self._index = index
+
+    def flush(self):
+        self._attach()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        if not self.subscribers:
+            return
+        changes = []
+        for room_id, summary in pending.items():
+            if summary is None:
+                changes.append({'type': 'closed', 'id': room_id})
+            elif summary['open']:
+                changes.append({'type': 'open', 'room': summary})
+            else:
+                changes.append({'type': 'filled', 'id': room_id})
+        frame = encode_frame({'event': 'lobby', 'changes': changes})
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.reset_frame)
+                self.resets += 1
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self.flush()
+
+    async def start(self, app=None):
+        self._attach()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self, app=None):
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,266 @@
+"""
+运行时的计时和计数，以 Prometheus 文本格式在 /metrics 输出
+
+默认不启用，此时热点代码没有任何改动。WallGameApp(metrics=True) 调用 install()，
+install 把以下函数替换为计时的版本，结果按阶段（phase）记录在 wallgame_phase_seconds 直方图中：
+
+    update_areas    WallGame.update_areas（所有实现）
+    encode          encode_frame（player_manager 以及按名字导入它的 lobby、app）
+    send            PlayerManager.send_to / send_to_everyone（包括编码）
+    sqlite_load     Storage.load_user（在线程池中执行）
+    sqlite_commit   Storage.save
+    rsa_decrypt     CryptoExecutor.decrypt（包括在进程池中排队的时间）
+    password        CryptoExecutor.hash_password / verify_password
+
+另外 sample_loop_lag 每隔 interval 秒测量一次事件循环的延迟，记录在 wallgame_event_loop_lag_seconds 中。
+房间的数量、按状态汇总的本局动作数和单个房间 update_areas 累计时间的最大值在输出时从 GameRoom.instances 读取。
+房间不作为标签输出，公开的服务器上房间可以任意多，每个房间一组序列会让序列的数量没有上限。
+多进程部署时每个工作进程分别统计，需要直接访问各个工作进程的 /metrics
+"""
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from typing import *
+
+# 10us 到 10s
+DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                   1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 由 install 设为 True
+enabled = False
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Series:
+    """
+    直方图中一组标签的数据
+    """
+    __slots__ = 'buckets', 'counts', 'sum', 'count', 'lock'
+
+    def __init__(self, buckets) -> None:
+        self.buckets = buckets
+        # 各个桶的计数（不累计），最后一个是 +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        """
+        只能在事件循环的线程中调用，其他线程使用 observe_locked
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_locked(self, value: float):
+        with self.lock:
+            self.observe(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], _Series] = {}
+        self._lock = threading.Lock()
+
+    def series(self, labels: Tuple[str, ...] = ()) -> _Series:
+        series = self._series.get(labels)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(labels, _Series(self.buckets))
+        return series
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()):
+        self.series(labels).observe_locked(value)
+
+    def time(self, labels: Tuple[str, ...] = ()):
+        return _Timer(self, labels)
+
+    def collect(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, series in sorted(self._series.items()):
+            with series.lock:
+                counts, total, count = list(series.counts), series.sum, series.count
+            labels = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels({**labels, 'le': _format_value(bound)})
+                yield f'{self.name}_bucket{bucket_labels} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(labels)} {count}'
+
+
+class _Timer:
+    __slots__ = 'histogram', 'labels', 'started'
+
+    def __init__(self, histogram: Histogram, labels) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, self.labels)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List[Histogram] = []
+        # 输出时调用，产出已格式化的行，用于房间数量等只在输出时计算的值
+        self.collectors: List[Callable[[], Iterable[str]]] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+PHASE_SECONDS = REGISTRY.register(Histogram(
+    'wallgame_phase_seconds', 'Time spent in each instrumented phase', ['phase']))
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    'wallgame_event_loop_lag_seconds', 'How late a periodic task woke up'))
+
+
+def instrument(owner, attr: str, phase: str, threaded: bool = False, on_self: Optional[str] = None):
+    """
+    把 owner.attr（函数或协程函数）替换为计时的版本，记录在 phase 阶段。
+    threaded 为真表示函数在线程池中执行，记录时需要加锁。
+    on_self 不为 None 时，同时把耗时累加到第一个参数的 on_self 属性上
+    """
+    func = getattr(owner, attr)
+    if getattr(func, '__instrumented__', False):
+        return
+    series = PHASE_SECONDS.series((phase,))
+    observe = series.observe_locked if threaded else series.observe
+    perf_counter = time.perf_counter
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                observe(perf_counter() - started)
+    elif on_self is not None:
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            started = perf_counter()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                elapsed = perf_counter() - started
+                observe(elapsed)
+                setattr(self, on_self, getattr(self, on_self, 0.0) + elapsed)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(perf_counter() - started)
+    wrapper.__instrumented__ = True
+    setattr(owner, attr, wrapper)
+
+
+def _collect_rooms() -> Iterator[str]:
+    from game_room import GameRoom
+
+    rooms = list(GameRoom.instances.values())
+    statuses: Dict[str, int] = {}
+    for room in rooms:
+        statuses[room.status.value] = statuses.get(room.status.value, 0) + 1
+    yield '# HELP wallgame_rooms Rooms in this process by status'
+    yield '# TYPE wallgame_rooms gauge'
+    for status, count in sorted(statuses.items()):
+        yield f'wallgame_rooms{_format_labels({"status": status})} {count}'
+    moves: Dict[str, int] = {}
+    for room in rooms:
+        moves[room.status.value] = moves.get(room.status.value, 0) + len(room.moves)
+    yield '# HELP wallgame_room_moves Moves in the current game of the rooms, by room status'
+    yield '# TYPE wallgame_room_moves gauge'
+    for status, count in sorted(moves.items()):
+        yield f'wallgame_room_moves{_format_labels({"status": status})} {count}'
+    # 所有房间的总和见 wallgame_phase_seconds{phase="update_areas"}
+    seconds = max((getattr(room.game, 'metrics_update_seconds', 0.0) for room in rooms), default=0.0)
+    yield '# HELP wallgame_room_update_areas_seconds_max Largest time spent in update_areas by one room'
+    yield '# TYPE wallgame_room_update_areas_seconds_max gauge'
+    yield f'wallgame_room_update_areas_seconds_max {_format_value(seconds)}'
+
+
+def install():
+    """
+    替换热点函数，开始统计。可以重复调用
+    """
+    global enabled
+    if enabled:
+        return
+    import app
+    import core
+    import crypto_executor
+    import lobby
+    import player_manager
+    import storage
+
+    for cls in {core.WallGame, *core.BACKENDS.values()}:
+        if 'update_areas' in vars(cls):
+            instrument(cls, 'update_areas', 'update_areas', on_self='metrics_update_seconds')
+    # lobby 和 app 用 from player_manager import encode_frame 导入，需要分别替换
+    for module in (player_manager, lobby, app):
+        instrument(module, 'encode_frame', 'encode')
+    instrument(player_manager.PlayerManager, 'send_to', 'send')
+    instrument(player_manager.PlayerManager, 'send_to_everyone', 'send')
+    instrument(storage.Storage, 'load_user', 'sqlite_load', threaded=True)
+    instrument(storage.Storage, 'save', 'sqlite_commit', threaded=True)
+    instrument(crypto_executor.CryptoExecutor, 'decrypt', 'rsa_decrypt')
+    instrument(crypto_executor.CryptoExecutor, 'hash_password', 'password')
+    instrument(crypto_executor.CryptoExecutor, 'verify_password', 'password')
+    REGISTRY.collectors.append(_collect_rooms)
+    enabled = True
+
+
+async def sample_loop_lag(interval: float = 0.1):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - expected))
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,186 @@
+"""
+用 NumPy 数组分析棋盘，可以一次处理一批局面
+
+墙保存为布尔数组 top、left，形状为 (局面数, size, size)，与 WallGame.wall_top、wall_left 的含义相同，
+第一行的上侧和第一列的左侧总是有墙。Boards 还保存各个玩家的位置，可以由 WallGame 或 GameState 构造。
+
+    label_areas       区域标记和区域大小，编号方式与 WallGame.map、area_sizes 完全相同
+    distance_maps     从给定格子出发、绕开 blocked 的最短步数，逐步做受墙限制的膨胀
+    reachable_masks   某玩家本回合可以到达的位置，与 WallGame.get_reachable_points 相同
+    scores            每个玩家所在区域的大小，即在该局面结束时各玩家的得分
+
+区域标记在每轮中先沿行、再沿列求出每段连续无墙的格子中的最小标记，然后做一次指针跳跃，
+轮数只与区域的弯折程度有关，与棋盘尺寸基本无关。
+对局中不需要本模块：WallGame.update_areas 是增量的，100x100 的棋盘上每步也只需几微秒，
+整个棋盘重新标记反而慢得多。本模块用于一次分析大量局面，或在大棋盘上从头计算。
+NumPy 是可选依赖，没有安装时导入本模块不会出错，但调用任何函数都会抛出 ImportError
+"""
+from typing import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from core import GameState, WallGame
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('numpy_engine requires numpy')
+
+
+def _unpack_bits(values: Sequence[int], size: int):
+    """
+    GameState 中的位板 -> 布尔数组 (len(values), size, size)
+    """
+    cells = size * size
+    length = (cells + 7) // 8
+    data = b''.join(value.to_bytes(length, 'little') for value in values)
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8).reshape(len(values), length),
+                         axis=1, count=cells, bitorder='little')
+    return bits.astype(bool).reshape(len(values), size, size)
+
+
+class Boards(NamedTuple):
+    """
+    一批尺寸相同、玩家数量相同的局面。positions 的形状为 (局面数, 玩家数, 2)
+    """
+    top: 'np.ndarray'
+    left: 'np.ndarray'
+    positions: 'np.ndarray'
+
+    @property
+    def size(self) -> int:
+        return self.top.shape[1]
+
+    def __len__(self):
+        return self.top.shape[0]
+
+    @classmethod
+    def from_states(cls, states: Sequence[GameState]) -> 'Boards':
+        _require_numpy()
+        size = states[0].size
+        if any(state.size != size for state in states):
+            raise ValueError('all boards must have the same size')
+        return cls(_unpack_bits([state.wall_top for state in states], size),
+                   _unpack_bits([state.wall_left for state in states], size),
+                   np.array([state.positions for state in states], dtype=np.intp).reshape(
+                       len(states), -1, 2))
+
+    @classmethod
+    def from_games(cls, games: Sequence[WallGame]) -> 'Boards':
+        return cls.from_states([game.snapshot() for game in games])
+
+
+def _run_min(values, starts):
+    """
+    values 按行优先顺序展开后，starts 为真处开始新的一段，求每段的最小值并填回该段的每个位置
+    """
+    flat = values.ravel()
+    starts = starts.ravel()
+    mins = np.minimum.reduceat(flat, np.flatnonzero(starts))
+    return mins[np.cumsum(starts) - 1].reshape(values.shape)
+
+
+def label_areas(top, left) -> Tuple['np.ndarray', 'np.ndarray']:
+    """
+    返回 (areas, area_sizes)：areas[b] 与 WallGame.map 相同，
+    area_sizes[b] 的长度为 size * size + 1，前 areas[b].max() + 1 项与 WallGame.area_sizes 相同，其余为 0
+    """
+    _require_numpy()
+    count, size, _ = top.shape
+    cells = size * size
+    top = top.copy()
+    left = left.copy()
+    top[:, 0, :] = True
+    left[:, :, 0] = True
+    # 转置后每一列成为连续的一段，上侧的墙就是段的起点
+    top_t = np.ascontiguousarray(top.transpose(0, 2, 1))
+    # labels[b, row, col] 是与该格连通的某个格子的序号，且不大于该格的序号，
+    # 收敛时同一区域的格子都等于区域中最小的序号
+    labels = np.broadcast_to(np.arange(cells, dtype=np.int32).reshape(size, size),
+                             top.shape).copy()
+    while True:
+        before = labels
+        labels = _run_min(labels, left)
+        labels = _run_min(labels.transpose(0, 2, 1).copy(), top_t).transpose(0, 2, 1)
+        flat = labels.reshape(count, cells)
+        flat = np.take_along_axis(flat, flat, axis=1)
+        labels = flat.reshape(count, size, size)
+        if np.array_equal(labels, before):
+            break
+    # 区域按最小格子的顺序从 1 开始编号
+    roots = flat == np.arange(cells, dtype=np.int32)
+    numbers = np.cumsum(roots, axis=1, dtype=np.int32)
+    areas = np.take_along_axis(numbers, flat, axis=1)
+    offsets = np.arange(count, dtype=np.int32)[:, None] * (cells + 1)
+    area_sizes = np.bincount((areas + offsets).ravel(), minlength=count * (cells + 1))
+    return areas.reshape(count, size, size), area_sizes.reshape(count, cells + 1).astype(np.int32)
+
+
+def _expand(frontier, down_open, right_open):
+    """
+    frontier 中的格子向四个方向走一步（不穿过墙）能到达的格子
+    """
+    result = np.zeros_like(frontier)
+    result[:, :-1, :] |= frontier[:, 1:, :] & down_open
+    result[:, 1:, :] |= frontier[:, :-1, :] & down_open
+    result[:, :, :-1] |= frontier[:, :, 1:] & right_open
+    result[:, :, 1:] |= frontier[:, :, :-1] & right_open
+    return result
+
+
+def distance_maps(top, left, sources, blocked=None, max_steps: Optional[int] = None) -> 'np.ndarray':
+    """
+    从 sources（布尔数组）中的格子出发到每个格子的最少步数，不能进入 blocked 中的格子，
+    到达不了或超过 max_steps 步的格子为 -1
+    """
+    _require_numpy()
+    down_open = ~top[:, 1:, :]
+    right_open = ~left[:, :, 1:]
+    distances = np.where(sources, 0, -1).astype(np.int32)
+    reached = sources.copy()
+    if blocked is not None:
+        reached |= blocked
+    frontier = sources
+    step = 0
+    while max_steps is None or step < max_steps:
+        frontier = _expand(frontier, down_open, right_open) & ~reached
+        if not frontier.any():
+            break
+        step += 1
+        reached |= frontier
+        distances[frontier] = step
+    return distances
+
+
+def _position_mask(boards: Boards, players) -> 'np.ndarray':
+    mask = np.zeros(boards.top.shape, dtype=bool)
+    positions = boards.positions[:, players]
+    batch = np.broadcast_to(np.arange(len(boards))[:, None], positions.shape[:2])
+    mask[batch, positions[..., 0], positions[..., 1]] = True
+    return mask
+
+
+def reachable_masks(boards: Boards, player: int, steps: int = 3) -> 'np.ndarray':
+    """
+    第 player 个玩家在各个局面中本回合可以到达的位置（包括当前位置），其他玩家所在的格子不能经过
+    """
+    others = [index for index in range(boards.positions.shape[1]) if index != player]
+    distances = distance_maps(boards.top, boards.left, _position_mask(boards, [player]),
+                              _position_mask(boards, others), steps)
+    return distances >= 0
+
+
+def scores(boards: Boards, areas=None) -> 'np.ndarray':
+    """
+    各个局面中每个玩家所在区域的大小，形状为 (局面数, 玩家数)。
+    areas 为 label_areas 的结果，省略时重新计算
+    """
+    if areas is None:
+        areas = label_areas(boards.top, boards.left)
+    labels, area_sizes = areas
+    batch = np.arange(len(boards))[:, None]
+    player_areas = labels[batch, boards.positions[..., 0], boards.positions[..., 1]]
+    return np.take_along_axis(area_sizes, player_areas, axis=1)
@@ -1,7 +1,28 @@
+import argparse
 import logging
 from aiohttp import web
 from app import WallGameApp
+from sharding import run_sharded
 
-logging.basicConfig(level=logging.INFO)
-app = WallGameApp()
-web.run_app(app)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='工作进程数量，大于 1 时房间按 id 分配到各个进程')
+    parser.add_argument('--metrics', action='store_true',
+                        help='统计各个阶段的耗时，在 /metrics 输出')
+    parser.add_argument('--journal-dir', default='rooms',
+                        help='房间操作日志的目录，重启后从中恢复房间；为空字符串时不记录')
+    parser.add_argument('--archive', default='games.wgr',
+                        help='结束的对局追加到这个归档文件；为空字符串时不记录')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    journal_dir = args.journal_dir or None
+    archive = args.archive or None
+    if args.workers > 1:
+        run_sharded(args.port, args.workers, metrics=args.metrics,
+                    journal_dir=journal_dir, archive=archive)
+    else:
+        app = WallGameApp(metrics=args.metrics, journal_dir=journal_dir, archive=archive)
+        web.run_app(app, port=args.port)
@@ -1,12 +1,35 @@
 import asyncio
+import contextlib
 import json
+import logging
 from asyncio import Queue
-from asyncio import wait as wait_coros
+from enum import Enum
 from typing import *
 
 from aiohttp.web import WebSocketResponse
 
-from core import Event, Player
+from core import Player
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ClosedSocket:
+    """
+    从日志恢复房间时玩家的连接：已经断开，发送的消息被丢弃，玩家可以用 reconnect 重新连接
+    """
+    closed = True
+
+    async def send_json(self, data, dumps=None):
+        pass
+
+    async def send_str(self, data):
+        pass
+
+    async def close(self, *args, **kwargs):
+        pass
 
 
 class PlayerManager:
@@ -51,7 +74,7 @@ class PlayerManager:
         if isinstance(who, Player):
             who = self.players_users[who]
         ws = self.users_sockets[who]
-        await ws.send_json(data, dumps=json_dumps)
+        await ws.send_json(data, dumps=encode_frame)
 
     async def receive_from(self, who: Player) -> Dict:
         if isinstance(who, Player):
@@ -60,20 +83,46 @@ class PlayerManager:
         return await queue.get()
 
     async def send_to_everyone(self, data: Dict):
-        await wait_coros([
-            self.send_to(player, data)
-            for player in self.players
-            if player not in self.unregistered_players
-        ])
-
-    async def receive_from_any(self, users):
-        while True:
-            for user in users:
-                try:
-                    return user, self.users_queues[user].get_nowait()
-                except asyncio.QueueEmpty:
-                    pass
-            await asyncio.sleep(0.02)
+        # 只编码一次，所有连接发送同一个文本帧
+        frame = encode_frame(data)
+        sockets = [self.users_sockets[self.players_users[player]]
+                   for player in self.players
+                   if player not in self.unregistered_players]
+        # 已断开的连接跳过，玩家重新连接后会收到完整的地图。
+        # 正在关闭的连接发送时仍可能抛出异常，不能影响其他连接
+        results = await asyncio.gather(*[ws.send_str(frame) for ws in sockets if not ws.closed],
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logging.info('broadcast to a closing socket failed: %r', result)
+
+    async def receive_from_each(self, users) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        按到达的先后顺序，依次产出 users 中每个用户发来的下一条消息
+        """
+        pending = {asyncio.ensure_future(self.users_queues[user].get()): user
+                   for user in users}
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield pending.pop(task), task.result()
+        finally:
+            # 调用者提前停止时（需要用 contextlib.aclosing 及时关闭），取消尚未完成的 Queue.get 不会丢失消息，
+            # 已经取出但还没有产出的消息放回队列的最前面
+            for task, user in pending.items():
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    self._put_back(user, task.result())
+                else:
+                    task.cancel()
+
+    def _put_back(self, user: str, message: Dict):
+        queue = self.users_queues[user]
+        rest = []
+        while not queue.empty():
+            rest.append(queue.get_nowait())
+        for item in (message, *rest):
+            queue.put_nowait(item)
 
     async def ask(self, player, data: Dict) -> Dict:
         user = self.players_users[player]
@@ -87,22 +136,27 @@ class PlayerManager:
         for user in self.users_players:
             self.users_msgs_on_recovery[user].append(data)
         await self.send_to_everyone(data)
-        users_queues = self.users_queues.copy()
-        while users_queues:
-            user, data = await self.receive_from_any(users_queues.keys())
-            del users_queues[user]
-            yield user, data
+        async with contextlib.aclosing(self.receive_from_each(list(self.users_queues))) as answers:
+            async for user, answer in answers:
+                self.users_msgs_on_recovery[user].remove(data)
+                yield user, answer
+
+
+def _json_default(obj):
+    if isinstance(obj, Enum):
+        return obj.value
+    elif isinstance(obj, Player):
+        return obj.symbol
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
 
 
-class CustomJsonEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Event):
-            obj = obj.value
-        elif isinstance(obj, Player):
-            obj = obj.symbol
-        return obj
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_json_default)
 
 
-def json_dumps(*args, **kwargs):
-    kwargs['cls'] = CustomJsonEncoder
-    return json.dumps(*args, **kwargs)
+def encode_frame(data: Dict) -> str:
+    """
+    把消息编码为 WebSocket 文本帧，安装了 orjson 时使用 orjson
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default).decode()
+    return _encoder.encode(data)
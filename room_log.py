@@ -0,0 +1,167 @@
+"""
+房间的操作日志
+
+每个房间在 directory 中有一个只追加的日志文件 {room_id}.log，每行一条 JSON 记录：
+
+    {"t": "room", "id", "name", "size", "positions", "created"}   第一行，房间的参数
+    {"t": "join", "user", "player", "symbol", "bot"}               玩家加入，bot 为电脑的预算或 null
+    {"t": "move", "p", "m", "w"}                                   第 p 个玩家的动作 (motions, wall_dir)
+    {"t": "out", "p", "score"}                                     玩家出局，回放时由 game_loop 重新得出
+
+记录先缓存在内存中，每 flush_interval 秒由一个线程批量写入并 fdatasync，一批中每个房间同步一次。
+最多同时打开 max_open_files 个日志文件，超过时关闭最久没有写入的文件。
+一个房间的记录超过 compact_every 条，或者重新开始游戏时，把日志原子地改写为
+只包含房间参数、加入的玩家和本局动作的快照，旧的对局和出局记录不再保留。
+启动时 GameRoom.restore 读取所有日志，通过 WallGame.game_loop 回放本局的动作，恢复房间
+"""
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+
+
+# macOS 没有 fdatasync
+_datasync = getattr(os, 'fdatasync', os.fsync)
+
+
+class ActionJournal:
+    def __init__(self, directory: str = 'rooms', flush_interval: float = 0.05,
+                 compact_every: int = 1000, max_open_files: int = 64) -> None:
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self.max_open_files = max_open_files
+        os.makedirs(directory, exist_ok=True)
+        # 房间 id -> 尚未写入的记录
+        self._pending: Dict[str, List[str]] = {}
+        # 房间 id -> 上次改写后追加的记录数
+        self._counts: Dict[str, int] = {}
+        # 所有文件操作都在同一个线程中按提交的顺序执行
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='room-log')
+        # 打开的日志文件，按最近写入的顺序排列
+        self._files: 'OrderedDict[str, IO[str]]' = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self.bytes_written = 0
+        self.fsyncs = 0
+
+    def path(self, room_id: str) -> str:
+        return os.path.join(self.directory, f'{room_id}.log')
+
+    @staticmethod
+    def encode(record: Dict) -> str:
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    def record(self, room_id: str, record: Dict):
+        self._pending.setdefault(room_id, []).append(self.encode(record))
+        self._counts[room_id] = self._counts.get(room_id, 0) + 1
+
+    def needs_compaction(self, room_id: str) -> bool:
+        return self._counts.get(room_id, 0) >= self.compact_every
+
+    def compact(self, room_id: str, records: List[Dict]):
+        """
+        用 records 替换房间的整个日志。records 必须反映房间的当前状态，
+        尚未写入的记录会被丢弃
+        """
+        self._pending.pop(room_id, None)
+        self._counts[room_id] = 0
+        self._executor.submit(self._rewrite, room_id, ''.join(map(self.encode, records)))
+
+    def delete(self, room_id: str):
+        self._pending.pop(room_id, None)
+        self._counts.pop(room_id, None)
+        self._executor.submit(self._delete, room_id)
+
+    def submit_pending(self) -> 'asyncio.Future':
+        pending, self._pending = self._pending, {}
+        return asyncio.wrap_future(self._executor.submit(self._append, pending))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._pending:
+                # stop 会取消这个任务，取消 wrap_future 会连带取消还在排队的写入，这批记录就丢了
+                await asyncio.shield(self.submit_pending())
+
+    async def start(self, app=None):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self, app=None):
+        if self._task is not None:
+            self._task.cancel()
+        await self.submit_pending()
+        await asyncio.wrap_future(self._executor.submit(self._close_all))
+        self._executor.shutdown()
+
+    def load(self, include: Callable[[str], bool] = lambda room_id: True) -> Iterator[Tuple[str, List[Dict]]]:
+        """
+        读取目录中的所有日志，产出 (房间 id, 记录)。最后一行不完整时（写入时进程退出）忽略它
+        """
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.log'):
+                continue
+            room_id = name[:-len('.log')]
+            if not include(room_id):
+                continue
+            records = []
+            with open(self.path(room_id), encoding='utf-8') as fp:
+                for line in fp:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+            if records and records[0].get('t') == 'room':
+                yield room_id, records
+
+    # 以下方法在日志线程中执行
+
+    def _file(self, room_id):
+        fp = self._files.pop(room_id, None)
+        if fp is None:
+            if len(self._files) >= self.max_open_files:
+                # 关闭前的写入都已经同步，直接关闭
+                _, oldest = self._files.popitem(last=False)
+                oldest.close()
+            fp = open(self.path(room_id), 'a', encoding='utf-8')
+        self._files[room_id] = fp
+        return fp
+
+    def _append(self, pending: Dict[str, List[str]]):
+        for room_id, lines in pending.items():
+            fp = self._file(room_id)
+            data = ''.join(lines)
+            fp.write(data)
+            fp.flush()
+            # 只追加内容，不需要同步修改时间等元数据
+            _datasync(fp.fileno())
+            self.bytes_written += len(data.encode())
+            self.fsyncs += 1
+
+    def _rewrite(self, room_id, data):
+        fp = self._files.pop(room_id, None)
+        if fp is not None:
+            fp.close()
+        tmp = self.path(room_id) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, self.path(room_id))
+        self.bytes_written += len(data.encode())
+        self.fsyncs += 1
+
+    def _delete(self, room_id):
+        fp = self._files.pop(room_id, None)
+        if fp is not None:
+            fp.close()
+        try:
+            os.remove(self.path(room_id))
+        except FileNotFoundError:
+            pass
+
+    def _close_all(self):
+        for fp in self._files.values():
+            fp.close()
+        self._files.clear()
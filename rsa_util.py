@@ -1,27 +1,65 @@
 import base64
+import os
+from typing import *
 
 import rsa
 from rsa import common
 
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+except ImportError:
+    serialization = padding = None
+
+# (文件名, 修改时间, 后端) -> 密钥，同一个进程中的多个 RsaUtil 只解析一次 PEM 文件
+_key_cache: Dict[Tuple[str, int, str], Any] = {}
+
+
+def _load_key(filename: str, backend: str, private: bool):
+    path = os.path.abspath(filename)
+    cache_key = path, os.stat(path).st_mtime_ns, backend
+    key = _key_cache.get(cache_key)
+    if key is None:
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        if backend == 'cryptography':
+            # 私钥对象中包含 CRT 参数，解密时直接使用
+            key = (serialization.load_pem_private_key(data, password=None) if private
+                   else serialization.load_pem_public_key(data))
+        elif private:
+            key = rsa.PrivateKey.load_pkcs1(data)
+        else:
+            key = rsa.PublicKey.load_pkcs1_openssl_pem(data)
+        _key_cache[cache_key] = key
+    return key
+
 
 class RsaUtil(object):
     def __init__(self,
                  company_pub_file='./static/public_key.pem',
-                 company_pri_file='./private_key.pem'):
-
+                 company_pri_file='./private_key.pem',
+                 backend: Optional[str] = None):
+        """
+        :param backend: 'cryptography'（安装了 cryptography 时的默认值）或纯 Python 的 'rsa'，
+            两者都使用分段的 PKCS#1 v1.5 填充，密文可以互相解密
+        """
+        if backend is None:
+            backend = 'cryptography' if padding is not None else 'rsa'
+        self.backend = backend
         if company_pub_file:
-            with open(company_pub_file, 'rb') as fp:
-                self.company_public_key = rsa.PublicKey.load_pkcs1_openssl_pem(fp.read())
+            self.company_public_key = _load_key(company_pub_file, backend, private=False)
         if company_pri_file:
-            with open(company_pri_file, 'rb') as fp:
-                self.company_private_key = rsa.PrivateKey.load_pkcs1(fp.read())
+            self.company_private_key = _load_key(company_pri_file, backend, private=True)
 
     def get_max_length(self, rsa_key, encrypt=True):
         """加密内容过长时 需要分段加密 换算每一段的长度.
             :param rsa_key: 钥匙.
             :param encrypt: 是否是加密.
         """
-        blocksize = common.byte_size(rsa_key.n)
+        if self.backend == 'cryptography':
+            blocksize = (rsa_key.key_size + 7) // 8
+        else:
+            blocksize = common.byte_size(rsa_key.n)
         reserve_size = 11  # 预留位为11
         if not encrypt:  # 解密时不需要考虑预留位
             reserve_size = 0
@@ -35,11 +73,14 @@ class RsaUtil(object):
         """
         encrypt_result = bytearray()
         max_length = self.get_max_length(self.company_public_key)
-        while message:
-            input = message[:max_length]
-            message = message[max_length:]
-            out = rsa.encrypt(input, self.company_public_key)
-            encrypt_result += out
+        key = self.company_public_key
+        view = memoryview(message)
+        for start in range(0, len(view), max_length):
+            if self.backend == 'cryptography':
+                encrypt_result += key.encrypt(bytes(view[start:start + max_length]),
+                                              padding.PKCS1v15())
+            else:
+                encrypt_result += rsa.encrypt(view[start:start + max_length], key)
         encrypt_result = base64.b64encode(encrypt_result)
         return encrypt_result
 
@@ -51,12 +92,13 @@ class RsaUtil(object):
         decrypt_result = bytearray()
 
         max_length = self.get_max_length(self.company_private_key, False)
-        decrypt_message = base64.b64decode(message)
-        while decrypt_message:
-            input = decrypt_message[:max_length]
-            decrypt_message = decrypt_message[max_length:]
-            out = rsa.decrypt(input, self.company_private_key)
-            decrypt_result += out
+        key = self.company_private_key
+        # 用 memoryview 分段，不再每次复制剩余的全部密文
+        view = memoryview(base64.b64decode(message))
+        for start in range(0, len(view), max_length):
+            if self.backend == 'cryptography':
+                decrypt_result += key.decrypt(bytes(view[start:start + max_length]),
+                                              padding.PKCS1v15())
+            else:
+                decrypt_result += rsa.decrypt(view[start:start + max_length], key)
         return decrypt_result
-
-
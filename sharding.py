@@ -0,0 +1,215 @@
+"""
+多进程部署
+
+房间按 id 分配到各个工作进程（shard_for），每个工作进程都是一个完整的 WallGameApp，
+只创建属于自己的房间。ShardRouter 监听对外的端口，把 /{room}/ 下的请求（包括 WebSocket）
+转发到房间所在的进程，其余请求轮流转发给各个进程。
+房间列表保存在 RoomRegistry 中，单进程时使用 LocalRegistry，
+多进程时使用由 multiprocessing.Manager 共享的 SharedRegistry，不需要额外的消息中间件
+"""
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import time
+import uuid
+import zlib
+from typing import *
+
+from aiohttp import ClientSession, WSMsgType, web
+from multidict import CIMultiDict
+from yarl import URL
+
+from lobby import LobbyIndex
+
+# 不属于房间的一级路径
+NON_ROOM_PATHS = {'', 'static', 'new', 'login', 'register', 'edit-profile', 'logout', 'lobby.json',
+                  'lobby', 'metrics'}
+# 逐跳首部，转发时不能原样传递
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+                      'te', 'trailers', 'transfer-encoding', 'upgrade', 'host',
+                      'content-length'}
+
+
+def shard_for(room_id: str, shards: int) -> int:
+    return zlib.crc32(room_id.encode()) % shards
+
+
+def new_room_id(shard: int = 0, shards: int = 1) -> str:
+    """
+    生成一个属于第 shard 个进程的房间 id
+    """
+    while True:
+        room_id = str(uuid.uuid1())
+        if shard_for(room_id, shards) == shard:
+            return room_id
+
+
+class RoomRegistry:
+    """
+    房间 id -> 房间摘要 {'id', 'name', 'open', 'users', 'seats', 'status', 'created'}
+    """
+
+    def publish(self, room_id: str, summary: Dict):
+        raise NotImplementedError
+
+    def remove(self, room_id: str):
+        raise NotImplementedError
+
+    def rooms(self) -> Dict[str, Dict]:
+        raise NotImplementedError
+
+    def lobby(self) -> LobbyIndex:
+        raise NotImplementedError
+
+
+class LocalRegistry(RoomRegistry):
+    def __init__(self) -> None:
+        self._index = LobbyIndex()
+
+    def publish(self, room_id, summary):
+        self._index.publish(room_id, summary)
+
+    def remove(self, room_id):
+        self._index.remove(room_id)
+
+    def rooms(self):
+        return self._index.rooms
+
+    def lobby(self):
+        return self._index
+
+
+class SharedRegistry(RoomRegistry):
+    """
+    由 multiprocessing.Manager().dict() 保存的房间列表，可以传给子进程。
+    每个进程的大厅索引最多每 refresh_interval 秒与共享的列表同步一次
+    """
+
+    def __init__(self, shared_dict, refresh_interval: float = 0.5) -> None:
+        self._rooms = shared_dict
+        self.refresh_interval = refresh_interval
+        self._index: Optional[LobbyIndex] = None
+        self._synced = 0.0
+
+    def publish(self, room_id, summary):
+        self._rooms[room_id] = summary
+        if self._index is not None:
+            self._index.publish(room_id, summary)
+
+    def remove(self, room_id):
+        self._rooms.pop(room_id, None)
+        if self._index is not None:
+            self._index.remove(room_id)
+
+    def rooms(self):
+        return self._rooms.copy()
+
+    def lobby(self):
+        if self._index is None:
+            self._index = LobbyIndex()
+        now = time.monotonic()
+        if now - self._synced >= self.refresh_interval:
+            self._index.sync(self._rooms.copy())
+            self._synced = now
+        return self._index
+
+
+class ShardRouter(web.Application):
+    def __init__(self, workers: List[URL], **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.workers = workers
+        self._next_worker = itertools.cycle(workers)
+        self.add_routes([web.route('*', '/{tail:.*}', self.proxy_handler)])
+        self.on_startup.append(self._create_session)
+        self.on_cleanup.append(self._close_session)
+        self.session: Optional[ClientSession] = None
+
+    async def _create_session(self, app):
+        self.session = ClientSession(auto_decompress=False)
+
+    async def _close_session(self, app):
+        await self.session.close()
+
+    def worker_for(self, path: str) -> URL:
+        first = path.strip('/').split('/', 1)[0]
+        if first in NON_ROOM_PATHS:
+            return next(self._next_worker)
+        return self.workers[shard_for(first, len(self.workers))]
+
+    @staticmethod
+    def forwarded_headers(headers) -> CIMultiDict:
+        return CIMultiDict((key, value) for key, value in headers.items()
+                           if key.lower() not in HOP_BY_HOP_HEADERS)
+
+    async def proxy_handler(self, request: web.Request):
+        url = self.worker_for(request.path).join(request.rel_url)
+        if request.headers.get('Upgrade', '').lower() == 'websocket':
+            return await self.proxy_websocket(request, url)
+        async with self.session.request(
+                request.method, url, headers=self.forwarded_headers(request.headers),
+                data=await request.read(), allow_redirects=False) as resp:
+            return web.Response(status=resp.status, headers=self.forwarded_headers(resp.headers),
+                                body=await resp.read())
+
+    async def proxy_websocket(self, request: web.Request, url: URL):
+        server_ws = web.WebSocketResponse()
+        await server_ws.prepare(request)
+        headers = {'Cookie': request.headers['Cookie']} if 'Cookie' in request.headers else {}
+        async with self.session.ws_connect(url, headers=headers) as client_ws:
+            async def pump(source, sink):
+                async for msg in source:
+                    if msg.type == WSMsgType.TEXT:
+                        await sink.send_str(msg.data)
+                    elif msg.type == WSMsgType.BINARY:
+                        await sink.send_bytes(msg.data)
+                await sink.close()
+
+            tasks = [asyncio.create_task(pump(server_ws, client_ws)),
+                     asyncio.create_task(pump(client_ws, server_ws))]
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                task.cancel()
+        await server_ws.close()
+        return server_ws
+
+
+def run_worker(shard: int, shards: int, port: int, registry: RoomRegistry, metrics: bool = False,
+               journal_dir: Optional[str] = None, archive: Optional[str] = None):
+    from app import WallGameApp
+
+    logging.basicConfig(level=logging.INFO)
+    app = WallGameApp(shard=shard, shards=shards, registry=registry, metrics=metrics,
+                      journal_dir=journal_dir, archive=archive)
+    web.run_app(app, host='127.0.0.1', port=port, print=None)
+
+
+def run_sharded(port: int = 8080, workers: int = 2, host: Optional[str] = None, metrics: bool = False,
+                journal_dir: Optional[str] = None, archive: Optional[str] = None):
+    """
+    启动 workers 个工作进程（端口 port + 1 到 port + workers）和对外的 ShardRouter。
+    metrics 为真时各工作进程分别在自己的端口上提供 /metrics；
+    各进程共用日志目录 journal_dir，每个进程只恢复分配给自己的房间；
+    各进程把结束的对局追加到同一个归档文件 archive
+    """
+    from app import load_secret_key
+
+    # 在启动工作进程前生成密钥，保证各进程使用同一个密钥解密会话
+    load_secret_key()
+    manager = multiprocessing.Manager()
+    registry = SharedRegistry(manager.dict())
+    processes = []
+    for shard in range(workers):
+        process = multiprocessing.Process(
+            target=run_worker,
+            args=(shard, workers, port + 1 + shard, registry, metrics, journal_dir, archive))
+        process.start()
+        processes.append(process)
+    try:
+        router = ShardRouter([URL(f'http://127.0.0.1:{port + 1 + shard}')
+                              for shard in range(workers)])
+        web.run_app(router, host=host, port=port)
+    finally:
+        for process in processes:
+            process.terminate()
+        manager.shutdown()
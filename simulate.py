@@ -0,0 +1,239 @@
+"""
+批量模拟对局，用于调整棋盘尺寸和玩家初始位置
+
+    python simulate.py --games 10000 --size 7 --players 2 --policies random greedy
+
+--archive 把所有对局写入对局归档，可以用 game_record.py 分析和回放
+
+每局的随机种子由 --seed 和对局序号决定，相同参数的两次运行结果完全相同
+"""
+import argparse
+import json
+import random
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+
+from core import Direction, Event, Player, WallGame
+from game_record import GameRecord, append_to_archive, encode_move
+
+
+class GameResult(NamedTuple):
+    index: int
+    seed: str
+    positions: Tuple[Tuple[int, int], ...]
+    moves: int
+    scores: Tuple[int, ...]
+    # 按 game_record 的格式编码的动作
+    actions: bytes = b''
+
+    def record(self, size) -> GameRecord:
+        return GameRecord(size, self.positions, self.scores, self.actions)
+
+
+def random_policy(game: WallGame, player: Player, rng: random.Random):
+    return game.decode_action(rng.choice(game.legal_actions(player)))
+
+
+def greedy_policy(game: WallGame, player: Player, rng: random.Random):
+    """
+    选择放墙后自己所在区域平均每人面积最大的动作，分数相同时随机选择
+    """
+    best_score = None
+    best = []
+    for action in game.legal_actions(player):
+        score = _share_after_wall(game, player, *game.decode_action(action))
+        if best_score is None or score > best_score:
+            best_score = score
+            best = [action]
+        elif score == best_score:
+            best.append(action)
+    return game.decode_action(rng.choice(best))
+
+
+def _share_after_wall(game: WallGame, player: Player, pos, direction):
+    """
+    player 移动到 pos 并向 direction 放墙后，pos 所在区域的面积除以区域内的玩家数
+    """
+    row, col = pos
+    other = {
+        Direction.up: (row - 1, col),
+        Direction.down: (row + 1, col),
+        Direction.left: (row, col - 1),
+        Direction.right: (row, col + 1),
+    }[direction]
+    wall = {pos, other}
+    area = game.area_of(row, col)
+    others = [(p.row, p.col) for p in game.players if p is not player]
+    # 与 WallGame._split_area 相同的双向搜索，只是把新墙当作已经存在
+    seen_a = {pos}
+    seen_b = {other}
+    queue_a = deque((pos,))
+    queue_b = deque((other,))
+    sides = ((queue_a, seen_a, seen_b), (queue_b, seen_b, seen_a))
+    while queue_a and queue_b:
+        for queue, seen, opposite in sides:
+            cell = queue.popleft()
+            for point in game.reachable_points_near(*cell):
+                if cell in wall and point in wall:
+                    continue
+                if point in opposite:
+                    # 没有分割区域
+                    members = sum(game.area_of(*p) == area for p in others) + 1
+                    return game.area_sizes[area] / members
+                if point not in seen:
+                    seen.add(point)
+                    queue.append(point)
+    if not queue_a:
+        members = sum(p in seen_a for p in others) + 1
+        return len(seen_a) / members
+    members = sum(game.area_of(*p) == area and p not in seen_b for p in others) + 1
+    return (game.area_sizes[area] - len(seen_b)) / members
+
+
+POLICIES: Dict[str, Callable] = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+}
+
+
+def random_positions(size, players, rng: random.Random):
+    cells = rng.sample(range(size * size), players)
+    return tuple(divmod(cell, size) for cell in cells)
+
+
+def play_game(index, seed, size, positions, policies, backend='list') -> GameResult:
+    rng = random.Random(seed)
+    if isinstance(positions, int):
+        positions = random_positions(size, positions, rng)
+    players = [Player(str(i), row, col) for i, (row, col) in enumerate(positions, 1)]
+    seats = {player: POLICIES[policies[i % len(policies)]]
+             for i, player in enumerate(players)}
+    game = WallGame(size, players, backend=backend)
+    loop = game.game_loop()
+    reply = None
+    actions = bytearray()
+    try:
+        while True:
+            event, *args = loop.send(reply)
+            if event is Event.ask_player_action:
+                player, message = args
+                if message:
+                    raise RuntimeError(f'policy made an invalid action: {message}')
+                (row, col), direction = seats[player](game, player, rng)
+                reply = (row - player.row, col - player.col), direction
+                actions.append(encode_move(*reply))
+    except StopIteration as exc:
+        scores = exc.value
+    return GameResult(index, seed, tuple(positions), len(actions),
+                      tuple(scores[player] for player in players), bytes(actions))
+
+
+def _play_batch(args):
+    indexes, seed, size, positions, policies, backend = args
+    return [play_game(index, f'{seed}-{index}', size, positions, policies, backend)
+            for index in indexes]
+
+
+def simulate(games, size=7, positions=2, policies=('random',), seed=0,
+             workers=None, batch_size=50, backend='list') -> Iterator[GameResult]:
+    """
+    模拟 games 局对局，按对局序号顺序逐个产出结果。
+    positions 为玩家初始位置的列表，或为玩家数量（此时每局随机选取初始位置）；
+    policies 按座位循环分配给各玩家；workers 为 1 时不使用进程池
+    """
+    batches = [(range(start, min(start + batch_size, games)), seed, size,
+                positions, tuple(policies), backend)
+               for start in range(0, games, batch_size)]
+    if workers == 1:
+        for batch in batches:
+            yield from _play_batch(batch)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        for results in executor.map(_play_batch, batches):
+            yield from results
+
+
+class SimulationStats:
+    def __init__(self) -> None:
+        self.games = 0
+        self.moves = 0
+        self.started = time.perf_counter()
+        self.scores: Dict[int, Counter] = {}
+        self.wins: Counter = Counter()
+        self.ties = 0
+
+    def add(self, result: GameResult):
+        self.games += 1
+        self.moves += result.moves
+        best = max(result.scores)
+        winners = [seat for seat, score in enumerate(result.scores) if score == best]
+        if len(winners) == 1:
+            self.wins[winners[0]] += 1
+        else:
+            self.ties += 1
+        for seat, score in enumerate(result.scores):
+            self.scores.setdefault(seat, Counter())[score] += 1
+
+    def summary(self) -> Dict:
+        elapsed = time.perf_counter() - self.started
+        seats = {}
+        for seat, counter in sorted(self.scores.items()):
+            total = sum(counter.values())
+            ordered = sorted(counter.elements())
+            seats[seat + 1] = {
+                'mean': sum(ordered) / total,
+                'min': ordered[0],
+                'median': ordered[total // 2],
+                'max': ordered[-1],
+                'win_rate': self.wins[seat] / self.games,
+                'distribution': dict(sorted(counter.items())),
+            }
+        return {
+            'games': self.games,
+            'seconds': elapsed,
+            'games_per_second': self.games / elapsed if elapsed else 0.0,
+            'average_moves': self.moves / self.games if self.games else 0.0,
+            'tie_rate': self.ties / self.games if self.games else 0.0,
+            'seats': seats,
+        }
+
+
+def _counted(stats: SimulationStats, result: GameResult) -> GameResult:
+    stats.add(result)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量模拟困兽围斗对局')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=7)
+    parser.add_argument('--players', type=int, default=2,
+                        help='玩家数量，未指定 --positions 时每局随机选取初始位置')
+    parser.add_argument('--positions', type=json.loads, default=None,
+                        help='玩家初始位置，如 "[[0, 0], [6, 6]]"')
+    parser.add_argument('--policies', nargs='+', choices=sorted(POLICIES), default=['random'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--backend', default='list')
+    parser.add_argument('--archive', default=None, help='把对局追加到这个归档文件')
+    args = parser.parse_args()
+
+    positions = tuple(map(tuple, args.positions)) if args.positions else args.players
+    stats = SimulationStats()
+    results = simulate(args.games, args.size, positions, args.policies, args.seed,
+                       args.workers, args.batch_size, args.backend)
+    if args.archive:
+        # 边统计边写入，不把所有结果留在内存中
+        append_to_archive(args.archive, (_counted(stats, result).record(args.size)
+                                         for result in results))
+    else:
+        for result in results:
+            stats.add(result)
+    print(json.dumps(stats.summary(), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+var lobby_ws;
+var lobby_page;
+var lobby_per_page = 20;
+
+function room_item(room) {
+    var li = document.createElement('li');
+    li.id = 'room-' + room.id;
+    var a = document.createElement('a');
+    a.href = room.id + '/';
+    a.innerText = room.name;
+    li.appendChild(a);
+    return li;
+}
+
+function update_empty_hint() {
+    var list = document.getElementById('available-rooms');
+    document.getElementById('no-rooms').hidden = list.children.length > 0;
+}
+
+function render_rooms(rooms) {
+    var list = document.getElementById('available-rooms');
+    list.innerHTML = '';
+    for (var i = 0; i < rooms.length; i++) {
+        list.appendChild(room_item(rooms[i]));
+    }
+    update_empty_hint();
+}
+
+function refresh_lobby() {
+    fetch('/lobby.json?page=' + lobby_page + '&per_page=' + lobby_per_page)
+        .then(function (resp) { return resp.json(); })
+        .then(function (data) { render_rooms(data.rooms); });
+}
+
+function apply_lobby_changes(changes) {
+    var list = document.getElementById('available-rooms');
+    for (var i = 0; i < changes.length; i++) {
+        var change = changes[i];
+        var id = change.type == 'open' ? change.room.id : change.id;
+        var old = document.getElementById('room-' + id);
+        if (change.type == 'open') {
+            if (old) {
+                list.replaceChild(room_item(change.room), old);
+            } else if (lobby_page == 1) {
+                // 新房间排在第一页的最前面
+                list.insertBefore(room_item(change.room), list.firstChild);
+                if (list.children.length > lobby_per_page) {
+                    list.removeChild(list.lastChild);
+                }
+            }
+        } else if (old) {
+            list.removeChild(old);
+        }
+    }
+    update_empty_hint();
+}
+
+function connect_lobby() {
+    var url = (location.protocol == 'https:' ? 'wss://' : 'ws://') + location.host + '/lobby/ws/';
+    lobby_ws = new WebSocket(url);
+    lobby_ws.onopen = function () {
+        // 页面渲染之后到连接建立之前的变化没有推送，重新获取一次
+        refresh_lobby();
+    };
+    lobby_ws.onmessage = function (e) {
+        var data = JSON.parse(e.data);
+        if (data.event == 'lobby') {
+            apply_lobby_changes(data.changes);
+        } else if (data.event == 'lobby_reset') {
+            refresh_lobby();
+        }
+    };
+    lobby_ws.onclose = function () {
+        setTimeout(connect_lobby, 3000);
+    };
+}
+
+function init_lobby(page) {
+    lobby_page = page;
+    connect_lobby();
+}
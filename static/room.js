@@ -8,6 +8,8 @@ var g_reachable_points;
 var chosen_pos;
 var current_pos;
 var decided_restarting;
+var map_seq = -1;
+var resyncing = false;
 var DIRS = ['left', 'right', 'top', 'bottom'];
 
 function put_message(message) {
@@ -163,6 +165,80 @@ function show_game_over_dialog(players_scores) {
     ]);
 }
 
+function get_cell(row, col) {
+    var game_board = document.getElementById('game-board');
+    var row_ele = game_board.children[row];
+    return row_ele ? row_ele.children[col] : undefined;
+}
+
+function add_class(cell, class_) {
+    if (cell && !cell.classList.contains(class_)) {
+        cell.classList.add(class_);
+    }
+}
+
+function place_player(row, col, player) {
+    var ele = document.createElement('span');
+    ele.innerText = player;
+    ele.classList.add('player-display');
+    ele.addEventListener('click', function () {
+        this.parentNode.click();
+    })
+    get_cell(row, col).appendChild(ele);
+    if (player == current_player) {
+        current_pos = [row, col];
+    }
+}
+
+function render_game_map(data) {
+    for (var i = 0; i < room_size; i++) {
+        for (var j = 0; j < room_size; j++) {
+            var cell = get_cell(i, j);
+            cell.innerText = '';
+            for (var k = 0; k < DIRS.length; k++) {
+                cell.classList.remove('cell-wall-' + DIRS[k]);
+            }
+            if (data.wall_top[i][j] == '1') {
+                add_class(cell, 'cell-wall-top');
+            }
+            if (data.wall_left[i][j] == '1') {
+                add_class(cell, 'cell-wall-left');
+            }
+            if (data.wall_top[i + 1] == null || data.wall_top[i + 1][j] == '1') {
+                add_class(cell, 'cell-wall-bottom');
+            }
+            if (data.wall_left[i][j + 1] == '1' || data.wall_left[i][j + 1] == null) {
+                add_class(cell, 'cell-wall-right');
+            }
+        }
+    }
+    for (var i = 0; i < data.players_info.length; i++) {
+        place_player(data.players_info[i][0], data.players_info[i][1], data.players_info[i][2]);
+    }
+    map_seq = data.seq;
+    resyncing = false;
+}
+
+function apply_game_map_diff(data) {
+    var row = data.wall[0], col = data.wall[1];
+    if (data.wall[2] == 'top') {
+        add_class(get_cell(row, col), 'cell-wall-top');
+        add_class(get_cell(row - 1, col), 'cell-wall-bottom');
+    } else {
+        add_class(get_cell(row, col), 'cell-wall-left');
+        add_class(get_cell(row, col - 1), 'cell-wall-right');
+    }
+    var player = data.move[2];
+    var eles = document.querySelectorAll('#game-board .player-display');
+    for (var i = 0; i < eles.length; i++) {
+        if (eles[i].innerText == player) {
+            eles[i].parentNode.removeChild(eles[i]);
+        }
+    }
+    place_player(data.move[0], data.move[1], player);
+    map_seq = data.seq;
+}
+
 function setup_websocket(url, reconnect) {
     if (reconnect == undefined) {
         reconnect = false;
@@ -214,49 +290,20 @@ function setup_websocket(url, reconnect) {
             put_message('游戏排名：\n' + output.join('\n'));
             show_game_over_dialog(players_scores)
         } else if (data.event == 'update_game_map') {
-            var game_board = document.getElementById('game-board');
-
-            function add_class(cell, class_) {
-                if (!cell.classList.contains(class_)) {
-                    cell.classList.add(class_);
-                }
-            }
-
-            for (var i = 0; i < room_size; i++) {
-                var row = game_board.children[i];
-                for (var j = 0; j < room_size; j++) {
-                    var cell = row.children[j];
-                    cell.innerText = '';
-                    if (data.wall_top[i][j] == '1') {
-                        add_class(cell, 'cell-wall-top');
-                    }
-                    if (data.wall_left[i][j] == '1') {
-                        add_class(cell, 'cell-wall-left');
-                    }
-                    if (data.wall_top[i + 1] == null || data.wall_top[i + 1][j] == '1') {
-                        add_class(cell, 'cell-wall-bottom');
-                    }
-                    if (data.wall_left[i][j + 1] == '1' || data.wall_left[i][j + 1] == null) {
-                        add_class(cell, 'cell-wall-right');
-                    }
-                }
+            render_game_map(data);
+        } else if (data.event == 'game_map_diff') {
+            if (data.seq <= map_seq) {
+                return;
             }
-            var row, col, player;
-            for (var i = 0; i < data.players_info.length; i++) {
-                row = data.players_info[i][0];
-                col = data.players_info[i][1];
-                player = data.players_info[i][2];
-                var ele = document.createElement('span');
-                ele.innerText = player;
-                ele.classList.add('player-display');
-                ele.addEventListener('click', function () {
-                    this.parentNode.click();
-                })
-                game_board.children[row].children[col].appendChild(ele);
-                if (player == current_player) {
-                    current_pos = [row, col];
+            if (data.seq != map_seq + 1) {
+                // 遗漏了消息，请求完整的地图
+                if (!resyncing) {
+                    resyncing = true;
+                    ws.send(JSON.stringify({ resync: true }));
                 }
+                return;
             }
+            apply_game_map_diff(data);
         } else if (data.event == 'player_out') {
             if (data.player == current_player) {
                 put_message('您（' + data.player + '）已出局');
@@ -0,0 +1,49 @@
+"""
+带内容哈希的静态文件地址
+
+模板中使用 static_url('css/base.css')，得到 /static/css/base.css?v=<哈希>。
+请求带有当前的哈希时，响应带有一年的 Cache-Control，浏览器不会再验证；
+文件内容变化后哈希随之变化，页面引用的是新的地址。
+使用查询参数而不是改文件名，CSS 中的相对路径不受影响。
+哈希在第一次使用时计算并一直保留，修改静态文件后需要重启服务器
+"""
+import hashlib
+import os
+from typing import *
+
+from aiohttp import web
+
+LONG_CACHE = 'public, max-age=31536000, immutable'
+
+
+class StaticAssets:
+    def __init__(self, directory: str = './static', prefix: str = '/static/') -> None:
+        self.directory = directory
+        self.prefix = prefix
+        # 相对路径 -> 哈希，文件不存在时为 None
+        self._digests: Dict[str, Optional[str]] = {}
+
+    def digest(self, path: str) -> Optional[str]:
+        try:
+            return self._digests[path]
+        except KeyError:
+            pass
+        try:
+            with open(os.path.join(self.directory, path), 'rb') as fp:
+                digest = hashlib.sha256(fp.read()).hexdigest()[:12]
+        except OSError:
+            digest = None
+        self._digests[path] = digest
+        return digest
+
+    def url(self, path: str) -> str:
+        digest = self.digest(path)
+        if digest is None:
+            return self.prefix + path
+        return f'{self.prefix}{path}?v={digest}'
+
+    async def on_response_prepare(self, request: web.Request, response: web.StreamResponse):
+        if (response.status == 200 and 'v' in request.query
+                and request.path.startswith(self.prefix)
+                and request.query['v'] == self._digests.get(request.path[len(self.prefix):])):
+            response.headers['Cache-Control'] = LONG_CACHE
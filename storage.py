@@ -1,9 +1,15 @@
+import asyncio
 import atexit
 import base64
 import hashlib
+import hmac
 import secrets
 import sqlite3
 import string
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import *
 
 
@@ -11,21 +17,162 @@ class UserValidationError(ValueError):
     pass
 
 
+# 新密码使用的算法，格式为 scrypt-n-r-p 或 pbkdf2_<hash>-<iterations>，
+# 其余的算法名（如旧的 sha256）表示 hashlib.new(method, salt + password)
+PASSWORD_METHOD = 'scrypt-16384-8-1'
+SALT_LENGTH = 16
+SALT_CHOICES = (string.ascii_letters + string.digits).encode()
+
+
+def password_digest(method: str, salt: bytes, raw_password: Union[str, bytes]) -> bytes:
+    if isinstance(raw_password, str):
+        raw_password = raw_password.encode()
+    if method.startswith('scrypt-'):
+        n, r, p = map(int, method.split('-')[1:])
+        return hashlib.scrypt(raw_password, salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r + 1024 * 1024, dklen=32)
+    if method.startswith('pbkdf2_'):
+        name, iterations = method[len('pbkdf2_'):].split('-')
+        return hashlib.pbkdf2_hmac(name, raw_password, salt, int(iterations))
+    ha = hashlib.new(method, salt)
+    ha.update(raw_password)
+    return ha.digest()
+
+
+def hash_password(raw_password: Union[str, bytes], method: Optional[str] = None) -> str:
+    """
+    返回保存在数据库中的 method:salt:digest，计算量较大，应在 crypto_executor 中调用
+    """
+    if not 4 <= len(raw_password) <= 60:
+        raise UserValidationError('密码长度必须在闭区间4到60之间')
+    method = method or PASSWORD_METHOD
+    salt = bytes(secrets.choice(SALT_CHOICES) for _ in range(SALT_LENGTH))
+    digest = password_digest(method, salt, raw_password)
+    return f'{method}:{salt.decode()}:{base64.b64encode(digest).decode()}'
+
+
+def check_password(password: str, raw_password: Union[str, bytes]) -> bool:
+    method, salt, digest = password.split(':')
+    return hmac.compare_digest(password_digest(method, salt.encode(), raw_password),
+                               base64.b64decode(digest.encode()))
+
+
+class UserCache:
+    """
+    线程安全的 LRU 缓存：用户名 -> User，超过 maxsize 时淘汰最久未使用的记录，
+    记录在 ttl 秒后过期。存入和取出的都是副本，修改取出的 User 不影响缓存。
+
+    从数据库读取前先用 generation 取得用户的版本，读取后把版本传给 put：
+    读取期间用户被 invalidate 过时，读到的可能是旧的记录，put 不会存入它
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._users: 'OrderedDict[str, Tuple[float, User]]' = OrderedDict()
+        self._lock = threading.Lock()
+        # 用户名 -> invalidate 的次数。记录太多时清空并增加 _epoch，此前取得的版本全部作废
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, name: str) -> Optional['User']:
+        with self._lock:
+            entry = self._users.get(name)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, user = entry
+            if expires < time.monotonic():
+                del self._users[name]
+                self.misses += 1
+                return None
+            self._users.move_to_end(name)
+            self.hits += 1
+            return user.copy()
+
+    def generation(self, name: str) -> Tuple[int, int]:
+        with self._lock:
+            return self._epoch, self._generations.get(name, 0)
+
+    def put(self, user: 'User', generation: Optional[Tuple[int, int]] = None):
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(user.name, 0)):
+                return
+            self._users[user.name] = time.monotonic() + self.ttl, user.copy()
+            self._users.move_to_end(user.name)
+            while len(self._users) > self.maxsize:
+                self._users.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, name: str):
+        with self._lock:
+            self._users.pop(name, None)
+            if name not in self._generations and len(self._generations) >= self.maxsize:
+                self._generations.clear()
+                self._epoch += 1
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._users), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
 class Storage:
-    def __init__(self, filename: str = 'db.sqlite3'):
+    def __init__(self, filename: str = 'db.sqlite3', check_same_thread: bool = True,
+                 cache: Optional[UserCache] = None):
+        """
+        cache 可以由多个 Storage 共用，写操作会使其中对应的记录失效
+        """
         self.filename: str = filename
-        self.conn = sqlite3.connect(filename)
+        self.cache = cache
+        # 尚未提交的写操作涉及的用户，提交后再次使缓存失效，
+        # 以免其他连接在提交前把旧的记录读进缓存
+        self._dirty: Set[str] = set()
+        self.conn = sqlite3.connect(filename, check_same_thread=check_same_thread)
+        # WAL 模式下读不阻塞写，写也不阻塞读
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
         atexit.register(self.save)
 
     def get_user(self, name) -> 'User':
+        if self.cache is not None:
+            user = self.cache.get(name)
+            if user is not None:
+                return user
+        return self.load_user(name)
+
+    def load_user(self, name) -> 'User':
+        """
+        不经过缓存，从数据库读取用户，并放入缓存
+        """
+        # 必须在查询之前取得版本，否则查询和 put 之间提交的修改不会被发现
+        generation = self.cache.generation(name) if self.cache is not None else None
         try:
             data = self.conn.execute(
                 'SELECT name, symbol, password FROM User WHERE name=?', (name,)).fetchall()
-            return User(*data[0])
+            user = User(*data[0])
         except IndexError:
             raise UserValidationError("用户不存在")
+        if self.cache is not None:
+            self.cache.put(user, generation)
+        return user
+
+    def _invalidate(self, name):
+        if self.cache is not None:
+            self.cache.invalidate(name)
+            self._dirty.add(name)
 
     def update_user(self, user: 'User'):
+        self._invalidate(user.name)
         try:
             self.conn.execute('UPDATE User SET name=?, symbol=?, password=? WHERE name=?',
                               (user.name, user.symbol, user.password, user.name))
@@ -36,6 +183,7 @@ class Storage:
                 raise UserValidationError("用户名已被其他用户占用")
 
     def new_user(self, user: 'User'):
+        self._invalidate(user.name)
         try:
             self.conn.execute('INSERT INTO User (name, symbol, password) VALUES (?, ?, ?)',
                               (user.name, user.symbol, user.password))
@@ -47,6 +195,103 @@ class Storage:
 
     def save(self):
         self.conn.commit()
+        for name in self._dirty:
+            self.cache.invalidate(name)
+        self._dirty.clear()
+
+    def close(self):
+        atexit.unregister(self.save)
+        self.save()
+        self.conn.close()
+
+
+class AsyncStorage:
+    """
+    在线程池中执行查询的 Storage，供事件循环中的代码使用。
+
+    查询由 readers 个线程执行，每个线程有自己的连接；
+    所有写操作都在同一个写线程中执行，写完后等待提交。
+    commit_delay 秒内的写操作共用一次提交
+    """
+
+    def __init__(self, filename: str = 'db.sqlite3', readers: int = 4,
+                 commit_delay: float = 0.005, cache_size: int = 1024, cache_ttl: float = 300.0):
+        """
+        cache_size 为 0 时不使用缓存
+        """
+        self.filename = filename
+        self.commit_delay = commit_delay
+        self.cache: Optional[UserCache] = UserCache(cache_size, cache_ttl) if cache_size else None
+        self._local = threading.local()
+        self._readers: List[Storage] = []
+        self._read_executor = ThreadPoolExecutor(readers, thread_name_prefix='storage-reader')
+        self._write_executor = ThreadPoolExecutor(1, thread_name_prefix='storage-writer')
+        self._writer: Optional[Storage] = None
+        self._commit: Optional[asyncio.Future] = None
+        self.commits = 0
+
+    def _reader(self) -> Storage:
+        storage = getattr(self._local, 'storage', None)
+        if storage is None:
+            storage = self._local.storage = Storage(self.filename, False, self.cache)
+            self._readers.append(storage)
+        return storage
+
+    def _get_writer(self) -> Storage:
+        if self._writer is None:
+            self._writer = Storage(self.filename, False, self.cache)
+        return self._writer
+
+    async def _read(self, method: str, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._read_executor, lambda: getattr(self._reader(), method)(*args))
+
+    async def _write(self, method: str, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._write_executor, lambda: getattr(self._get_writer(), method)(*args))
+
+    async def get_user(self, name) -> 'User':
+        # 命中缓存时不需要切换到线程池
+        if self.cache is not None:
+            user = self.cache.get(name)
+            if user is not None:
+                return user
+        return await self._read('load_user', name)
+
+    async def new_user(self, user: 'User'):
+        await self._write('new_user', user)
+        await self.save()
+
+    async def update_user(self, user: 'User'):
+        await self._write('update_user', user)
+        await self.save()
+
+    async def save(self):
+        """
+        提交此前的所有写操作，同时调用的 save 共用一次提交
+        """
+        if self._commit is None:
+            self._commit = asyncio.ensure_future(self._delayed_commit())
+        await asyncio.shield(self._commit)
+
+    async def _delayed_commit(self):
+        await asyncio.sleep(self.commit_delay)
+        # 此后开始的写操作由下一次提交负责
+        self._commit = None
+        self.commits += 1
+        await self._write('save')
+
+    async def close(self):
+        if self._commit is not None:
+            await self._commit
+        if self._writer is not None:
+            await self._write('close')
+        self._write_executor.shutdown()
+        self._read_executor.shutdown()
+        for storage in self._readers:
+            storage.close()
 
 
 class User:
@@ -102,21 +347,23 @@ class User:
             raise UserValidationError('符号必须为一个全角字符或一到两个ascii字符')
 
     def verify_password(self, raw_password):
-        ha = hashlib.new(self.pwd_method, self.pwd_salt)
-        ha.update(raw_password.encode() if isinstance(
-            raw_password, str) else raw_password)
-        return ha.digest() == self.pwd_digest
-
-    def set_password(self, raw_password, method='sha256'):
-        if not 4 <= len(raw_password) <= 60:
-            raise UserValidationError('密码长度必须在闭区间4到60之间')
-        salt = bytes(secrets.choice(self.salt_choices) for _ in range(4))
-        ha = hashlib.new(method, salt)
-        ha.update(raw_password.encode() if isinstance(
-            raw_password, str) else raw_password)
-        self.pwd_method = method
-        self.pwd_salt = salt
-        self.pwd_digest = ha.digest()
+        return hmac.compare_digest(
+            password_digest(self.pwd_method, self.pwd_salt, raw_password), self.pwd_digest)
+
+    def set_password(self, raw_password, method=None):
+        self.password = hash_password(raw_password, method)
+
+    def needs_rehash(self, method=None) -> bool:
+        """
+        密码是否由旧的或参数不同的算法计算，登录成功后应重新计算
+        """
+        return self.pwd_method != (method or PASSWORD_METHOD)
+
+    def copy(self) -> 'User':
+        user = User.__new__(User)
+        for slot in self.__slots__:
+            setattr(user, slot, getattr(self, slot))
+        return user
 
     def __eq__(self, o: 'User') -> bool:
         return self.name == o.name
@@ -124,4 +371,4 @@ class User:
     def __hash__(self) -> int:
         return hash(self.name)
 
-    salt_choices = (string.ascii_letters + string.digits).encode()
+    salt_choices = SALT_CHOICES
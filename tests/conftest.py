@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 仓库中的模块都在顶层，直接以 pytest 运行时把仓库根目录加入搜索路径
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='module')
+def key_files(tmp_path_factory):
+    """
+    新生成的 1024 位密钥对，(公钥文件, 私钥文件)
+    """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    path = tmp_path_factory.mktemp('keys')
+    key = rsa.generate_private_key(public_exponent=65537, key_size=1024)
+    (path / 'private_key.pem').write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption()))
+    (path / 'public_key.pem').write_bytes(key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo))
+    return str(path / 'public_key.pem'), str(path / 'private_key.pem')
+
+
+@pytest.fixture
+def room_state(monkeypatch):
+    """
+    WallGameApp 会修改 GameRoom 的类属性，测试结束后恢复
+    """
+    from game_room import GameRoom
+
+    monkeypatch.setattr(GameRoom, 'instances', {})
+    for name in ('registry', 'journal', 'archive'):
+        monkeypatch.setattr(GameRoom, name, getattr(GameRoom, name))
+
+
+@pytest.fixture
+def make_app(monkeypatch, tmp_path, room_state):
+    """
+    构造 WallGameApp 的函数：密钥固定，数据库在临时目录中
+    """
+    import app as app_module
+    from storage import AsyncStorage
+
+    # 模板和静态文件的路径是相对于仓库根目录的
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(app_module, 'load_secret_key', lambda: bytes(32))
+    db = str(tmp_path / 'db.sqlite3')
+    with open(os.path.join(ROOT, 'create_table.sql')) as fp, sqlite3.connect(db) as conn:
+        conn.executescript(fp.read())
+    apps = []
+
+    def make(**kwargs):
+        application = app_module.WallGameApp(**kwargs)
+        application.storage = AsyncStorage(db)
+        apps.append(application)
+        return application
+
+    yield make
+    for application in apps:
+        application.crypto.shutdown()
@@ -0,0 +1,181 @@
+import asyncio
+import gc
+
+from aiohttp import WSMsgType, web
+from aiohttp.test_utils import TestClient, TestServer
+
+from benchmarks.harness import Client, prepare_workdir, serve
+from game_record import GameArchive
+from game_room import GameRoom
+from room_log import ActionJournal
+from static_assets import LONG_CACHE
+from storage import PASSWORD_METHOD, Storage, User
+
+
+def test_journal_is_opt_in(make_app, tmp_path):
+    make_app()
+    assert GameRoom.journal is None
+    make_app(journal_dir=str(tmp_path / 'rooms'))
+    assert isinstance(GameRoom.journal, ActionJournal)
+    assert (tmp_path / 'rooms').is_dir()
+
+
+def test_archive_is_opt_in(make_app, tmp_path):
+    make_app()
+    assert GameRoom.archive is None
+    make_app(archive=str(tmp_path / 'games.wgr'))
+    assert isinstance(GameRoom.archive, GameArchive)
+    assert GameRoom.archive.path == str(tmp_path / 'games.wgr')
+
+
+def test_lobby_websocket_pushes_changes(make_app):
+    async def main():
+        app = make_app()
+        app.lobby.tick = 0.01
+        async with TestClient(TestServer(app)) as client:
+            ws = await client.ws_connect('/lobby/ws/')
+            room = GameRoom(5, 'pushed', [[0, 0], [4, 4]])
+            message = await asyncio.wait_for(ws.receive_json(), 5)
+            assert message == {'event': 'lobby', 'changes': [
+                {'type': 'open', 'room': room.summary()}]}
+            room.destroy()
+            message = await asyncio.wait_for(ws.receive_json(), 5)
+            assert message['changes'] == [{'type': 'closed', 'id': room.id}]
+            await ws.close()
+
+    asyncio.run(main())
+
+
+def test_lobby_websocket_ends_when_send_fails(make_app, monkeypatch):
+    async def main():
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        app = make_app()
+
+        async def send_str(self, data, compress=None):
+            raise ConnectionResetError('Cannot write to closing transport')
+
+        async with TestClient(TestServer(app)) as client:
+            ws = await client.ws_connect('/lobby/ws/')
+            monkeypatch.setattr(web.WebSocketResponse, 'send_str', send_str)
+            queue, = app.lobby.subscribers
+            # 处理函数已经在等待第一条消息，取得的是替换前的 send_str，第二条消息才会发送失败
+            queue.put_nowait('{}')
+            queue.put_nowait('{}')
+            message = await asyncio.wait_for(ws.receive(), 5)
+            assert message.type is WSMsgType.TEXT
+            # 发送失败后服务器关闭连接，处理函数结束并取消订阅
+            message = await asyncio.wait_for(ws.receive(), 5)
+            assert message.type in (WSMsgType.CLOSE, WSMsgType.CLOSED)
+            for _ in range(100):
+                if not app.lobby.subscribers:
+                    break
+                await asyncio.sleep(0.01)
+            assert not app.lobby.subscribers
+        gc.collect()
+        await asyncio.sleep(0)
+        assert errors == []
+
+    asyncio.run(main())
+
+
+def test_resync_message_resends_map(tmp_path, room_state):
+    async def main():
+        from rsa_util import RsaUtil
+
+        workdir = prepare_workdir(tmp_path)
+        async with serve(workdir) as (base_url, app):
+            rsa_util = RsaUtil(company_pri_file=None)
+            clients = [Client(base_url, f'user{i}', f'U{i}', rsa_util) for i in range(2)]
+            try:
+                for client in clients:
+                    await client.register()
+                room = await clients[0].new_room(3, [[0, 0], [2, 2]])
+                sockets = [await client.session.ws_connect(f'{base_url}{room}ws/') for client in clients]
+
+                async def receive(ws, event):
+                    while True:
+                        message = await asyncio.wait_for(ws.receive_json(), 5)
+                        if message['event'] == event:
+                            return message
+
+                first = await receive(sockets[0], 'update_game_map')
+                assert first['seq'] == 0
+                await receive(sockets[0], 'ask_player_action')
+                await sockets[0].send_json({'motions': [1, 0], 'wall_dir': 'down'})
+                for ws in sockets:
+                    diff = await receive(ws, 'game_map_diff')
+                    assert diff['seq'] == 1 and diff['wall'] == [2, 0, 'top']
+                await receive(sockets[1], 'ask_player_action')
+                await sockets[1].send_json({'resync': True})
+                full = await receive(sockets[1], 'update_game_map')
+                assert full['seq'] == 1
+                assert full['wall_top'][2][0] == '1'
+                assert [info[:3] for info in full['players_info']] == [[1, 0, 'U0'], [2, 2, 'U1']]
+                # 重新同步的请求没有被当作动作，游戏仍在等待第二个玩家
+                await sockets[1].send_json({'motions': [-1, 0], 'wall_dir': 'left'})
+                diff = await receive(sockets[0], 'game_map_diff')
+                assert diff['seq'] == 2 and diff['move'] == [1, 2, 'U1']
+                for ws in sockets:
+                    await ws.close()
+            finally:
+                for client in clients:
+                    await client.close()
+
+    asyncio.run(main())
+
+
+def test_login_rehashes_legacy_password(tmp_path, room_state):
+    async def main():
+        from rsa_util import RsaUtil
+
+        workdir = prepare_workdir(tmp_path)
+        legacy = User('alice', 'A', password='sha256:salt:AA==')
+        legacy.set_password(b'password', 'sha256')
+        storage = Storage(str(workdir / 'db.sqlite3'))
+        storage.new_user(legacy)
+        storage.close()
+        async with serve(workdir) as (base_url, app):
+            client = Client(base_url, 'alice', 'A', RsaUtil(company_pri_file=None))
+            wrong = Client(base_url, 'alice', 'A', RsaUtil(company_pri_file=None), password=b'wrong')
+            try:
+                # 密码错误时不跳转，也不修改记录
+                assert await wrong.login() == 200
+                assert (await app.storage.get_user('alice')).pwd_method == 'sha256'
+                assert await client.login() == 302
+                user = await app.storage.get_user('alice')
+                assert user.pwd_method == PASSWORD_METHOD
+                assert user.verify_password(b'password')
+            finally:
+                await client.close()
+                await wrong.close()
+        # 新的密码已经写入数据库
+        storage = Storage(str(workdir / 'db.sqlite3'))
+        assert storage.get_user('alice').pwd_method == PASSWORD_METHOD
+        storage.close()
+
+    asyncio.run(main())
+
+
+def test_static_pages_are_cached_and_fingerprinted(make_app, monkeypatch):
+    async def main():
+        app = make_app()
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get('/login/')
+            assert resp.status == 200
+            page = await resp.text()
+            css = app.assets.url('css/base.css')
+            assert '?v=' in css and css in page
+            resp = await client.get(css)
+            assert resp.status == 200 and resp.headers['Cache-Control'] == LONG_CACHE
+            # 空白的登录表单只渲染一次
+            assert ('login.html', '') in app._pages
+
+            def get_template(name):
+                raise AssertionError(f'{name} rendered again')
+
+            monkeypatch.setattr(app.env, 'get_template', get_template)
+            resp = await client.get('/login/')
+            assert resp.status == 200 and await resp.text() == page
+
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+import argparse
+import asyncio
+import json
+
+import pytest
+
+from benchmarks import core as bench_core
+from benchmarks import load
+from benchmarks.harness import percentile
+from core import WallGame
+
+
+def run_args(output, **kwargs):
+    args = dict(sizes=[3], players=[2], densities=[0.2], backends=['list'], benchmarks=list(bench_core.BENCHMARKS),
+                rounds=1, min_time=1e-9, seed=0, output=str(output), quiet=True)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def test_core_benchmarks_skip_missing_methods(tmp_path, monkeypatch):
+    # 早期的 WallGame 没有 legal_actions 和 territory
+    monkeypatch.delattr(WallGame, 'legal_actions')
+    monkeypatch.delattr(WallGame, 'territory')
+    bench_core.run(run_args(tmp_path / 'before.json'))
+    results = json.loads((tmp_path / 'before.json').read_text())['results']
+    assert {key.split('/')[0] for key in results} == {'update_areas', 'get_reachable_points',
+                                                      'reachable_points_near'}
+
+
+def test_core_benchmarks_compare(tmp_path, capsys):
+    bench_core.run(run_args(tmp_path / 'before.json', benchmarks=['update_areas', 'playout']))
+    bench_core.run(run_args(tmp_path / 'after.json', benchmarks=['playout']))
+    args = argparse.Namespace(baseline=str(tmp_path / 'before.json'), current=str(tmp_path / 'after.json'),
+                              threshold=float('inf'), absolute=False, all=True)
+    assert bench_core.compare(args) == 0
+    assert '1 compared' in capsys.readouterr().out
+
+
+def test_load_harness_plays_every_room(room_state):
+    args = argparse.Namespace(players=2, size=3, games=1, think=0.0, lag_interval=0.01, seed=0,
+                              tracemalloc=False, metrics=False)
+    result = asyncio.run(asyncio.wait_for(load.run_level(2, args), 60))
+    assert result['rooms'] == 2 and result['games'] == 2
+    assert result['moves'] > 0 and result['moves_per_second'] > 0
+    assert result['latency_ms']['p50'] <= result['latency_ms']['p99']
+    assert 'rss_per_room_kb' in result
+
+
+def test_load_helpers():
+    assert load.corner_positions(5, 3) == [[0, 0], [4, 4], [0, 4]]
+    with pytest.raises(ValueError):
+        load.corner_positions(5, 5)
+    assert percentile([3, 1, 2, 4], 0.5) == 3
+    assert percentile([3, 1, 2, 4], 0.99) == 4
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import bot
+from bot import Bot
+from core import Event
+from game_room import GameRoom
+from storage import User, UserValidationError
+
+
+class Inbox:
+    closed = False
+
+    def __init__(self) -> None:
+        self.asked = asyncio.Event()
+
+    async def send_json(self, data, dumps=None):
+        await self.send_str(dumps(data))
+
+    async def send_str(self, data):
+        if json.loads(data)['event'] == Event.ask_player_action.value:
+            self.asked.set()
+
+
+def test_bot_symbols_cannot_be_chosen_by_users(monkeypatch):
+    executor = ThreadPoolExecutor(1)
+    monkeypatch.setattr(Bot, 'executor', executor)
+
+    async def main():
+        room = GameRoom(5, 'test', [[0, 0], [4, 4], [0, 4]])
+        try:
+            first = await room.add_bot()
+            second = await room.add_bot()
+        finally:
+            room.destroy()
+        return first.symbol, second.symbol
+
+    symbols = asyncio.run(main())
+    executor.shutdown()
+    assert len(set(symbols)) == 2
+    for symbol in symbols:
+        with pytest.raises(UserValidationError):
+            User('someone', symbol, password='sha256:salt:')
+
+
+def play_first_bot_move(timeout=5):
+    """
+    电脑玩家占据第一个座位，先走；它走完之后才会询问人类玩家。返回电脑玩家这一步用的时间
+    """
+    async def main():
+        room = GameRoom(3, 'test', [[0, 0], [2, 2]])
+        try:
+            await room.add_bot()
+            human = Inbox()
+            started = time.perf_counter()
+            await room.register_player('human', room.manager.unregistered_players[0], human)
+            await asyncio.wait_for(human.asked.wait(), timeout)
+            assert len(room.moves) == 1
+            return time.perf_counter() - started
+        finally:
+            if room.task is not None:
+                room.task.cancel()
+            room.destroy()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def thread_executor(monkeypatch):
+    executor = ThreadPoolExecutor(1)
+    monkeypatch.setattr(Bot, 'executor', executor)
+    yield executor
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def test_bot_plays_a_legal_move_when_search_fails(monkeypatch, thread_executor):
+    def fail(*args):
+        raise RuntimeError('search failed')
+
+    monkeypatch.setattr(bot, 'choose_action', fail)
+    play_first_bot_move()
+
+
+def test_bot_plays_a_legal_move_when_budget_is_exceeded(monkeypatch, thread_executor):
+    release = threading.Event()
+
+    def slow(*args):
+        # 例如工作进程还在启动，或者所有进程都在为其他房间搜索
+        release.wait(5)
+        return 0, {}
+
+    monkeypatch.setattr(bot, 'choose_action', slow)
+    monkeypatch.setattr(Bot, 'grace', 0.05)
+    try:
+        # add_bot 的默认预算为 1 秒
+        assert play_first_bot_move(timeout=3) < 2
+    finally:
+        release.set()
+
+
+def test_bot_starts_workers_when_it_joins(monkeypatch):
+    submitted = []
+
+    class Executor(ThreadPoolExecutor):
+        def __init__(self, max_workers, mp_context):
+            super().__init__(max_workers)
+
+        def submit(self, fn, *args):
+            submitted.append(fn)
+            return super().submit(fn, *args)
+
+    monkeypatch.setattr(bot, 'ProcessPoolExecutor', Executor)
+    monkeypatch.setattr(Bot, 'executor', None)
+    monkeypatch.setattr(Bot, 'max_workers', 3)
+    try:
+        Bot(None, 'bot')
+        assert submitted == [bot._ready] * 3
+        # 进程池只创建一次
+        Bot(None, 'bot2')
+        assert len(submitted) == 3
+    finally:
+        Bot.shutdown()
+
+
+def test_shutdown_releases_executor(monkeypatch):
+    monkeypatch.setattr(Bot, 'executor', None)
+    monkeypatch.setattr(Bot, 'max_workers', 1)
+    executor = Bot.get_executor()
+    Bot.shutdown()
+    assert Bot.executor is None
+    with pytest.raises(RuntimeError):
+        executor.submit(print)
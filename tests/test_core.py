@@ -0,0 +1,341 @@
+import copy
+import random
+
+import pytest
+
+from core import CONTESTED, DIRECTIONS, UNCLAIMED, Direction, Event, Player, WallGame, ZobristKeys
+
+BACKENDS = ['list', 'bitboard']
+
+
+def random_walls(game: WallGame, rng: random.Random):
+    """
+    随机顺序产出棋盘内部所有可以放墙的 (位置, 方向)
+    """
+    size = game.size
+    walls = [((row, col), Direction.down) for row in range(size - 1) for col in range(size)]
+    walls += [((row, col), Direction.right) for row in range(size) for col in range(size - 1)]
+    rng.shuffle(walls)
+    return walls
+
+
+def areas_of(game: WallGame):
+    return [list(row) for row in game.map], list(game.area_sizes), game.areas
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('seed', range(20))
+def test_update_areas_matches_recompute(backend, seed):
+    rng = random.Random(seed)
+    size = rng.randint(2, 9)
+    game = WallGame(size, backend=backend)
+    walls = random_walls(game, rng)
+    while walls:
+        # 一次放一面或多面墙再更新，两种情况走 update_areas 中不同的分支
+        for _ in range(min(len(walls), rng.choice([1, 1, 1, 2, 4]))):
+            game.put_wall(*walls.pop())
+        game.update_areas()
+        expected = copy.deepcopy(game)
+        expected.recompute_areas()
+        assert areas_of(game) == areas_of(expected)
+
+
+def plain_territory(game: WallGame):
+    """
+    不使用缓存的多源广度优先搜索，每个格子记录所有最近的玩家
+    """
+    size = game.size
+    distances = [[-1] * size for _ in range(size)]
+    nearest = [[set() for _ in range(size)] for _ in range(size)]
+    frontier = []
+    for index, player in enumerate(game.players):
+        distances[player.row][player.col] = 0
+        nearest[player.row][player.col].add(index)
+        frontier.append((player.row, player.col))
+    distance = 0
+    while frontier:
+        distance += 1
+        reached = []
+        for row, col in frontier:
+            for r, c in game.reachable_points_near(row, col):
+                if distances[r][c] < 0:
+                    distances[r][c] = distance
+                    reached.append((r, c))
+                if distances[r][c] == distance:
+                    nearest[r][c] |= nearest[row][col]
+        frontier = reached
+    owners = [[next(iter(cell)) if len(cell) == 1 else CONTESTED if cell else UNCLAIMED
+               for cell in row] for row in nearest]
+    counts = tuple(sum(row.count(index) for row in owners) for index in range(len(game.players)))
+    return owners, distances, counts, sum(row.count(CONTESTED) for row in owners)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('seed', range(20))
+def test_territory_matches_plain_bfs(backend, seed):
+    rng = random.Random(seed)
+    size = rng.randint(2, 10)
+    cells = rng.sample(range(size * size), rng.randint(2, min(8, size * size)))
+    game = WallGame(size, [Player(str(i), *divmod(cell, size)) for i, cell in enumerate(cells)],
+                    backend=backend)
+    assert tuple(game.territory()) == plain_territory(game)
+    pushed = 0
+    for _ in range(size * size):
+        player = rng.choice(game.players)
+        actions = game.legal_actions(player)
+        if pushed and (not actions or rng.random() < 0.2):
+            # 撤销时墙被拆除、玩家退回原处，缓存同样要更新
+            game.pop_action()
+            pushed -= 1
+        elif not actions:
+            continue
+        else:
+            (row, col), direction = game.decode_action(rng.choice(actions))
+            motions = row - player.row, col - player.col
+            # pop_action 只能撤销紧接着的 push_action，所以有未撤销的动作时不用 apply_player_action
+            if pushed or rng.random() < 0.5:
+                game.push_action(player, motions, direction)
+                pushed += 1
+            else:
+                game.apply_player_action(player, motions, direction)
+        assert tuple(game.territory()) == plain_territory(game)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_players_out_get_no_more_turns(seed):
+    rng = random.Random(seed)
+    size = rng.randint(3, 6)
+    cells = rng.sample(range(size * size), rng.randint(3, 4))
+    game = WallGame(size, [Player(str(i), *divmod(cell, size)) for i, cell in enumerate(cells)])
+    loop = game.game_loop()
+    reply = None
+    out = []
+    with pytest.raises(StopIteration):
+        while True:
+            event, *args = loop.send(reply)
+            reply = None
+            if event is Event.player_out:
+                player = args[0]
+                assert player.status == 'out' and player not in out
+                out.append(player)
+            elif event is Event.ask_player_action:
+                player = args[0]
+                assert player.status == 'normal' and player not in out
+                (row, col), direction = game.decode_action(rng.choice(game.legal_actions(player)))
+                reply = (row - player.row, col - player.col), direction
+    assert len(out) >= len(game.players) - 1
+
+
+def board_of(game: WallGame):
+    return ([list(row) for row in game.wall_top], [list(row) for row in game.wall_left],
+            [[game.area_of(row, col) for col in range(game.size)] for row in range(game.size)],
+            *areas_of(game))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_bitboard_matches_list_backend(seed):
+    rng = random.Random(seed)
+    size = rng.randint(2, 10)
+    cells = rng.sample(range(size * size), rng.randint(2, min(4, size * size)))
+    games = [WallGame(size, [Player(str(i), *divmod(cell, size)) for i, cell in enumerate(cells)],
+                      backend=backend) for backend in BACKENDS]
+    expected, bitboard = games
+    pushed = 0
+    for _ in range(2 * size * size):
+        index = rng.randrange(len(cells))
+        actions = expected.legal_actions(expected.players[index])
+        assert sorted(bitboard.legal_actions(bitboard.players[index])) == sorted(actions)
+        if pushed and (not actions or rng.random() < 0.3):
+            for game in games:
+                game.pop_action()
+            pushed -= 1
+        elif actions:
+            (row, col), direction = expected.decode_action(rng.choice(actions))
+            for game in games:
+                player = game.players[index]
+                game.push_action(player, (row - player.row, col - player.col), direction)
+            pushed += 1
+        assert board_of(bitboard) == board_of(expected)
+
+
+def test_bitboard_views_are_cached():
+    game = WallGame(5, backend='bitboard')
+    top, left, map = game.wall_top, game.wall_left, game.map
+    assert game.wall_top is top and game.wall_left is left and game.map is map
+    game.put_wall((1, 1), Direction.up)
+    assert game.wall_top is not top and game.wall_top[1][1] and not top[1][1]
+    # 没有分割区域时，区域的列表不变
+    game.update_areas()
+    assert game.map is map
+    for col in range(2, 5):
+        game.put_wall((1, col), Direction.up)
+    game.update_areas()
+    assert game.map is map and game.areas == 1
+    game.put_wall((1, 0), Direction.up)
+    game.update_areas()
+    assert game.map is not map and game.areas == 2
+    assert game.area_of(0, 0) == 1 and game.area_of(4, 4) == 2
+
+
+def test_bitboard_undo_does_not_copy_areas_without_split():
+    game = WallGame(4, backend='bitboard')
+    player = game.players[0]
+    masks = game._area_masks
+    game.push_action(player, (0, 1), Direction.down)
+    assert game._history[-1][3] is None and game._area_masks is masks
+    game.pop_action()
+    assert game._area_masks is masks
+
+
+def plain_reachable(game: WallGame, player: Player):
+    """
+    不使用缓存的广度优先搜索：最多走 3 步，不能经过其他玩家
+    """
+    occupied = {(p.row, p.col) for p in game.players if p is not player}
+    reached = {(player.row, player.col)}
+    frontier = [(player.row, player.col)]
+    for _ in range(3):
+        frontier = [point for row, col in frontier for point in game.reachable_points_near(row, col)
+                    if point not in occupied and point not in reached]
+        reached.update(frontier)
+    return reached
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('seed', range(20))
+def test_reachable_set_matches_plain_search(backend, seed):
+    rng = random.Random(seed)
+    size = rng.randint(2, 9)
+    cells = rng.sample(range(size * size), rng.randint(2, min(4, size * size)))
+    game = WallGame(size, [Player(str(i), *divmod(cell, size)) for i, cell in enumerate(cells)],
+                    backend=backend)
+    walls = random_walls(game, rng)
+    for pos, direction in walls[:rng.randrange(len(walls) + 1)]:
+        game.put_wall(pos, direction)
+    for player in game.players:
+        points = game.reachable_set(player)
+        assert points.points[0] == (player.row, player.col)
+        assert len(set(points)) == len(points)
+        assert set(points) == plain_reachable(game, player)
+        assert all(point in points for point in points)
+
+
+def test_reachable_set_is_cached_until_board_changes():
+    game = WallGame(5)
+    first, second = game.players
+    points = game.reachable_set(first)
+    assert game.reachable_set(first) is points
+    assert game.reachable_set(second) is not points
+    points = game.reachable_set(first)
+    game.put_wall((2, 2), Direction.up)
+    assert game.reachable_set(first) is not points
+    points = game.reachable_set(first)
+    game.apply_player_action(first, (1, 0), Direction.down)
+    moved = game.reachable_set(first)
+    assert moved is not points and moved.points[0] == (1, 0)
+
+
+def test_apply_player_action_rejects_unreachable_moves():
+    game = WallGame(5)
+    player = game.players[0]
+    walls = [list(row) for row in game.wall_top], [list(row) for row in game.wall_left]
+    # 超过 3 步、走到其他玩家的位置
+    for motions in ((4, 0), (2, 2), (4, 4)):
+        with pytest.raises(ValueError, match='invalid motions'):
+            game.apply_player_action(player, motions, Direction.down)
+    assert (player.row, player.col) == (0, 0)
+    assert ([list(row) for row in game.wall_top], [list(row) for row in game.wall_left]) == walls
+
+
+def probed_actions(game: WallGame, player: Player):
+    """
+    对每个可到达的位置和方向在副本上尝试 apply_player_action，成功的即为合法动作
+    """
+    actions = set()
+    for pos in game.reachable_set(player):
+        for direction in DIRECTIONS:
+            trial = copy.deepcopy(game)
+            trial_player = trial.players[game.players.index(player)]
+            try:
+                trial.apply_player_action(trial_player, (pos[0] - player.row, pos[1] - player.col), direction)
+            except ValueError:
+                continue
+            actions.add((pos, direction))
+    return actions
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('seed', range(20))
+def test_legal_actions_match_probing(backend, seed):
+    rng = random.Random(seed)
+    size = rng.randint(2, 7)
+    cells = rng.sample(range(size * size), rng.randint(2, min(4, size * size)))
+    game = WallGame(size, [Player(str(i), *divmod(cell, size)) for i, cell in enumerate(cells)],
+                    backend=backend)
+    walls = random_walls(game, rng)
+    for pos, direction in walls[:rng.randrange(len(walls) + 1)]:
+        game.put_wall(pos, direction)
+    for player in game.players:
+        actions = game.legal_actions(player)
+        assert len(set(actions)) == len(actions)
+        decoded = {game.decode_action(action) for action in actions}
+        assert decoded == probed_actions(game, player)
+        for pos, direction in decoded:
+            assert game.decode_action(game.encode_action(pos, direction)) == (pos, direction)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('seed', range(20))
+def test_pop_action_restores_state(backend, seed):
+    rng = random.Random(seed)
+    size = rng.randint(2, 8)
+    cells = rng.sample(range(size * size), rng.randint(2, min(4, size * size)))
+
+    def new_game():
+        return WallGame(size, [Player(str(i), *divmod(cell, size)) for i, cell in enumerate(cells)],
+                        backend=backend)
+
+    game = new_game()
+    # 每次 push_action 之前的 (局面, 快照)，以及已执行的动作
+    states = []
+    actions = []
+    for _ in range(3 * size * size):
+        index = rng.randrange(len(cells))
+        player = game.players[index]
+        legal = game.legal_actions(player)
+        if states and (not legal or rng.random() < 0.3):
+            game.pop_action()
+            actions.pop()
+            board, snapshot = states.pop()
+            assert board_of(game) == board
+            assert game.snapshot(zobrist=True) == snapshot and game.zobrist == snapshot.zobrist
+        elif legal:
+            states.append((board_of(game), game.snapshot(zobrist=True)))
+            (row, col), direction = game.decode_action(rng.choice(legal))
+            motions = row - player.row, col - player.col
+            game.push_action(player, motions, direction)
+            actions.append((index, motions, direction))
+        # 增量维护的哈希与重新执行所有动作得到的相同
+        replay = new_game()
+        for index, motions, direction in actions:
+            replay.apply_player_action(replay.players[index], motions, direction)
+        replay.update_areas()
+        game.update_areas()
+        assert board_of(replay) == board_of(game)
+        assert replay.snapshot(zobrist=True) == game.snapshot(zobrist=True)
+        assert replay.zobrist == game.zobrist
+
+
+def test_snapshot_keys():
+    game = WallGame(4)
+    first = game.snapshot()
+    with_hash = game.snapshot(zobrist=True)
+    assert with_hash.zobrist == game.zobrist and hash(with_hash) == hash(game.zobrist)
+    seen = {first: 0}
+    game.push_action(game.players[0], (1, 0), Direction.down)
+    assert game.snapshot() not in seen
+    game.pop_action()
+    assert game.snapshot() in seen
+    # 键只由棋盘尺寸决定，其他进程中的 ZobristKeys 也会得到相同的值
+    assert ZobristKeys(4).walls == ZobristKeys.for_size(4).walls
+    assert ZobristKeys(4).player(1, 3) == ZobristKeys.for_size(4).player(1, 3)
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from crypto_executor import CryptoExecutor
+from rsa_util import RsaUtil
+from storage import User, UserValidationError
+
+# 计算很快的算法，测试中代替 scrypt
+FAST_METHOD = 'pbkdf2_sha256-1000'
+
+
+@pytest.fixture(scope='module')
+def crypto(key_files):
+    executor = CryptoExecutor(key_files[1], max_workers=1, password_method=FAST_METHOD)
+    yield executor
+    executor.shutdown()
+
+
+def legacy_user(raw_password='secret'):
+    user = User('alice', 'A', password='sha256:salt:AA==')
+    user.set_password(raw_password, 'sha256')
+    return user
+
+
+def test_decrypt_in_worker(crypto, key_files):
+    public_key = RsaUtil(company_pub_file=key_files[0], company_pri_file=None)
+    # 超过一段的长度，需要分段解密
+    message = b'password' * 20
+    encrypted = public_key.encrypt_by_public_key(message)
+    assert asyncio.run(crypto.decrypt(encrypted)) == message
+
+
+def test_verify_and_upgrade(crypto):
+    async def main():
+        user = legacy_user()
+        old_password = user.password
+        assert await crypto.verify_and_upgrade(user, b'wrong') == (False, False)
+        assert user.password == old_password
+        # 旧算法的密码验证通过后换成新算法
+        assert await crypto.verify_and_upgrade(user, b'secret') == (True, True)
+        assert user.pwd_method == FAST_METHOD and not user.needs_rehash(FAST_METHOD)
+        assert await crypto.verify_and_upgrade(user, b'secret') == (True, False)
+        assert await crypto.verify_password(user, b'secret')
+        assert not await crypto.verify_password(user, b'wrong')
+
+    asyncio.run(main())
+
+
+def test_hash_password_errors_reach_the_caller(crypto):
+    async def main():
+        with pytest.raises(UserValidationError):
+            await crypto.hash_password(b'abc')
+        password = await crypto.hash_password(b'secret')
+        assert password.startswith(FAST_METHOD + ':')
+        # 每次的盐不同
+        assert password != await crypto.hash_password(b'secret')
+
+    asyncio.run(main())
+
+
+def test_pending_jobs_are_bounded(key_files, monkeypatch):
+    crypto = CryptoExecutor(key_files[1], max_workers=1, max_pending=2, password_method=FAST_METHOD)
+    running = 0
+    peak = 0
+    submit = crypto.executor.submit
+
+    def counted(fn, *args):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        future = submit(fn, *args)
+        future.add_done_callback(lambda _: done())
+        return future
+
+    def done():
+        nonlocal running
+        running -= 1
+
+    monkeypatch.setattr(crypto.executor, 'submit', counted)
+
+    async def main():
+        return await asyncio.gather(*[crypto.hash_password(b'secret') for _ in range(6)])
+
+    try:
+        assert len(asyncio.run(main())) == 6
+    finally:
+        crypto.shutdown()
+    assert peak <= 2
@@ -0,0 +1,77 @@
+import asyncio
+import itertools
+
+import pytest
+
+from core import DIRECTIONS
+from game_record import (ArchiveStats, GameArchive, GameRecord, append_to_archive, decode_move, encode_move,
+                         iter_archive)
+
+RECORDS = [
+    GameRecord(5, ((0, 0), (4, 4)), (10, 15), bytes([0, 195, 17])),
+    GameRecord(7, ((0, 0), (6, 6), (0, 6)), (20, 9, 20), bytes(range(50))),
+    GameRecord(3, ((1, 1), (2, 2)), (0, 9), b''),
+]
+
+
+def normalized(record: GameRecord):
+    return record.size, tuple(record.positions), tuple(record.scores), bytes(record.moves)
+
+
+def test_move_codes_round_trip():
+    codes = set()
+    for drow, dcol, direction in itertools.product(range(-3, 4), range(-3, 4), DIRECTIONS):
+        code = encode_move((drow, dcol), direction)
+        assert 0 <= code < 256
+        assert decode_move(code) == ((drow, dcol), direction)
+        codes.add(code)
+    assert len(codes) == 7 * 7 * 4
+    with pytest.raises(ValueError):
+        encode_move((4, 0), DIRECTIONS[0])
+
+
+def test_records_round_trip():
+    data = b''.join(record.to_bytes() for record in RECORDS)
+    offset = 0
+    for record in RECORDS:
+        decoded, offset = GameRecord.from_buffer(data, offset)
+        assert normalized(decoded) == normalized(record)
+    assert offset == len(data)
+    # 2 个玩家、3 个动作：7 字节的头部，4 字节的位置，4 字节的得分
+    assert len(RECORDS[0].to_bytes()) == 7 + 4 + 4 + 3
+    with pytest.raises(ValueError):
+        GameRecord.from_buffer(b'XX' + data[2:])
+
+
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_iter_archive(tmp_path, use_mmap):
+    path = str(tmp_path / 'games.wgr')
+    open(path, 'wb').close()
+    assert list(iter_archive(path, use_mmap)) == []
+    append_to_archive(path, RECORDS[:2])
+    append_to_archive(path, RECORDS[2:])
+    assert [normalized(record) for record in iter_archive(path, use_mmap)] == \
+           [normalized(record) for record in RECORDS]
+
+
+def test_game_archive_appends_in_order(tmp_path):
+    path = str(tmp_path / 'games.wgr')
+    archive = GameArchive(path)
+    for record in RECORDS:
+        archive.append(record)
+    asyncio.run(archive.close())
+    assert archive.records == len(RECORDS)
+    assert [normalized(record) for record in iter_archive(path)] == [normalized(record) for record in RECORDS]
+
+
+def test_archive_stats():
+    stats = ArchiveStats()
+    for record in RECORDS:
+        stats.add(record)
+    summary = stats.summary()
+    assert summary['games'] == 3
+    assert summary['max_moves'] == 50 and summary['median_moves'] == 3
+    # 第二局第一和第三个座位平局
+    assert summary['tie_rate'] == pytest.approx(1 / 3)
+    assert summary['win_rate_by_seat'] == {1: 0.0, 2: pytest.approx(2 / 3), 3: 0.0}
+    assert ArchiveStats().summary()['games'] == 0
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import random
+from typing import *
+
+from core import Event
+from game_record import GameArchive, iter_archive, replay
+from game_room import GameRoom
+from room_log import ActionJournal
+
+
+class RandomPlayer:
+    """
+    收到询问后立即随机回答的连接，用于驱动 GameRoom.game_loop
+    """
+    closed = False
+
+    def __init__(self, room: GameRoom, user: str, seed, moves: Optional[int] = None) -> None:
+        self.room = room
+        self.user = user
+        self.rng = random.Random(seed)
+        self.games_started = 0
+        self.restarted = asyncio.Event()
+        # 回答 moves 次询问后不再回答，为 None 时不限制
+        self.moves = moves
+        self.stopped = asyncio.Event()
+
+    async def send_json(self, data, dumps=None):
+        await self.send_str(dumps(data))
+
+    async def send_str(self, data):
+        data = json.loads(data)
+        queue = self.room.manager.users_queues.get(self.user)
+        if data['event'] == Event.ask_player_action.value:
+            if self.moves is not None:
+                if self.moves == 0:
+                    self.stopped.set()
+                    return
+                self.moves -= 1
+            (row, col), *_ = data['reachable_points']
+            to_row, to_col = self.rng.choice(data['reachable_points'])
+            queue.put_nowait({'motions': [to_row - row, to_col - col],
+                              'wall_dir': self.rng.choice(['up', 'down', 'left', 'right'])})
+        elif data['event'] == Event.game_over.value:
+            queue.put_nowait({'agree': True})
+        elif data['event'] == Event.game_start.value:
+            self.games_started += 1
+            if self.games_started == 2:
+                self.restarted.set()
+
+
+class MapClient(RandomPlayer):
+    """
+    与 room.js 相同地维护地图：收到完整的地图时重建，收到 game_map_diff 时只修改变化的部分。
+    drop 中序号的 game_map_diff 被丢弃，模拟遗漏的消息，之后发现序号不连续时请求重新同步
+    """
+
+    def __init__(self, room: GameRoom, user: str, seed, moves: Optional[int] = None, drop=()) -> None:
+        super().__init__(room, user, seed, moves)
+        self.drop = set(drop)
+        self.seq = -1
+        self.state = None
+        self.resyncs = 0
+        self.resynced = asyncio.Event()
+
+    async def send_str(self, data):
+        message = json.loads(data)
+        if message['event'] == Event.update_game_map.value:
+            self.seq = message['seq']
+            self.state = map_state(message)
+            if self.resyncs:
+                self.resynced.set()
+        elif message['event'] == Event.game_map_diff.value and message['seq'] not in self.drop:
+            if message['seq'] == self.seq + 1:
+                self.seq = message['seq']
+                row, col, side = message['wall']
+                walls = self.state[0 if side == 'top' else 1]
+                walls[row] = walls[row][:col] + '1' + walls[row][col + 1:]
+                self.state[2][message['move'][2]] = tuple(message['move'][:2])
+            elif message['seq'] > self.seq and not self.resyncs:
+                # 与 room.js 相同，请求完整的地图后仍按顺序处理之后的消息
+                self.resyncs += 1
+                asyncio.ensure_future(self.room.resync(self.user))
+        await super().send_str(data)
+
+
+def map_state(message):
+    return ([*message['wall_top']], [*message['wall_left']],
+            {symbol: (row, col) for row, col, symbol, *_ in message['players_info']})
+
+
+def test_map_diffs_rebuild_the_map():
+    async def main():
+        room = GameRoom(5, 'test', [[0, 0], [4, 4]])
+        try:
+            sockets = [MapClient(room, f'user{i}', i, moves=5) for i in range(2)]
+            for socket, player in zip(sockets, list(room.players)):
+                await room.register_player(socket.user, player, socket)
+            await asyncio.wait_for(sockets[0].stopped.wait(), 10)
+            assert room.map_seq == len(room.moves) > 0
+            for socket in sockets:
+                assert socket.seq == room.map_seq and not socket.resyncs
+                assert socket.state == map_state(room.update_game_map_message())
+        finally:
+            room.task.cancel()
+            room.destroy()
+
+    asyncio.run(main())
+
+
+def test_seq_gap_requests_resync():
+    async def main():
+        room = GameRoom(5, 'test', [[0, 0], [4, 4]])
+        try:
+            sockets = [MapClient(room, 'user0', 0, moves=5, drop={2}), MapClient(room, 'user1', 1, moves=5)]
+            for socket, player in zip(sockets, list(room.players)):
+                await room.register_player(socket.user, player, socket)
+            await asyncio.wait_for(sockets[0].stopped.wait(), 10)
+            await asyncio.wait_for(sockets[0].resynced.wait(), 10)
+            assert room.map_seq >= 3
+            assert sockets[0].resyncs == 1
+            assert sockets[0].seq == room.map_seq
+            assert sockets[0].state == map_state(room.update_game_map_message())
+        finally:
+            room.task.cancel()
+            room.destroy()
+
+    asyncio.run(main())
+
+
+def test_restart_resets_player_status():
+    async def main():
+        room = GameRoom(3, 'test', [[0, 0], [2, 2]])
+        try:
+            sockets = [RandomPlayer(room, f'user{i}', i) for i in range(2)]
+            for socket, player in zip(sockets, list(room.players)):
+                await room.register_player(socket.user, player, socket)
+            await asyncio.wait_for(sockets[0].restarted.wait(), 10)
+            assert [player.status for player in room.players] == ['normal', 'normal']
+            assert [(p.row, p.col) for p in room.players] == [(0, 0), (2, 2)]
+        finally:
+            if room.task is not None:
+                room.task.cancel()
+            room.destroy()
+
+    asyncio.run(main())
+
+
+def test_journal_compaction_and_restore(tmp_path, monkeypatch):
+    async def main():
+        journal = ActionJournal(str(tmp_path), flush_interval=0.001, compact_every=5)
+        monkeypatch.setattr(GameRoom, 'journal', journal)
+        await journal.start()
+        room = GameRoom(6, 'journal', [[0, 0], [5, 5]])
+        sockets = [RandomPlayer(room, f'user{i}', i, moves=6) for i in range(2)]
+        for socket, player in zip(sockets, list(room.players)):
+            await room.register_player(socket.user, player, socket)
+        await asyncio.wait_for(sockets[0].stopped.wait(), 10)
+        room.task.cancel()
+        moves = list(room.moves)
+        walls = room.game.wall_top, room.game.wall_left
+        positions = [(p.row, p.col) for p in room.players]
+        await journal.stop()
+        # 无效的回答也计入 moves 次询问，但有效的动作加上 2 条加入记录仍超过 compact_every，
+        # 日志至少改写过一次，只保留当前状态
+        assert len(moves) >= 3
+        with open(journal.path(room.id), encoding='utf-8') as fp:
+            assert len(fp.readlines()) == 1 + 2 + len(moves)
+        # 模拟进程退出：房间消失，但不删除日志
+        del GameRoom.instances[room.id]
+        GameRoom.registry.remove(room.id)
+
+        journal = ActionJournal(str(tmp_path))
+        monkeypatch.setattr(GameRoom, 'journal', journal)
+        restored, = GameRoom.restore(journal)
+        try:
+            assert restored.id == room.id
+            assert restored.moves == moves
+            assert (restored.game.wall_top, restored.game.wall_left) == walls
+            assert [(p.row, p.col) for p in restored.players] == positions
+            assert [p.symbol for p in restored.players] == [p.symbol for p in room.players]
+            assert set(restored.manager.users_players) == {'user0', 'user1'}
+            assert restored.task is not None
+        finally:
+            restored.task.cancel()
+            restored.destroy()
+            await journal.stop()
+        assert not (tmp_path / f'{room.id}.log').exists()
+
+    asyncio.run(main())
+
+
+def test_finished_games_are_archived(tmp_path, monkeypatch):
+    async def main():
+        archive = GameArchive(str(tmp_path / 'games.wgr'))
+        monkeypatch.setattr(GameRoom, 'archive', archive)
+        room = GameRoom(4, 'test', [[0, 0], [3, 3]])
+        try:
+            sockets = [RandomPlayer(room, f'user{i}', i) for i in range(2)]
+            for socket, player in zip(sockets, list(room.players)):
+                await room.register_player(socket.user, player, socket)
+            await asyncio.wait_for(sockets[0].restarted.wait(), 10)
+        finally:
+            room.task.cancel()
+            room.destroy()
+        await archive.close()
+
+    asyncio.run(main())
+    # 取消之前第二局可能也已结束
+    records = list(iter_archive(str(tmp_path / 'games.wgr'), use_mmap=False))
+    assert records
+    for record in records:
+        assert record.size == 4 and record.positions == ((0, 0), (3, 3))
+        assert len(record.moves) > 0
+        for backend in ('list', 'bitboard'):
+            assert replay(record, backend) == tuple(record.scores)
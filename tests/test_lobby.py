@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from game_room import GameRoom
+from lobby import LobbyBroadcaster, LobbyIndex
+from sharding import LocalRegistry
+
+
+def summary(room_id, name='room', open=True, users=(), created=0.0):
+    return {'id': room_id, 'name': name, 'open': open, 'users': list(users), 'seats': 2,
+            'status': 'waiting', 'created': created}
+
+
+def test_index_tracks_open_rooms_and_users():
+    index = LobbyIndex()
+    changes = []
+    index.listeners.append(lambda room_id, summary: changes.append((room_id, summary)))
+    index.publish('a', summary('a', users=['alice'], created=1))
+    index.publish('b', summary('b', users=['alice', 'bob'], created=2))
+    assert index.open_rooms == {'a', 'b'}
+    assert index.user_rooms == {'alice': {'a', 'b'}, 'bob': {'b'}}
+    # 房间满员后不再可加入
+    index.publish('b', summary('b', open=False, users=['alice', 'bob'], created=2))
+    assert index.open_rooms == {'a'}
+    assert [room['id'] for room in index.rooms_of('alice')] == ['b', 'a']
+    index.remove('b')
+    assert index.user_rooms == {'alice': {'a'}}
+    assert [room_id for room_id, _ in changes] == ['a', 'b', 'b', 'b']
+    assert changes[-1] == ('b', None)
+
+
+def test_index_pages_and_sorts():
+    index = LobbyIndex()
+    for number, name in enumerate('cadbe'):
+        index.publish(name, summary(name, name=name, created=number))
+    page = index.open_page(1, 2)
+    assert [room['id'] for room in page['rooms']] == ['e', 'b']
+    assert (page['page'], page['pages'], page['total']) == (1, 3, 5)
+    assert [room['id'] for room in index.open_page(3, 2)['rooms']] == ['c']
+    # 超出范围的页码取最近的一页
+    assert index.open_page(10, 2)['page'] == 3
+    assert [room['id'] for room in index.open_page(1, 5, 'name')['rooms']] == list('abcde')
+    assert [room['id'] for room in index.open_page(1, 5, 'oldest')['rooms']] == list('cadbe')
+    # 排序结果在变化后重新计算
+    index.remove('a')
+    assert [room['id'] for room in index.open_page(1, 5, 'name')['rooms']] == list('bcde')
+
+
+def test_index_version_and_etag():
+    index = LobbyIndex()
+    index.publish('a', summary('a'))
+    version, etag = index.version, index.etag(1, 20, 'newest', '')
+    # 内容相同的发布和同步不改变版本
+    index.publish('a', summary('a'))
+    index.sync({'a': summary('a')})
+    assert index.version == version and index.etag(1, 20, 'newest', '') == etag
+    assert index.etag(2, 20, 'newest', '') != etag
+    assert index.etag(1, 20, 'newest', 'alice') != etag
+    index.sync({'b': summary('b')})
+    assert set(index.rooms) == {'b'}
+    assert index.etag(1, 20, 'newest', '') != etag
+    # 重启后的进程不会产生相同的 ETag
+    other = LobbyIndex()
+    other.publish('a', summary('a'))
+    assert other.etag(1, 20, 'newest', '') != etag
+
+
+def test_broadcaster_merges_changes_and_resets_slow_subscribers():
+    registry = LocalRegistry()
+    broadcaster = LobbyBroadcaster(registry, queue_size=2)
+    queue = broadcaster.subscribe()
+    broadcaster.flush()
+    registry.publish('a', summary('a'))
+    registry.publish('a', summary('a', open=False))
+    registry.publish('b', summary('b'))
+    registry.remove('b')
+    broadcaster.flush()
+    # 同一房间只保留最后的状态
+    assert json.loads(queue.get_nowait())['changes'] == [{'type': 'filled', 'id': 'a'},
+                                                         {'type': 'closed', 'id': 'b'}]
+    for room_id in 'cde':
+        registry.publish(room_id, summary(room_id))
+        broadcaster.flush()
+    assert queue.qsize() == 1 and json.loads(queue.get_nowait()) == {'event': 'lobby_reset'}
+    assert broadcaster.resets == 1
+
+
+def test_lobby_json_etag(make_app):
+    async def main():
+        app = make_app()
+        async with TestClient(TestServer(app)) as client:
+            room = GameRoom(5, 'lobby', [[0, 0], [4, 4]])
+            resp = await client.get('/lobby.json')
+            assert resp.status == 200
+            listing = await resp.json()
+            assert [item['id'] for item in listing['rooms']] == [room.id]
+            assert listing['joined'] == []
+            etag = resp.headers['ETag']
+            resp = await client.get('/lobby.json', headers={'If-None-Match': etag})
+            assert resp.status == 304 and resp.headers['ETag'] == etag
+            # 其他分页参数的 ETag 不同
+            resp = await client.get('/lobby.json?per_page=5', headers={'If-None-Match': etag})
+            assert resp.status == 200
+            room.destroy()
+            resp = await client.get('/lobby.json', headers={'If-None-Match': etag})
+            assert resp.status == 200 and (await resp.json())['rooms'] == []
+            assert (await client.get('/lobby.json?sort=random')).status == 400
+            assert (await client.get('/lobby.json?page=x')).status == 400
+
+    asyncio.run(main())
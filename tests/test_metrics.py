@@ -0,0 +1,105 @@
+import re
+
+import pytest
+
+import app
+import core
+import crypto_executor
+import lobby
+import metrics
+import player_manager
+import storage
+from game_room import GameRoom
+from sharding import LocalRegistry
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+SUFFIXES = {'histogram': ('_bucket', '_sum', '_count'), 'counter': ('',), 'gauge': ('',)}
+
+
+def check_exposition(text: str):
+    """
+    检查 Prometheus 文本格式：每个样本都属于之前由 HELP 和 TYPE 声明的指标
+    """
+    assert text.endswith('\n')
+    helps = set()
+    types = {}
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            helps.add(line.split(' ')[2])
+        elif line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            assert kind in SUFFIXES
+            types[name] = kind
+        else:
+            match = SAMPLE.match(line)
+            assert match, line
+            name, _, value = match.groups()
+            float(value.replace('+Inf', 'inf'))
+            family = next((family for family, kind in types.items()
+                           if any(name == family + suffix for suffix in SUFFIXES[kind])), None)
+            assert family is not None, f'sample {name} has no TYPE'
+            assert family in helps, f'sample {name} has no HELP'
+
+
+def test_histogram_exposition():
+    registry = metrics.Registry()
+    histogram = registry.register(metrics.Histogram('test_seconds', 'Test', ['phase'], buckets=[0.1, 1]))
+    histogram.observe(0.05, ('a',))
+    histogram.observe(5, ('a',))
+    text = registry.render()
+    check_exposition(text)
+    assert 'test_seconds_bucket{phase="a",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{phase="a",le="+Inf"} 2' in text
+    assert 'test_seconds_count{phase="a"} 2' in text
+
+
+def test_room_metrics_exposition():
+    rooms = [GameRoom(5, 'test', [[0, 0], [4, 4]]) for _ in range(3)]
+    try:
+        for seconds, room in zip((0.25, 0.5, 0.125), rooms):
+            room.game.metrics_update_seconds = seconds
+        text = metrics.render() + '\n'.join(metrics._collect_rooms()) + '\n'
+        check_exposition(text)
+        assert 'wallgame_rooms{status="waiting"} 3' in text
+        assert 'wallgame_room_moves{status="waiting"} 0' in text
+        assert 'wallgame_room_update_areas_seconds_max 0.5' in text
+        # 房间数量不影响序列的数量
+        for room in rooms:
+            assert room.id not in text
+    finally:
+        for room in rooms:
+            room.destroy()
+
+
+@pytest.fixture
+def installed(monkeypatch):
+    """
+    调用 install，测试结束后恢复被替换的函数
+    """
+    owners = [(cls, 'update_areas') for cls in {core.WallGame, *core.BACKENDS.values()}
+              if 'update_areas' in vars(cls)]
+    owners += [(module, 'encode_frame') for module in (player_manager, lobby, app)]
+    owners += [(player_manager.PlayerManager, 'send_to'), (player_manager.PlayerManager, 'send_to_everyone'),
+               (storage.Storage, 'load_user'), (storage.Storage, 'save'),
+               (crypto_executor.CryptoExecutor, 'decrypt'),
+               (crypto_executor.CryptoExecutor, 'hash_password'),
+               (crypto_executor.CryptoExecutor, 'verify_password')]
+    for owner, attr in owners:
+        monkeypatch.setattr(owner, attr, vars(owner)[attr])
+    monkeypatch.setattr(metrics.REGISTRY, 'collectors', [])
+    monkeypatch.setattr(metrics, 'enabled', False)
+    metrics.install()
+
+
+def test_lobby_broadcast_is_timed(installed):
+    encode = metrics.PHASE_SECONDS.series(('encode',))
+    count = encode.count
+    broadcaster = lobby.LobbyBroadcaster(LocalRegistry())
+    queue = broadcaster.subscribe()
+    broadcaster.flush()
+    broadcaster.notify('room', None)
+    broadcaster.flush()
+    assert queue.qsize() == 1
+    assert encode.count == count + 1
+    for module in (player_manager, lobby, app):
+        assert module.encode_frame.__instrumented__
@@ -0,0 +1,69 @@
+import random
+from collections import deque
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from core import Player, WallGame
+from numpy_engine import Boards, distance_maps, label_areas, reachable_masks, scores
+
+
+def random_game(rng: random.Random, size: int, players: int) -> WallGame:
+    cells = rng.sample(range(size * size), players)
+    game = WallGame(size, [Player(str(i), *divmod(cell, size)) for i, cell in enumerate(cells)],
+                    backend=rng.choice(['list', 'bitboard']))
+    for _ in range(rng.randint(0, 2 * size * size)):
+        player = rng.choice(game.players)
+        actions = game.legal_actions(player)
+        if not actions:
+            continue
+        (row, col), direction = game.decode_action(rng.choice(actions))
+        game.apply_player_action(player, (row - player.row, col - player.col), direction)
+    game.update_areas()
+    return game
+
+
+def distances_from(game: WallGame, start):
+    distances = np.full((game.size, game.size), -1)
+    distances[start] = 0
+    queue = deque([start])
+    while queue:
+        row, col = queue.popleft()
+        for point in game.reachable_points_near(row, col):
+            if distances[point] < 0:
+                distances[point] = distances[row, col] + 1
+                queue.append(point)
+    return distances
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_matches_wall_game(seed):
+    rng = random.Random(seed)
+    size = rng.randint(2, 12)
+    players = rng.randint(2, min(4, size * size))
+    games = [random_game(rng, size, players) for _ in range(rng.randint(1, 5))]
+    boards = Boards.from_games(games)
+
+    areas, area_sizes = label_areas(boards.top, boards.left)
+    player_scores = scores(boards, (areas, area_sizes))
+    for b, game in enumerate(games):
+        assert areas[b].tolist() == game.map
+        assert area_sizes[b, :len(game.area_sizes)].tolist() == game.area_sizes
+        assert not area_sizes[b, len(game.area_sizes):].any()
+        assert player_scores[b].tolist() == [game.area_sizes[game.area_of(p.row, p.col)]
+                                             for p in game.players]
+
+    for index in range(players):
+        masks = reachable_masks(boards, index)
+        for b, game in enumerate(games):
+            expected = set(game.get_reachable_points(game.players[index]))
+            assert {(int(row), int(col)) for row, col in zip(*np.nonzero(masks[b]))} == expected
+
+    starts = [(rng.randrange(size), rng.randrange(size)) for _ in games]
+    sources = np.zeros(boards.top.shape, dtype=bool)
+    for b, start in enumerate(starts):
+        sources[b][start] = True
+    distances = distance_maps(boards.top, boards.left, sources)
+    for b, game in enumerate(games):
+        assert (distances[b] == distances_from(game, starts[b])).all()
@@ -0,0 +1,68 @@
+import asyncio
+import contextlib
+
+from aiohttp import ClientConnectionResetError
+
+from core import Player
+from player_manager import PlayerManager
+
+
+class FakeSocket:
+    def __init__(self, closed=False, error=None) -> None:
+        self.closed = closed
+        self.error = error
+        self.frames = []
+
+    async def send_json(self, data, dumps=None):
+        await self.send_str(dumps(data))
+
+    async def send_str(self, data):
+        if self.error is not None:
+            raise self.error
+        self.frames.append(data)
+
+
+def make_manager(sockets):
+    players = [Player(str(i), 0, i) for i in range(len(sockets))]
+    manager = PlayerManager(players)
+    for i, (player, ws) in enumerate(zip(players, sockets)):
+        manager.register_player(f'user{i}', player, ws)
+    return manager
+
+
+def test_send_to_everyone_skips_closed_socket():
+    alive = FakeSocket()
+    closed = FakeSocket(closed=True, error=RuntimeError('closed'))
+    manager = make_manager([closed, alive])
+    asyncio.run(manager.send_to_everyone({'event': 'game_start'}))
+    assert alive.frames == ['{"event":"game_start"}']
+
+
+def test_send_to_everyone_survives_closing_socket():
+    # 连接正在关闭时 closed 仍为假，发送会抛出异常
+    first, second = FakeSocket(), FakeSocket()
+    closing = FakeSocket(error=ClientConnectionResetError('Cannot write to closing transport'))
+    manager = make_manager([first, closing, second])
+    asyncio.run(manager.send_to_everyone({'event': 'game_start'}))
+    assert first.frames == second.frames == ['{"event":"game_start"}']
+
+
+def test_receive_from_each_keeps_unconsumed_messages():
+    async def main():
+        manager = make_manager([FakeSocket(), FakeSocket()])
+        for user in ('user0', 'user1'):
+            manager.users_queues[user].put_nowait({'from': user})
+        manager.users_queues['user1'].put_nowait({'from': 'user1', 'later': True})
+        # 两个 Queue.get 都已完成，只消费第一条就停止
+        async with contextlib.aclosing(manager.receive_from_each(['user0', 'user1'])) as messages:
+            async for user, message in messages:
+                break
+        other = 'user1' if user == 'user0' else 'user0'
+        remaining = []
+        while not manager.users_queues[other].empty():
+            remaining.append(manager.users_queues[other].get_nowait())
+        return other, remaining
+
+    other, remaining = asyncio.run(main())
+    expected = [{'from': other}] + ([{'from': 'user1', 'later': True}] if other == 'user1' else [])
+    assert remaining == expected
@@ -0,0 +1,46 @@
+import asyncio
+
+from room_log import ActionJournal
+
+
+def test_open_files_are_bounded(tmp_path):
+    async def main():
+        journal = ActionJournal(str(tmp_path), max_open_files=2)
+        for round in range(3):
+            for room in range(5):
+                journal.record(f'room{room}', {'t': 'move', 'p': room, 'round': round})
+            await journal.submit_pending()
+            assert len(journal._files) <= 2
+        await journal.stop()
+        assert not journal._files
+        assert journal.fsyncs == 15
+        loaded = dict(journal.load())
+        assert loaded == {}
+        for room in range(5):
+            with open(journal.path(f'room{room}'), encoding='utf-8') as fp:
+                assert fp.read() == ''.join(
+                    ActionJournal.encode({'t': 'move', 'p': room, 'round': round})
+                    for round in range(3))
+
+    asyncio.run(main())
+
+
+def test_compact_and_delete(tmp_path):
+    async def main():
+        journal = ActionJournal(str(tmp_path), compact_every=3)
+        header = {'t': 'room', 'id': 'a'}
+        for index in range(3):
+            journal.record('a', {'t': 'move', 'p': index})
+        assert journal.needs_compaction('a')
+        await journal.submit_pending()
+        journal.compact('a', [header, {'t': 'move', 'p': 2}])
+        assert not journal.needs_compaction('a')
+        journal.record('a', {'t': 'move', 'p': 3})
+        journal.record('b', {'t': 'room', 'id': 'b'})
+        await journal.submit_pending()
+        journal.delete('b')
+        await journal.stop()
+        assert list(ActionJournal(str(tmp_path)).load()) == [
+            ('a', [header, {'t': 'move', 'p': 2}, {'t': 'move', 'p': 3}])]
+
+    asyncio.run(main())
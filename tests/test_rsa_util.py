@@ -0,0 +1,45 @@
+import os
+import shutil
+
+import pytest
+
+import rsa_util
+from rsa_util import RsaUtil
+
+BACKENDS = ['cryptography', 'rsa']
+
+
+@pytest.mark.parametrize('decrypt_backend', BACKENDS)
+@pytest.mark.parametrize('encrypt_backend', BACKENDS)
+def test_backends_decrypt_each_other(key_files, encrypt_backend, decrypt_backend):
+    public_key, private_key = key_files
+    encrypter = RsaUtil(public_key, None, backend=encrypt_backend)
+    decrypter = RsaUtil(None, private_key, backend=decrypt_backend)
+    # 空的、一段以内的和需要分段的消息
+    for message in (b'', b'secret', os.urandom(300)):
+        assert bytes(decrypter.decrypt_by_private_key(encrypter.encrypt_by_public_key(message))) == message
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_keys_are_cached_per_file(key_files, tmp_path, monkeypatch, backend):
+    public_key = str(tmp_path / 'public_key.pem')
+    private_key = str(tmp_path / 'private_key.pem')
+    shutil.copy(key_files[0], public_key)
+    shutil.copy(key_files[1], private_key)
+    first = RsaUtil(public_key, private_key, backend=backend)
+    second = RsaUtil(public_key, private_key, backend=backend)
+    assert second.company_public_key is first.company_public_key
+    assert second.company_private_key is first.company_private_key
+    # 相对路径与绝对路径共用缓存
+    monkeypatch.chdir(tmp_path)
+    relative = RsaUtil('public_key.pem', None, backend=backend)
+    assert relative.company_public_key is first.company_public_key
+    # 文件被替换后重新读取
+    stat = os.stat(private_key)
+    os.utime(private_key, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert RsaUtil(None, private_key, backend=backend).company_private_key is not first.company_private_key
+
+
+def test_default_backend():
+    expected = 'cryptography' if rsa_util.padding is not None else 'rsa'
+    assert RsaUtil(None, None).backend == expected
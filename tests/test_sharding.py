@@ -0,0 +1,73 @@
+import asyncio
+import contextlib
+import json
+
+from yarl import URL
+
+from benchmarks.harness import Client, prepare_workdir, serve
+from sharding import SharedRegistry, ShardRouter, shard_for
+
+
+def test_router_with_two_shards(tmp_path, room_state):
+    async def main():
+        from app import WallGameApp
+        from rsa_util import RsaUtil
+
+        workdir = prepare_workdir(tmp_path)
+        # 进程内的两个分片共用一个普通的 dict，代替 multiprocessing.Manager 的 dict
+        registry = SharedRegistry({}, refresh_interval=0)
+        # (处理请求的分片, 路径)
+        handled = []
+
+        def worker_factory(shard):
+            async def record(request, response):
+                handled.append((shard, request.path))
+
+            def factory():
+                app = WallGameApp(shard=shard, shards=2, registry=registry)
+                app.on_response_prepare.append(record)
+                return app
+            return factory
+
+        async with contextlib.AsyncExitStack() as stack:
+            workers = []
+            for shard in range(2):
+                base_url, _ = await stack.enter_async_context(serve(workdir, worker_factory(shard)))
+                workers.append(URL(base_url))
+            base_url, _ = await stack.enter_async_context(
+                serve(workdir, lambda: ShardRouter(workers)))
+
+            rsa_util = RsaUtil(company_pri_file=None)
+            clients = [Client(base_url, f'user{i}', f'U{i}', rsa_util) for i in range(2)]
+            for client in clients:
+                stack.push_async_callback(client.close)
+                await client.register()
+                # 会话 cookie 由各分片共用的密钥加密，登录后可以访问任一分片
+                assert await client.login() == 302
+
+            rooms = [await clients[0].new_room(5, [[0, 0], [4, 4]]) for _ in range(4)]
+            room_ids = [room.strip('/') for room in rooms]
+            # /new/ 轮流转发给两个分片，每个分片创建属于自己的房间
+            assert sorted(shard_for(room_id, 2) for room_id in room_ids) == [0, 0, 1, 1]
+
+            async with clients[1].session.get(base_url + '/lobby.json') as resp:
+                assert resp.status == 200
+                lobby = json.loads(await resp.read())
+            assert {room['id'] for room in lobby['rooms']} == set(room_ids)
+
+            async with clients[1].session.get(base_url + rooms[1]) as resp:
+                assert resp.status == 200
+
+            # 通过转发的 WebSocket 下完一局
+            await asyncio.wait_for(asyncio.gather(*[client.play(rooms[1], games=1)
+                                                    for client in clients]), 30)
+            assert [client.games for client in clients] == [1, 1]
+            assert all(client.moves for client in clients)
+
+        room_requests = [(shard, path) for shard, path in handled
+                         if path.strip('/').split('/')[0] in room_ids]
+        assert any(path.endswith('/ws/') for _, path in room_requests)
+        for shard, path in room_requests:
+            assert shard == shard_for(path.strip('/').split('/')[0], 2)
+
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+import json
+import sys
+
+import pytest
+
+import simulate
+from game_record import iter_archive, replay
+
+
+def test_same_seed_gives_same_games():
+    first = list(simulate.simulate(20, size=5, positions=3, policies=('random', 'greedy'),
+                                   seed=7, workers=1, batch_size=6))
+    second = list(simulate.simulate(20, size=5, positions=3, policies=('random', 'greedy'),
+                                    seed=7, workers=1, batch_size=4))
+    assert first == second
+    assert [result.index for result in first] == list(range(20))
+    other = list(simulate.simulate(20, size=5, positions=3, seed=8, workers=1))
+    assert [result.actions for result in other] != [result.actions for result in first]
+
+
+def test_worker_count_does_not_change_results():
+    serial = list(simulate.simulate(12, size=4, positions=2, seed=3, workers=1, batch_size=5))
+    parallel = list(simulate.simulate(12, size=4, positions=2, seed=3, workers=2, batch_size=5))
+    assert serial == parallel
+
+
+@pytest.mark.parametrize('backend', ['list', 'bitboard'])
+def test_results_replay_to_their_scores(backend):
+    for result in simulate.simulate(10, size=6, positions=2, policies=('greedy', 'random'),
+                                    seed=1, workers=1, backend=backend):
+        assert result.moves == len(result.actions)
+        assert replay(result.record(6), backend) == result.scores
+
+
+def test_main_streams_results_into_archive(tmp_path, monkeypatch, capsys):
+    archive = tmp_path / 'games.wgr'
+    monkeypatch.setattr(sys, 'argv', ['simulate.py', '--games', '15', '--size', '5',
+                                      '--seed', '2', '--workers', '1',
+                                      '--archive', str(archive)])
+    simulate.main()
+    summary = json.loads(capsys.readouterr().out)
+    assert summary['games'] == 15
+    expected = list(simulate.simulate(15, size=5, seed=2, workers=1))
+    records = [(record.positions, tuple(record.scores), bytes(record.moves))
+               for record in iter_archive(str(archive), use_mmap=False)]
+    assert records == [(result.positions, result.scores, result.actions) for result in expected]
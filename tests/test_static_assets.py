@@ -0,0 +1,39 @@
+import asyncio
+import hashlib
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from static_assets import LONG_CACHE, StaticAssets
+
+
+def test_urls_carry_content_hash(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'base.css').write_bytes(b'body {}')
+    assets = StaticAssets(str(tmp_path))
+    digest = hashlib.sha256(b'body {}').hexdigest()[:12]
+    assert assets.url('css/base.css') == f'/static/css/base.css?v={digest}'
+    assert assets.url('missing.js') == '/static/missing.js'
+    # 哈希只计算一次，修改文件后需要重启
+    (tmp_path / 'css' / 'base.css').write_bytes(b'body { color: red }')
+    assert assets.url('css/base.css') == f'/static/css/base.css?v={digest}'
+
+
+def test_fingerprinted_responses_are_immutable(tmp_path):
+    (tmp_path / 'app.js').write_bytes(b'var a;')
+    assets = StaticAssets(str(tmp_path))
+    app = web.Application()
+    app.add_routes([web.static('/static/', str(tmp_path))])
+    app.on_response_prepare.append(assets.on_response_prepare)
+
+    async def main():
+        url = assets.url('app.js')
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get(url)
+            assert resp.status == 200 and resp.headers['Cache-Control'] == LONG_CACHE
+            # 旧的哈希或没有哈希时仍按普通的静态文件处理
+            for other in ('/static/app.js?v=000000000000', '/static/app.js'):
+                resp = await client.get(other)
+                assert resp.status == 200 and resp.headers.get('Cache-Control') != LONG_CACHE
+
+    asyncio.run(main())
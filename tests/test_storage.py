@@ -0,0 +1,196 @@
+import asyncio
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from conftest import ROOT
+from storage import AsyncStorage, Storage, User, UserCache, UserValidationError
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / 'db.sqlite3')
+    with open(os.path.join(ROOT, 'create_table.sql')) as fp, sqlite3.connect(path) as conn:
+        conn.executescript(fp.read())
+    return path
+
+
+def make_user(name='alice', raw_password='secret'):
+    # sha256 计算很快，测试中不需要 scrypt
+    user = User(name, 'A', password='sha256:salt:AA==')
+    user.set_password(raw_password, 'sha256')
+    return user
+
+
+class InterleavedConnection:
+    """
+    包装 sqlite3 连接：SELECT 读到结果之后、返回之前执行 between，
+    模拟另一个线程在读取和放入缓存之间提交修改
+    """
+
+    def __init__(self, conn, between) -> None:
+        self.conn = conn
+        self.between = between
+
+    def execute(self, sql, *args):
+        cursor = self.conn.execute(sql, *args)
+        if sql.startswith('SELECT'):
+            rows = cursor.fetchall()
+            self.between()
+            return FixedCursor(rows)
+        return cursor
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class FixedCursor:
+    def __init__(self, rows) -> None:
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_stale_read_is_not_cached(db):
+    cache = UserCache()
+    writer = Storage(db, cache=cache)
+    reader = Storage(db, cache=cache)
+    writer.new_user(make_user(raw_password='old-password'))
+    writer.save()
+
+    def change_password():
+        user = writer.load_user('alice')
+        user.set_password('new-password', 'sha256')
+        writer.update_user(user)
+        writer.save()
+
+    reader.conn = InterleavedConnection(reader.conn, change_password)
+    stale = reader.load_user('alice')
+    reader.conn = reader.conn.conn
+    assert stale.verify_password('old-password')
+    # 读到的旧记录没有进入缓存，下一次读取得到新密码
+    assert cache.get('alice') is None
+    assert reader.get_user('alice').verify_password('new-password')
+    assert cache.get('alice').verify_password('new-password')
+    writer.close()
+    reader.close()
+
+
+def test_put_with_generation():
+    cache = UserCache()
+    user = make_user()
+    generation = cache.generation('alice')
+    cache.invalidate('alice')
+    cache.put(user, generation)
+    assert cache.get('alice') is None
+    cache.put(user, cache.generation('alice'))
+    assert cache.get('alice') == user
+    # 其他用户的修改不影响
+    generation = cache.generation('alice')
+    cache.invalidate('bob')
+    cache.invalidate('alice')
+    cache.put(user, generation)
+    assert cache.get('alice') is None
+
+
+def test_generations_are_bounded():
+    cache = UserCache(maxsize=4)
+    user = make_user('user0')
+    generation = cache.generation('user0')
+    for index in range(1, 10):
+        cache.invalidate(f'user{index}')
+        assert len(cache._generations) <= 4
+    # 清空版本记录后，此前取得的版本全部作废
+    cache.put(user, generation)
+    assert cache.get('user0') is None
+    generation = cache.generation('user0')
+    cache.clear()
+    cache.put(user, generation)
+    assert cache.get('user0') is None
+
+
+def test_lru_ttl_and_copies(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('storage.time.monotonic', lambda: now[0])
+    cache = UserCache(maxsize=2, ttl=10)
+    users = [make_user(f'user{index}') for index in range(3)]
+    cache.put(users[0])
+    cache.put(users[1])
+    assert cache.get('user0') == users[0]
+    cache.put(users[2])
+    # user1 最久未使用，被淘汰
+    assert cache.get('user1') is None
+    assert cache.stats()['evictions'] == 1
+    copy = cache.get('user0')
+    copy.symbol = 'Z'
+    assert cache.get('user0').symbol == 'A'
+    now[0] = 11
+    assert cache.get('user0') is None
+
+
+def test_async_storage(db):
+    async def main():
+        storage = AsyncStorage(db, readers=2, commit_delay=0.05)
+        try:
+            await storage.new_user(make_user())
+            with pytest.raises(UserValidationError):
+                await storage.new_user(make_user())
+            with pytest.raises(UserValidationError):
+                await storage.get_user('nobody')
+            # 写操作在写线程中提交后，读线程的连接可以读到
+            assert (await storage.get_user('alice')).verify_password('secret')
+            user = await storage.get_user('alice')
+            user.set_password('changed', 'sha256')
+            await storage.update_user(user)
+            assert (await storage.get_user('alice')).verify_password('changed')
+            # 插入失败时不提交
+            assert storage.commits == 2
+        finally:
+            await storage.close()
+        # 数据在关闭前已经提交
+        reader = Storage(db)
+        assert reader.get_user('alice').verify_password('changed')
+        reader.close()
+
+    asyncio.run(main())
+
+
+def test_async_storage_batches_commits(db):
+    async def main():
+        storage = AsyncStorage(db, commit_delay=0.05)
+        try:
+            await asyncio.gather(*[storage.new_user(make_user(f'user{index}')) for index in range(5)])
+            assert storage.commits == 1
+            assert [(await storage.get_user(f'user{index}')).name for index in range(5)] == \
+                   [f'user{index}' for index in range(5)]
+        finally:
+            await storage.close()
+
+    asyncio.run(main())
+
+
+def test_async_storage_reads_off_the_event_loop(db, monkeypatch):
+    threads = []
+    load_user = Storage.load_user
+
+    def record(self, name):
+        threads.append(threading.current_thread().name)
+        return load_user(self, name)
+
+    monkeypatch.setattr(Storage, 'load_user', record)
+
+    async def main():
+        storage = AsyncStorage(db)
+        try:
+            await storage.new_user(make_user())
+            await storage.get_user('alice')
+            # 命中缓存时不再查询
+            await storage.get_user('alice')
+        finally:
+            await storage.close()
+
+    asyncio.run(main())
+    assert len(threads) == 1 and threads[0].startswith('storage-reader')